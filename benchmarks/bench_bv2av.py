@@ -0,0 +1,37 @@
+import time
+
+import numpy as np
+
+from easier_spider.bilivideo import BV2AV
+
+
+def benchmark_bv2av(n=1_000_000, seed=0):
+    """
+    对比逐个转换和批量转换的速度。两者结果一致由tests/test_bv2av.py保证
+    [使用方法]:
+        python -m benchmarks.bench_bv2av
+    :param n: 测试的id数
+    :return: {"av2bv": (逐个每秒个数, 批量每秒个数), "bv2av": (逐个每秒个数, 批量每秒个数)}
+    """
+    converter = BV2AV()
+    aids = np.random.default_rng(seed).integers(1, converter.MAX_AID, size=n, dtype=np.int64)
+
+    t0 = time.perf_counter()
+    bvids_scalar = [converter.av2bv(int(aid)) for aid in aids]
+    t1 = time.perf_counter()
+    bvids_many = converter.av2bv_many(aids)
+    t2 = time.perf_counter()
+    for bvid in bvids_scalar:
+        converter.bv2av(bvid)
+    t3 = time.perf_counter()
+    converter.bv2av_many(bvids_many)
+    t4 = time.perf_counter()
+
+    results = {"av2bv": (n / (t1 - t0), n / (t2 - t1)), "bv2av": (n / (t3 - t2), n / (t4 - t3))}
+    for name, (scalar, many) in results.items():
+        print(f"{name}: 逐个{scalar / 1e6:.2f}M个/秒，批量{many / 1e6:.2f}M个/秒，快{many / scalar:.1f}倍")
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_bv2av()
@@ -0,0 +1,78 @@
+import json
+import os
+import random
+import re
+import time
+
+from easier_spider.bilivideo import extract_video_data
+
+
+def _extract_video_data_regex(rtext):
+    """[子函数]旧的提取方法：正则匹配整个__INITIAL_STATE__后全部json.loads，只用于benchmark对比"""
+    video_data, pubdate = None, None
+    base_data_match = re.search(r'window\.__INITIAL_STATE__=(.*?);\(function\(\)', rtext)
+    if base_data_match:
+        video_data = json.loads(base_data_match.group(1))["videoData"]
+    time_data_match = re.search(r'<div class="pubdate-ip-text"[^>]*>(.*?)\s*</div>', rtext)
+    if time_data_match:
+        pubdate = time_data_match.group(1)
+    return video_data, pubdate
+
+
+def _make_fixture_html(n_related=400, seed=0):
+    """[子函数]生成一个结构和B站视频页相近的网页，没有保存下来的网页时给benchmark用"""
+    rng = random.Random(seed)
+
+    def fake_video(i):
+        return {"aid": rng.randint(1, 1 << 40), "bvid": f"BV1{i:09d}", "title": "标题" * 10, "pic": "//i0.hdslb.com/x.jpg",
+                "desc": "简介" * 50, "owner": {"mid": i, "name": "up主", "face": "//i0.hdslb.com/face.jpg"},
+                "stat": {"aid": i, "view": rng.randint(0, 1 << 20), "danmaku": 1, "reply": 2, "favorite": 3,
+                         "coin": 4, "share": 5, "like": 6}}
+    state = {"aid": 1, "bvid": "BV1000000000", "p": 1, "videoData": fake_video(0),
+             "related": [fake_video(i) for i in range(n_related)],
+             "upData": {"card": {"sign": "签名" * 100}}}
+    filler = "".join(f'<div class="item" data-v-{i:x}="">{"文字" * 20}</div>\n' for i in range(2000))
+    return ('<!DOCTYPE html><html><head><title>视频</title></head><body>' + filler +
+            '<div class="pubdate-ip-text" data-v-1="">2024-05-01 12:00:00</div>\n' + filler +
+            '<script>window.__INITIAL_STATE__=' + json.dumps(state, ensure_ascii=False) +
+            ';(function(){var s;(s=document.currentScript||document.scripts[document.scripts.length-1]).parentNode'
+            '.removeChild(s);}());</script></body></html>')
+
+
+def benchmark_extract(html_dir=None, repeat=20):
+    """
+    对比extract_video_data和旧的整页正则+json.loads的速度
+    [使用方法]:
+        python -m benchmarks.bench_extract
+        benchmark_extract("output/html/")  # 用get_html(html_path=...)保存下来的网页
+        benchmark_extract()  # 不指定时用生成的网页
+    :param html_dir: 网页目录，里面的*.html都会参与测试
+    :param repeat: 重复次数
+    :return: {"old": 每页秒数, "new": 每页秒数}
+    """
+    if html_dir is not None:
+        pages = []
+        for name in sorted(os.listdir(html_dir)):
+            if name.endswith(".html"):
+                with open(os.path.join(html_dir, name), 'r', encoding='utf-8') as f:
+                    pages.append(f.read())
+    else:
+        pages = [_make_fixture_html(seed=i) for i in range(5)]
+    for page in pages:
+        assert extract_video_data(page) == _extract_video_data_regex(page), "新旧方法结果不一致"
+
+    results = {}
+    for name, func in (("old", _extract_video_data_regex), ("new", extract_video_data)):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                func(page)
+        results[name] = (time.perf_counter() - t0) / (repeat * len(pages))
+    size_kb = sum(len(page.encode("utf-8")) for page in pages) / len(pages) / 1024
+    print(f"{len(pages)}个网页，平均{size_kb:.0f}KB: 旧方法{results['old'] * 1000:.2f}ms/页，"
+          f"新方法{results['new'] * 1000:.2f}ms/页，快{results['old'] / results['new']:.1f}倍")
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_extract()
@@ -0,0 +1,45 @@
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from benchmarks.range_server import RangeHTTPRequestHandler
+from easier_tools.easy_download import segmented_download
+
+
+def benchmark_segmented_download(size_mb=64, per_conn_mb=16, segment_counts=(1, 2, 4, 8), out_dir="."):
+    """
+    在本地支持Range的服务器上测试分段下载的速度
+    [使用方法]:
+        python -m benchmarks.bench_segmented_download
+    :param size_mb: 测试文件大小(MB)
+    :param per_conn_mb: 每条连接的限速(MB/s)，模拟CDN的单连接限速
+    :param segment_counts: 要测试的分段数
+    :param out_dir: 临时文件目录
+    :return: {分段数: MB/s}
+    """
+    RangeHTTPRequestHandler.data = os.urandom(size_mb << 20)
+    RangeHTTPRequestHandler.per_conn_speed = per_conn_mb << 20
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHTTPRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/bench.bin"
+    path = os.path.join(out_dir, "bench_segmented.bin")
+
+    results = {}
+    try:
+        for segments in segment_counts:
+            t0 = time.perf_counter()
+            segmented_download(url, path, segments=segments)
+            cost = time.perf_counter() - t0
+            results[segments] = size_mb / cost
+            print(f"segments={segments}: {results[segments]:.1f} MB/s ({cost:.2f}s)")
+    finally:
+        server.shutdown()
+        if os.path.exists(path):
+            os.remove(path)
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_segmented_download()
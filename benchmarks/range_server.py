@@ -0,0 +1,51 @@
+import re
+import time
+from http.server import BaseHTTPRequestHandler
+
+
+class RangeHTTPRequestHandler(BaseHTTPRequestHandler):
+    """
+    [功能] 本地测试用的HTTP服务，支持Range，可以限制每条连接的速度来模拟CDN的单连接限速
+    [使用示例]
+        RangeHTTPRequestHandler.data = os.urandom(64 << 20)
+        RangeHTTPRequestHandler.per_conn_speed = 8 << 20  # 每条连接8MB/s
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHTTPRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    """
+    protocol_version = "HTTP/1.1"
+    data = b""
+    per_conn_speed = None  # 每条连接每秒最多发送的字节数，None为不限速
+    support_range = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        total = len(self.data)
+        start, end = 0, total - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if self.support_range and match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes" if self.support_range else "none")
+        self.end_headers()
+
+        block = 64 << 10
+        t0 = time.perf_counter()
+        sent = 0
+        for offset in range(start, end + 1, block):
+            piece = self.data[offset:min(offset + block, end + 1)]
+            try:
+                self.wfile.write(piece)
+            except (BrokenPipeError, ConnectionResetError):  # 客户端提前断开，比如探测Range时
+                return
+            sent += len(piece)
+            if self.per_conn_speed:
+                ahead = sent / self.per_conn_speed - (time.perf_counter() - t0)
+                if ahead > 0:
+                    time.sleep(ahead)
@@ -2,15 +2,143 @@ import re
 import json
 import time
 import pandas as pd
-import requests
 import os
 from PIL import Image
 from io import BytesIO
 import random
+import math
+import bisect
+import threading
+import sqlite3
+from collections import deque, OrderedDict
+from array import array
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import Pool
 
 from easier_spider.config import useragent
 from easier_spider.config import bilicookies as cookies
 from easier_tools.Colorful_Console import ColoredText as CT
+from easier_tools.easy_session import EasySession
+from easier_tools.rate_limiter import TokenBucket, AdaptiveRateLimiter
+from easier_tools.ttl_cache import TTLCache
+from easier_tools.page_store import DirPageStore
+from easier_tools.result_sink import SegmentSink
+from easier_tools.easy_download import segmented_download, print_progress
+from easier_tools.av_mux import ffmpeg_mux
+from easier_tools.timer import profiler
+
+
+_bili_session = None
+_bili_session_lock = threading.Lock()
+# 接口和网页按host限速，被412风控或返回的不是json时自动降速，CDN(下载视频)不限速
+bili_limiter = AdaptiveRateLimiter(host_rates={"api.bilibili.com": 2, "www.bilibili.com": 1}, cooldown=60)
+
+
+def get_bili_session():
+    """
+    获取本模块所有类共用的会话。默认请求头(User-Agent与Cookie)只构建一次，请求api.bilibili.com等host时复用keep-alive连接，
+    并且所有请求都经过bili_limiter限速
+    [使用方法]:
+        session = get_bili_session()
+        print(session.pool_stats())  # 查看连接复用情况
+    """
+    global _bili_session
+    with _bili_session_lock:
+        if _bili_session is None:
+            _bili_session = EasySession(headers={
+                "User-Agent": useragent().pcChrome,
+                "Cookie": cookies().bilicookie,
+            }, pool_maxsize=16, limiter=bili_limiter)
+    return _bili_session
+
+
+# playurl返回的下载地址带有deadline参数，大约两小时后过期，所以缓存时间要比它短
+PLAYURL_TTL = 100 * 60
+PLAYURL_TTL_MARGIN = 5 * 60
+playurl_cache = TTLCache(maxsize=1024, ttl=PLAYURL_TTL)
+
+
+def set_playurl_cache(cache):
+    """
+    替换所有biliVideo共用的playurl缓存，比如需要磁盘备份让重启后的进程也能用时
+    [使用方法]:
+        set_playurl_cache(TTLCache(maxsize=4096, ttl=PLAYURL_TTL, disk_path="output/playurl.sqlite"))
+        print(bilivideo.playurl_cache.stats())  # 命中统计
+    :param cache: TTLCache
+    """
+    global playurl_cache
+    playurl_cache = cache
+
+
+pagelist_cache = TTLCache(maxsize=65536, ttl=24 * 60 * 60)  # 分P列表基本不会变
+
+
+def get_pagelist(bv, session=None):
+    """
+    获取视频的分P列表(带缓存)
+    [使用方法]:
+        pages = get_pagelist("BV18x4y187DE")
+        cids = [page["cid"] for page in pages]
+    :param bv: bv号
+    :param session: 共享会话，不指定则使用get_bili_session()
+    :return: list，每个元素是一个分P的信息，包含cid、page、part、duration等
+    """
+    pages = pagelist_cache.get(bv)
+    if pages is None:
+        if session is None:
+            session = get_bili_session()
+        # 请求https://api.bilibili.com/x/player/pagelist，参数是bv号，返回的是所有分P的cid
+        r = session.get(url="https://api.bilibili.com/x/player/pagelist", params={"bvid": bv},
+                        headers={'referer': f"https://www.bilibili.com/video/{bv}"})
+        r_json = _json(r, session)
+        if r_json["code"] != 0:
+            raise ValueError(f"获取{bv}的分P列表失败，错误信息{r_json}")
+        pages = r_json["data"]
+        pagelist_cache.set(bv, pages)
+    return pages
+
+
+def _playurl_ttl(down_video_json):
+    """根据下载地址里的deadline参数算出缓存时间，取不到deadline时用PLAYURL_TTL"""
+    data = down_video_json["data"]
+    if data.get("dash"):
+        url = data["dash"]["video"][0]["baseUrl"]
+    elif data.get("durl"):
+        url = data["durl"][0]["url"]
+    else:
+        return PLAYURL_TTL
+    match = re.search(r"[?&]deadline=(\d+)", url)
+    if match is None:
+        return PLAYURL_TTL
+    return max(0, min(PLAYURL_TTL, int(match.group(1)) - time.time() - PLAYURL_TTL_MARGIN))
+
+
+def _json(r, session):
+    """
+    [子函数]解析返回的json。解析失败一般是被风控返回了网页，这时通知会话的限速器降速
+    :param r: requests.Response
+    :param session: 发请求的会话
+    """
+    try:
+        return r.json()
+    except ValueError:
+        limiter = getattr(session, "limiter", None)
+        if limiter is not None:
+            limiter.on_throttle(r.url)
+        raise
+
+
+def set_bili_session(session):
+    """
+    替换本模块默认使用的会话，比如需要自定义连接池大小，或者指向本地的测试服务器时
+    [使用方法]:
+        set_bili_session(EasySession(headers={...}, pool_maxsize=32))
+    :param session: EasySession或requests.Session
+    """
+    global _bili_session
+    with _bili_session_lock:
+        _bili_session = session
 
 
 # BV号和AV号的转换
@@ -29,6 +157,12 @@ class BV2AV:
         self.PREFIX_LEN = len(self.PREFIX)
         self.CODE_LEN = len(self.ENCODE_MAP)
 
+        # 查表用：字符->数值，以及批量转换用的numpy表(不在字母表里的字节为-1)
+        self.DECODE_TABLE = {c: i for i, c in enumerate(self.ALPHABET)}
+        self.ALPHABET_BYTES = np.frombuffer(self.ALPHABET.encode("ascii"), dtype=np.uint8)
+        self.DECODE_LUT = np.full(256, -1, dtype=np.int64)
+        self.DECODE_LUT[self.ALPHABET_BYTES] = np.arange(self.BASE)
+
     def av2bv(self, aid: int) -> str:
         """
         [使用方法]:
@@ -36,12 +170,12 @@ class BV2AV:
         :param aid: av号
         :return: bv号
         """
-        self.bvid = [""] * 9
+        bvid = [""] * 9
         tmp = (self.MAX_AID | aid) ^ self.XOR_CODE
         for i in range(self.CODE_LEN):
-            self.bvid[self.ENCODE_MAP[i]] = self.ALPHABET[tmp % self.BASE]
+            bvid[self.ENCODE_MAP[i]] = self.ALPHABET[tmp % self.BASE]
             tmp //= self.BASE
-        return self.PREFIX + "".join(self.bvid)
+        return self.PREFIX + "".join(bvid)
 
     def bv2av(self, bvid: str) -> int:
         """
@@ -54,10 +188,81 @@ class BV2AV:
         bvid = bvid[3:]
         tmp = 0
         for i in range(self.CODE_LEN):
-            idx = self.ALPHABET.index(bvid[self.DECODE_MAP[i]])
+            idx = self.DECODE_TABLE[bvid[self.DECODE_MAP[i]]]
             tmp = tmp * self.BASE + idx
         return (tmp & self.MASK_CODE) ^ self.XOR_CODE
 
+    def av2bv_many(self, aids):
+        """
+        批量av号转bv号，用numpy一次算完所有的base58
+        [使用方法]:
+            BV2AV().av2bv_many([111298867365120, 170001])  # 返回array(['BV1L9Uoa9EUx', 'BV17x411w7KC'])
+        :param aids: av号的list或numpy数组，可以是多维的
+        :return: 和aids形状相同的numpy字符串数组
+        """
+        aids = np.asarray(aids)
+        if aids.size == 0:
+            return np.empty(aids.shape, dtype="U12")
+        if not np.issubdtype(aids.dtype, np.integer):
+            raise ValueError(f"av号必须是整数，得到的类型是{aids.dtype}")
+        shape = aids.shape
+        aids = aids.astype(np.int64).ravel()
+        bad = np.flatnonzero((aids <= 0) | (aids >= self.MAX_AID))
+        if bad.size:
+            raise ValueError(f"第{_indices(bad, shape)}个av号超出范围(0, 2^51)，比如{aids[bad[0]]}")
+        tmp = (aids | self.MAX_AID) ^ self.XOR_CODE
+        out = np.empty((aids.size, self.PREFIX_LEN + self.CODE_LEN), dtype=np.uint8)
+        out[:, :self.PREFIX_LEN] = np.frombuffer(self.PREFIX.encode("ascii"), dtype=np.uint8)
+        for i in range(self.CODE_LEN):
+            out[:, self.PREFIX_LEN + self.ENCODE_MAP[i]] = self.ALPHABET_BYTES[tmp % self.BASE]
+            tmp //= self.BASE
+        return out.view(f"S{out.shape[1]}").astype("U12").reshape(shape)
+
+    def bv2av_many(self, bvids):
+        """
+        批量bv号转av号，用查表代替ALPHABET.index，用numpy一次算完所有的base58
+        [使用方法]:
+            BV2AV().bv2av_many(["BV1L9Uoa9EUx", "BV17x411w7KC"])  # 返回array([111298867365120, 170001])
+        :param bvids: bv号的list或numpy数组，可以是多维的
+        :return: 和bvids形状相同的numpy int64数组
+        """
+        bvids = np.asarray(bvids)
+        if bvids.size == 0:
+            return np.empty(bvids.shape, dtype=np.int64)
+        if bvids.dtype.kind not in "US":
+            raise ValueError(f"bv号必须是字符串，得到的类型是{bvids.dtype}")
+        shape = bvids.shape
+        flat = bvids.ravel()
+        length = self.PREFIX_LEN + self.CODE_LEN
+        lengths = np.char.str_len(flat)
+        if flat.dtype.kind == "U":
+            # 按UCS4码点取字符，非ASCII字符换成0(不在字母表里)，和其他格式不对的一起报错，不会在编码时抛UnicodeEncodeError
+            points = flat.astype(f"U{length}").view(np.uint32).reshape(-1, length)
+            codes = np.where(points < 128, points, 0).astype(np.uint8)
+        else:
+            codes = np.frombuffer(flat.astype(f"S{length}").tobytes(), dtype=np.uint8).reshape(-1, length)
+        bad = (lengths != length) | np.any(codes[:, :self.PREFIX_LEN] !=
+                                           np.frombuffer(self.PREFIX.encode("ascii"), dtype=np.uint8), axis=1)
+        digits = self.DECODE_LUT[codes[:, self.PREFIX_LEN:]]
+        bad |= np.any(digits < 0, axis=1)
+        bad = np.flatnonzero(bad)
+        if bad.size:
+            raise ValueError(f"第{_indices(bad, shape)}个bv号格式不对，比如{str(flat[bad[0]])!r}")
+        tmp = np.zeros(codes.shape[0], dtype=np.int64)
+        for i in range(self.CODE_LEN):
+            tmp = tmp * self.BASE + digits[:, self.DECODE_MAP[i]]
+        return ((tmp & self.MASK_CODE) ^ self.XOR_CODE).reshape(shape)
+
+
+def _indices(flat_indices, shape, limit=5):
+    """[子函数]把ravel后的下标换回原数组的下标，一维时是整数，多维时是元组，最多取limit个"""
+    if len(shape) <= 1:
+        return flat_indices[:limit].tolist()
+    return [tuple(int(i) for i in np.unravel_index(index, shape)) for index in flat_indices[:limit]]
+
+
+_bv2av = BV2AV()  # 共用的转换器，不用每个对象都建一次查找表
+
 
 # 获取鉴权参数
 class AuthUtil:
@@ -94,11 +299,13 @@ class AuthUtil:
 
 # 获取b站登录状态(目前该功能只做了获取登录状态, todo:应该将biliLoginState与biliQRLogin合并)
 class biliLoginState:
-    def __init__(self, headers):
+    def __init__(self, headers=None, session=None):
         """
-        :param headers: 比如headers={"Cookie": cookies().bilicookie, "User-Agent": useragent().pcChrome}
+        :param headers: 额外的请求头，比如headers={"referer": "https://www.bilibili.com/"}。User-Agent与Cookie已经在session里了
+        :param session: 共享会话，不指定则使用get_bili_session()
         """
         self.headers = headers
+        self.session = session if session is not None else get_bili_session()
         self.url = 'https://api.bilibili.com/x/web-interface/nav'
 
     def get_login_state(self):
@@ -109,8 +316,8 @@ class biliLoginState:
         :return:
         """
         # get请求https://api.bilibili.com/x/web-interface/nav，参数是cookie，返回的是用户的信息
-        r = requests.get(url=self.url, headers=self.headers)
-        login_msg = r.json()
+        r = self.session.get(url=self.url, headers=self.headers)
+        login_msg = _json(r, self.session)
         print("登录状态：", login_msg["data"]["isLogin"])
 
 
@@ -134,19 +341,23 @@ class biliQRLogin:
                     print("二维码失效")
                     break
     """
-    def __init__(self):
-        self.headers = {"User-Agent": useragent().pcChrome}
+    def __init__(self, session=None):
+        """
+        :param session: 共享会话，不指定则使用get_bili_session()
+        """
+        self.headers = {"Cookie": None}  # 扫码登录不带cookie
+        self.session = session if session is not None else get_bili_session()
         self.url = 'https://passport.bilibili.com/x/passport-login/web/qrcode/generate'
 
     def require(self):
-        r = requests.get(self.url, headers=self.headers)
+        r = self.session.get(self.url, headers=self.headers)
         print(r.text)
-        data = r.json()
+        data = _json(r, self.session)
         self.token = data['data']['qrcode_key']
         self.qrcode_url = data['data']['url']
 
     def generate(self):
-        r = requests.get(self.qrcode_url, headers=self.headers)
+        r = self.session.get(self.qrcode_url, headers=self.headers)
         img = Image.open(BytesIO(r.content))
         img.show()
         print("请使用手机客户端扫描二维码登录...")
@@ -156,8 +367,8 @@ class biliQRLogin:
         cookie = ''
         while True:
             url = f'https://passport.bilibili.com/x/passport-login/web/qrcode/poll?key={self.token}'
-            response = requests.get(url)
-            data = response.json().get('data', {})
+            response = self.session.get(url, headers=self.headers)
+            data = _json(response, self.session).get('data', {})
             status = data.get('status')
             if status in ['ScanSuccess', 'Success']:
                 cookie = response.headers.get('set-cookie')
@@ -167,9 +378,400 @@ class biliQRLogin:
         return status, cookie
 
 
+# 从网页中提取视频信息
+_STATE_MARKER = "window.__INITIAL_STATE__="
+_PUBDATE_MARKER = '<div class="pubdate-ip-text"'
+_pattern_video_data_key = re.compile(r'"videoData"\s*:\s*')
+_json_decoder = json.JSONDecoder()
+
+
+@profiler.timed("parse")
+def extract_video_data(rtext):
+    """
+    从视频网页中取出window.__INITIAL_STATE__里的videoData，以及发布时间。
+    不再用正则匹配整个__INITIAL_STATE__再json.loads整个对象，而是定位到"videoData"后用raw_decode只解码这一棵子树，
+    解码到它的结尾就停下。发布时间也直接用str.find定位，不再单独跑一遍正则。
+    [使用方法]:
+        video_data, pubdate = extract_video_data(rtext)
+    :param rtext: 网页文本
+    :return: (videoData的dict，发布时间的str)，取不到的项为None
+    """
+    video_data, pubdate = None, None
+
+    pos = rtext.find(_PUBDATE_MARKER)
+    if pos != -1:
+        start = rtext.find(">", pos) + 1
+        end = rtext.find("</div>", start)
+        if start > 0 and end != -1:
+            pubdate = rtext[start:end].rstrip()
+
+    pos = rtext.find(_STATE_MARKER)
+    if pos != -1:
+        key_match = _pattern_video_data_key.search(rtext, pos + len(_STATE_MARKER))
+        if key_match is not None:
+            try:
+                video_data, _ = _json_decoder.raw_decode(rtext, key_match.end())
+            except ValueError:
+                video_data = None
+            if not isinstance(video_data, dict):
+                video_data = None
+    return video_data, pubdate
+
+
+def video_data_to_record(video_data, pubdate=None):
+    """
+    把extract_video_data()的结果转成和biliVideo.to_record()一样的dict
+    :param video_data: videoData
+    :param pubdate: 发布时间
+    :return: dict
+    """
+    stat = video_data["stat"]
+    return {
+        "av": video_data["aid"],
+        "bv": video_data["bvid"],
+        "title": video_data["title"],
+        "pic": video_data["pic"],
+        "desc": video_data["desc"],
+        "view": stat["view"],
+        "dm": stat["danmaku"],
+        "reply": stat["reply"],
+        "time": pubdate,
+        "like": stat["like"],
+        "coin": stat["coin"],
+        "fav": stat["favorite"],
+        "share": stat["share"],
+    }
+
+
+def _parse_html_file(file_path):
+    """[子函数]进程池里解析一个保存下来的网页，返回(文件路径, record, 错误信息)"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            rtext = f.read()
+        video_data, pubdate = extract_video_data(rtext)
+        if video_data is None:
+            return file_path, None, "网页中没有找到videoData"
+        return file_path, video_data_to_record(video_data, pubdate), None
+    except Exception as e:
+        return file_path, None, repr(e)
+
+
+def parse_html_archive(html_path, processes=None, sink=None, chunksize=64, error_report_path=None):
+    """
+    离线解析get_html(html_path=...)保存下来的所有网页，多进程并行，不访问网络
+    [使用方法]:
+        if __name__ == '__main__':  # 多进程在Windows下需要放在main里
+            df, errors = parse_html_archive("output/html/")
+            # 网页很多时把结果流式写进SegmentSink，内存里不保留全部结果
+            sink, errors = parse_html_archive("output/html/", sink=SegmentSink("output/html_parsed", key="bv"))
+    :param html_path: 网页目录，和biliVideo的html_path一样
+    :param processes: 进程数，默认为CPU核数
+    :param sink: 可选，SegmentSink。指定后结果边解析边写入sink，返回sink而不是DataFrame
+    :param chunksize: 每次分给一个进程的文件数
+    :param error_report_path: 可选，把解析失败的网页列表保存为csv
+    :return: (DataFrame或sink, errors)，errors是[{"file": 文件路径, "error": 错误信息}]
+    """
+    file_paths = [entry.path for entry in os.scandir(html_path) if entry.is_file() and entry.name.endswith(".html")]
+    records, errors = [], []
+    with Pool(processes=processes) as pool:
+        for file_path, record, error in pool.imap_unordered(_parse_html_file, file_paths, chunksize=chunksize):
+            if error is not None:
+                errors.append({"file": file_path, "error": error})
+            elif sink is not None:
+                sink.append(record)
+            else:
+                records.append(record)
+    if error_report_path is not None:
+        pd.DataFrame(errors, columns=["file", "error"]).to_csv(error_report_path, index=False)
+    if sink is not None:
+        sink.flush()
+        return sink, errors
+    return pd.DataFrame(records, columns=list(biliVideo.RECORD_COLUMNS)), errors
+
+
+DM_SEGMENT_SECONDS = 6 * 60  # 弹幕按6分钟一个分段下发
+
+
+class DanmakuColumns:
+    """
+    [功能] 按列存放的弹幕。每一列是一个紧凑的array，所有弹幕文本拼在一个bytearray里，用偏移数组切分，
+        几百万条弹幕也不会产生几百万个dict/str
+    [使用示例]
+        dm = biliVideo("BV1Jv4y1p7q3").get_danmaku()
+        print(len(dm), dm.progress[:10], dm.text(0))
+        dm.dump("output/BV1Jv4y1p7q3_danmaku.npz")
+        df = DanmakuColumns.load("output/BV1Jv4y1p7q3_danmaku.npz").to_dataframe()
+    """
+    COLUMNS = (("id", "q"), ("progress", "i"), ("mode", "i"), ("fontsize", "i"), ("color", "I"), ("ctime", "q"))
+
+    def __init__(self):
+        self.id = array("q")  # 弹幕id
+        self.progress = array("i")  # 出现时间(毫秒)
+        self.mode = array("i")  # 1-3滚动 4底部 5顶部 6逆向 7高级 8代码 9BAS
+        self.fontsize = array("i")
+        self.color = array("I")  # 十进制RGB
+        self.ctime = array("q")  # 发送时间戳
+        self.text_offsets = array("Q", [0])  # 第i条弹幕的文本是text_blob[text_offsets[i]:text_offsets[i+1]]
+        self.text_blob = bytearray()
+        self.failed_segments = {}  # 获取失败的分段 {segment_index: 错误信息}
+
+    def __len__(self):
+        return len(self.progress)
+
+    def text(self, i):
+        """第i条弹幕的文本"""
+        return self.text_blob[self.text_offsets[i]:self.text_offsets[i + 1]].decode("utf-8", errors="replace")
+
+    def texts(self):
+        """逐条产出文本"""
+        for i in range(len(self)):
+            yield self.text(i)
+
+    def extend(self, other):
+        """把另一个DanmakuColumns接在后面"""
+        for name, _ in self.COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+        base = len(self.text_blob)
+        self.text_offsets.extend(offset + base for offset in other.text_offsets[1:])
+        self.text_blob += other.text_blob
+        self.failed_segments.update(other.failed_segments)
+
+    @profiler.timed("parse")
+    def feed(self, data):
+        """
+        解析一个分段(DmSegMobileReply的protobuf二进制)，追加到各列。只认识需要的字段，其余字段直接跳过，
+        不依赖protobuf库，也不会为每条弹幕创建对象
+        :param data: bytes
+        :return: 本分段的弹幕数
+        """
+        before = len(self)
+        buf = bytes(data)  # 按下标取bytes比memoryview快
+        pos, end = 0, len(buf)
+        while pos < end:
+            key, pos = _read_varint(buf, pos)
+            if key & 7 != 2:
+                pos = _skip_field(buf, pos, key & 7)
+                continue
+            length, pos = _read_varint(buf, pos)
+            if key >> 3 == 1:  # repeated DanmakuElem elems = 1
+                self._feed_elem(buf, pos, pos + length)
+            pos += length
+        return len(self) - before
+
+    def _feed_elem(self, buf, pos, end):
+        """[子函数]解析一条DanmakuElem"""
+        values = [0, 0, 0, 0, 0, 0, 0, 0, 0]  # 按字段号1-8放varint字段，没出现的字段按proto3的默认值0
+        text_start = text_end = 0
+        while pos < end:
+            # 绝大多数key和小整数只有一个字节，先走快速路径，省掉函数调用
+            key = buf[pos]
+            if key < 0x80:
+                pos += 1
+            else:
+                key, pos = _read_varint(buf, pos)
+            field, wire_type = key >> 3, key & 7
+            if wire_type == 0:
+                value = buf[pos]
+                if value < 0x80:
+                    pos += 1
+                else:
+                    value, pos = _read_varint(buf, pos)
+                if field <= 8:
+                    values[field] = value
+            elif wire_type == 2:
+                length = buf[pos]
+                if length < 0x80:
+                    pos += 1
+                else:
+                    length, pos = _read_varint(buf, pos)
+                if field == 7:  # content
+                    text_start, text_end = pos, pos + length
+                pos += length
+            else:
+                pos = _skip_field(buf, pos, wire_type)
+        self.id.append(values[1] - (1 << 64) if values[1] >= 1 << 63 else values[1])
+        self.progress.append(values[2])
+        self.mode.append(values[3])
+        self.fontsize.append(values[4])
+        self.color.append(values[5] & 0xFFFFFFFF)
+        self.ctime.append(values[8])
+        self.text_blob += buf[text_start:text_end]
+        self.text_offsets.append(len(self.text_blob))
+
+    def to_dataframe(self):
+        """转成DataFrame，按出现时间排序"""
+        data = {name: np.frombuffer(getattr(self, name), dtype=np.dtype(typecode)) for name, typecode in self.COLUMNS}
+        data["text"] = list(self.texts())
+        return pd.DataFrame(data).sort_values("progress", kind="stable", ignore_index=True)
+
+    def dump(self, path):
+        """
+        直接把各列写成npz文件
+        :param path: 保存路径，比如"output/BV1Jv4y1p7q3_danmaku.npz"
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {name: np.frombuffer(getattr(self, name), dtype=np.dtype(typecode))
+                  for name, typecode in self.COLUMNS}
+        arrays["text_offsets"] = np.frombuffer(self.text_offsets, dtype=np.uint64)
+        arrays["text_blob"] = np.frombuffer(bytes(self.text_blob), dtype=np.uint8)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """读取dump保存的npz文件"""
+        columns = cls()
+        with np.load(path) as data:
+            for name, typecode in cls.COLUMNS:
+                getattr(columns, name).frombytes(data[name].astype(np.dtype(typecode)).tobytes())
+            columns.text_offsets = array("Q", data["text_offsets"].astype(np.uint64).tobytes())
+            columns.text_blob = bytearray(data["text_blob"].tobytes())
+        return columns
+
+
+def _read_varint(buf, pos):
+    """[子函数]读一个protobuf varint，返回(值, 新位置)"""
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip_field(buf, pos, wire_type):
+    """[子函数]跳过一个不需要的字段的值"""
+    if wire_type == 0:
+        return _read_varint(buf, pos)[1]
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 2:
+        length, pos = _read_varint(buf, pos)
+        return pos + length
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError(f"不支持的protobuf wire type {wire_type}")
+
+
+class VideoShot:
+    """
+    [功能] 视频快照(进度条预览图)。接口返回若干张拼图，每张是img_x_len列*img_y_len行个小图，index是每个小图对应的秒数。
+        按时间取小图时只下载、解码需要的那张拼图，解码后的拼图放在LRU缓存里，不会一开始就解码全部
+    [使用示例]
+        shot = biliVideo("BV1zm411y7eF").get_videoshot()
+        shot.frame(65).save("output/65s.jpg")  # 第65秒附近的小图
+        frames = shot.frames([10, 20, 30], concurrency=4)  # 需要的拼图并发下载
+    """
+    def __init__(self, data, session, headers=None, cache_size=8):
+        """
+        :param data: videoshot接口返回的data(需要index=1)
+        :param session: 下载拼图用的会话
+        :param headers: 请求头
+        :param cache_size: 最多缓存几张解码后的拼图
+        """
+        self.images = ["https:" + url if url.startswith("//") else url for url in data["image"]]
+        self.index = data.get("index") or []
+        self.x_len, self.y_len = data["img_x_len"], data["img_y_len"]
+        self.x_size, self.y_size = data["img_x_size"], data["img_y_size"]
+        self.per_sheet = self.x_len * self.y_len
+        self.session = session
+        self.headers = headers
+        self.cache_size = cache_size
+        self._sheets = OrderedDict()  # 拼图序号 -> 解码后的PIL.Image
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """小图的个数"""
+        if self.index:
+            return min(len(self.index), len(self.images) * self.per_sheet)
+        return len(self.images) * self.per_sheet
+
+    def frame_index(self, seconds):
+        """第seconds秒对应第几个小图"""
+        if not self.index:
+            raise ValueError("没有index，请用index=1请求videoshot")
+        i = bisect.bisect_right(self.index, seconds) - 1
+        return min(max(i, 0), len(self) - 1)
+
+    def _fetch_sheet(self, k):
+        """[子函数]下载并解码第k张拼图"""
+        content = self.session.get(url=self.images[k], headers=self.headers).content
+        sheet = Image.open(BytesIO(content))
+        sheet.load()  # 在下载线程里解码完，PIL解码时会释放GIL
+        return sheet
+
+    def sheet(self, k):
+        """第k张拼图(解码后的)，最近用过的放在LRU缓存里"""
+        with self._lock:
+            if k in self._sheets:
+                self._sheets.move_to_end(k)
+                return self._sheets[k]
+        sheet = self._fetch_sheet(k)
+        self._cache_sheet(k, sheet)
+        return sheet
+
+    def _cache_sheet(self, k, sheet):
+        with self._lock:
+            self._sheets[k] = sheet
+            self._sheets.move_to_end(k)
+            while len(self._sheets) > self.cache_size:
+                self._sheets.popitem(last=False)
+
+    def frame_at(self, i):
+        """第i个小图，PIL.Image"""
+        k, pos = divmod(i, self.per_sheet)
+        col, row = pos % self.x_len, pos // self.x_len
+        sheet = self.sheet(k)
+        # 拼图的实际大小可能和img_x_size*img_x_len不一致(比如缩放过)，按实际大小等分
+        width, height = sheet.width // self.x_len, sheet.height // self.y_len
+        return sheet.crop((col * width, row * height, (col + 1) * width, (row + 1) * height))
+
+    def frame(self, seconds):
+        """第seconds秒附近的小图，PIL.Image"""
+        return self.frame_at(self.frame_index(seconds))
+
+    def prefetch(self, sheets=None, concurrency=4):
+        """
+        并发下载并解码拼图放进缓存
+        :param sheets: 拼图序号的list，为None则全部(超过cache_size的会被挤出缓存)
+        :param concurrency: 并发数
+        """
+        with self._lock:
+            missing = [k for k in (range(len(self.images)) if sheets is None else sheets) if k not in self._sheets]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for k, sheet in zip(missing, executor.map(profiler.wrap(self._fetch_sheet), missing)):
+                self._cache_sheet(k, sheet)
+
+    def frames(self, seconds_list, concurrency=4):
+        """
+        批量按时间取小图，需要的拼图先并发下载
+        :param seconds_list: 秒数的list
+        :return: list，PIL.Image
+        """
+        indices = [self.frame_index(seconds) for seconds in seconds_list]
+        needed = list(dict.fromkeys(i // self.per_sheet for i in indices))
+        if len(needed) > self.cache_size:
+            # 一次需要的拼图比缓存还多时，按拼图分批，每批取完小图再下一批
+            result = {}
+            for start in range(0, len(needed), self.cache_size):
+                batch = set(needed[start:start + self.cache_size])
+                self.prefetch(sorted(batch), concurrency)
+                for i in indices:
+                    if i // self.per_sheet in batch:
+                        result[i] = self.frame_at(i)
+            return [result[i] for i in indices]
+        self.prefetch(needed, concurrency)
+        return [self.frame_at(i) for i in indices]
+
+
 # 获取b站视频信息(目前已实现获取视频信息、下载视频和音频功能)
 class biliVideo:
-    def __init__(self, bv, html_path=None):
+    RECORD_COLUMNS = ("av", "bv", "title", "pic", "desc", "view", "dm", "reply", "time", "like", "coin", "fav", "share")
+
+    def __init__(self, bv, html_path=None, session=None, p=1, page_store=None):
         """
         [使用方法]:
             biliV = biliVideo("BV18x4y187DE")  # [必要]输入bv号
@@ -179,22 +781,28 @@ class biliVideo:
             biliV.show_values()  # [非必要]显示视频信息
         :param bv: bv号
         :param html_path: 如不指定，则不存储。如指定，则为f"{self.html_path}{self.bv}.html"
-
+        :param session: 共享会话，不指定则使用get_bili_session()
+        :param p: 分P序号，从1开始。下载多P视频的全部分P请使用iter_parts()或download_all_parts()
+        :param page_store: 网页存储，有put(key, text)与get(key)方法。比如SegmentPageStore("output/pages")会把网页压缩后
+            追加到大分段文件里并保留每次抓取的历史。指定后html_path无效，不指定且指定了html_path时使用DirPageStore(html_path)
         """
         # 基本信息
         self.bv = bv  # 你要爬取的视频的bv号
+        self.p = p  # 分P序号
         self.html_path = html_path  # html存储路径
+        if page_store is None and html_path is not None:
+            page_store = DirPageStore(html_path)
+        self.page_store = page_store  # 网页存储
         self.url = f"https://www.bilibili.com/video/{self.bv}"
+        self.session = session if session is not None else get_bili_session()
         self.headers = {
-            "User-Agent": useragent().pcChrome,
-            "Cookie": cookies().bilicookie,
             'referer': self.url
-        }
+        }  # User-Agent与Cookie在session里
 
         # 鉴权参数
-        # cid是鉴权参数。请求https://api.bilibili.com/x/player/pagelist，参数是bv号，返回的是视频的cid
-        self.cid = requests.get(url=f"https://api.bilibili.com/x/player/pagelist?bvid={self.bv}",
-                                headers=self.headers).json()["data"][0]["cid"]  # 目前这个似乎只适用于单P视频，暂未验证
+        # cid是鉴权参数，只有下载时才需要，所以第一次用到self.cid时才去请求pagelist(见pages)
+        self._cid = None
+        self._pages = None
 
         # 网页文本
         self.rtext = None  # 网页的文本，也就是r.text
@@ -218,42 +826,127 @@ class biliVideo:
         # 额外信息
         self.play_url = "https://api.bilibili.com/x/player/wbi/playurl"  # 视频下载信息的获取地址
         self.down_video_json = None  # 视频的下载信息（包含视频与音频地址，在download_video()与download_audio()中获取）
+        self._playurl_lock = threading.Lock()  # download_av的两个线程换新地址时都会写down_video_json
+
+    @property
+    def pages(self):
+        """
+        分P列表，第一次访问时请求pagelist，结果在所有实例间共享
+        :return: list，比如[{"cid": 123, "page": 1, "part": "分P标题", "duration": 60, ...}, ...]
+        """
+        if self._pages is None:
+            self._pages = get_pagelist(self.bv, session=self.session)
+        return self._pages
+
+    @property
+    def cid(self):
+        """第self.p个分P的cid"""
+        if self._cid is None:
+            self._cid = self.pages[self.p - 1]["cid"]
+        return self._cid
 
-    def get_html(self):
-        biliLoginState(self.headers).get_login_state()
-        r = requests.get(url=self.url, headers=self.headers)
+    @cid.setter
+    def cid(self, value):
+        self._cid = value
+
+    def iter_parts(self):
+        """
+        遍历所有分P，每个分P是一个共用session与pagelist的biliVideo
+        [使用方法]:
+            for part in biliVideo("BV1xx").iter_parts():
+                part.download_video(save_video_path="output")
+        """
+        for page in self.pages:
+            part = type(self)(self.bv, html_path=self.html_path, session=self.session, p=page["page"],
+                              page_store=self.page_store)
+            part._pages = self._pages
+            part._cid = page["cid"]
+            yield part
+
+    def download_all_parts(self, save_path=None, av=True, **kwargs):
+        """
+        下载所有分P。第1P保存为bv号(和单P视频一样)，其余保存为f"{bv}_p{分P序号}"
+        [使用方法]:
+            biliVideo("BV1xx").download_all_parts(save_path="output", segments=4)
+        :param save_path: 保存路径
+        :param av: 为True时使用download_av()(音视频都要)，为False时只下载视频
+        :param kwargs: 传给download_av()或download_video()的其他参数
+        :return: list，每个分P的下载结果
+        """
+        results = []
+        for part in self.iter_parts():
+            if av:
+                results.append(part.download_av(save_path=save_path, **kwargs))
+            else:
+                results.append(part.download_video(save_video_path=save_path, **kwargs))
+        return results
+
+    @classmethod
+    def prefetch_pages(cls, bvs, concurrency=4, rate=None, session=None):
+        """
+        批量并发地请求pagelist放进缓存，之后这些视频的cid/pages不用再等网络
+        [使用方法]:
+            failures = biliVideo.prefetch_pages(bvs, concurrency=8)
+        :param bvs: bv号列表
+        :param concurrency: 并发数
+        :param rate: 可选，每秒最多请求几次。不指定时只受会话的限速器(bili_limiter)约束
+        :param session: 共享会话，不指定则使用get_bili_session()
+        :return: 失败的{bv: 错误信息}
+        """
+        limiter = TokenBucket(rate) if rate is not None else None
+
+        def fetch(bv):
+            if limiter is not None:
+                limiter.acquire()
+            get_pagelist(bv, session=session)
+
+        failures = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(profiler.wrap(fetch), bv): bv for bv in bvs}
+            for future, bv in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    failures[bv] = repr(e)
+        return failures
+
+    def get_html(self, check_login=True):
+        """
+        获取网页
+        :param check_login: 是否先检查登录状态。批量爬取时没必要每个视频都检查一次
+        """
+        if check_login:
+            biliLoginState(self.headers, session=self.session).get_login_state()
+        r = self.session.get(url=self.url, headers=self.headers)
         r.encoding = 'utf-8'
         self.rtext = r.text
-        if self.html_path is not None:
-            if not os.path.exists(self.html_path):
-                os.makedirs(self.html_path)
-            with open(f"{self.html_path}{self.bv}.html", 'w', encoding='utf-8') as f:
-                f.write(self.rtext)
+        if self.page_store is not None:
+            self.page_store.put(self.bv, self.rtext)
 
     def get_content(self):
         """
         [使用方法]:
             biliV = biliVideo("BV18x4y187DE")
-            biliV.get_html()  # [必要]获取html
+            biliV.get_html()  # [必要]获取html。如果指定了html_path或page_store，也可以不get_html，直接读取之前保存的网页
             biliV.get_content()
         不能保证一定能用，获取view,dm的上个月还能用，这个月就不能用了，B站前端牛魔王又改了
         """
-        if self.html_path is not None:
-            with open(f"{self.html_path}{self.bv}.html", 'r', encoding='utf-8') as f:
-                self.rtext = f.read()
-
-        pattern_base_data = re.compile(r'window\.__INITIAL_STATE__=(.*?);\(function\(\)')
-        base_data_match = re.search(pattern_base_data, self.rtext)
-
-        if base_data_match:
-            base_data_content = base_data_match.group(1)
-            base_data_content = json.loads(base_data_content)
-            self.aid = base_data_content['videoData']['aid']
-            self.bvid = base_data_content['videoData']['bvid']
-            self.title = base_data_content['videoData']['title']
-            self.pic = base_data_content["videoData"]["pic"]
-            self.desc = base_data_content["videoData"]["desc"]
-            self.stat = base_data_content["videoData"]["stat"]  # B站牛魔前端又改了
+        if self.rtext is None and self.page_store is not None:
+            self.rtext = self.page_store.get(self.bv)
+        if self.rtext is None:
+            where = "" if self.page_store is None else "，page_store里也没有保存过"
+            raise ValueError(f"没有{self.bv}的网页{where}，请先调用get_html()")
+
+        # 一次扫描同时取出videoData和发布时间，只解码videoData这一棵子树
+        video_data, pubdate = extract_video_data(self.rtext)
+
+        if video_data is not None:
+            self.aid = video_data['aid']
+            self.bvid = video_data['bvid']
+            self.title = video_data['title']
+            self.pic = video_data["pic"]
+            self.desc = video_data["desc"]
+            self.stat = video_data["stat"]  # B站牛魔前端又改了
             self.view = self.stat["view"]
             self.dm = self.stat["danmaku"]
             self.reply = self.stat["reply"]
@@ -290,11 +983,8 @@ class biliVideo:
         # else:
         #     print("爬取评论数据错误，再见ヾ(￣▽￣)")
 
-        pattern_time_data = re.compile(r'<div class="pubdate-ip-text"[^>]*>(.*?)\s*</div>')
-        time_data_match = re.search(pattern_time_data, self.rtext)
-        if time_data_match:
-            time_data_content = time_data_match.group(1)
-            self.time = time_data_content
+        if pubdate is not None:
+            self.time = pubdate
         else:
             print("爬取发布时间数据错误，再见ヾ(￣▽￣)")
 
@@ -330,7 +1020,8 @@ class biliVideo:
         # else:
         #     print("爬取转发数据错误，再见ヾ(￣▽￣)")
 
-    def download_video(self, save_video_path=None, qn=80, platform="pc", high_quality=1, fnval=16):
+    def download_video(self, save_video_path=None, qn=80, platform="pc", high_quality=1, fnval=16,
+                       chunk_size=1 << 20, progress=print_progress, segments=1):
         """
         [使用方法]:
             biliV = biliVideo("BV18x4y187DE")
@@ -342,7 +1033,115 @@ class biliVideo:
         :param platform: 平台。pc或html5
         :param high_quality: 当platform=html5时，此值为1可使画质为1080p
         :param fnval: 1代表mp4，16是DASH。非常建议使用16。
+        :param chunk_size: 边下边写时每块的字节数，内存占用只和它有关，和视频大小无关
+        :param progress: 进度回调，参数是DownloadProgress(已下载字节数、总字节数、速度)。为None则不显示进度
+        :param segments: 大于1时按HTTP Range分段、多连接并行下载，CDN不支持Range时自动退回单连接
+        :return: DownloadProgress
+        [断点续传]下载中断后再次调用即可，只会下载缺的部分。已下载的进度记在f"{视频路径}.part.json"里，
+            下载地址过期时会重新请求playurl，并用文件大小和ETag确认是同一个文件
+        """
+        def resolve_url(use_cache=False):
+            playurl = self._get_playurl(qn=qn, platform=platform, high_quality=high_quality, fnval=fnval,
+                                        use_cache=use_cache)
+            return self._media_url("video", fnval, playurl=playurl)
+
+        return segmented_download(resolve_url(use_cache=True), self._media_path(save_video_path, None, "mp4"),
+                                  session=self.session, headers=self.headers, segments=segments,
+                                  chunk_size=chunk_size, progress=progress, resolve_url=resolve_url)
+
+    def download_audio(self, save_audio_path=None, save_audio_name=None, fnval=16,
+                       chunk_size=1 << 20, progress=print_progress, segments=1):
+        """
+        下载音频。如果视频音频都要，建议在download_video之后使用，这样能减少一次请求。
+        [使用方法]:
+            biliV = biliVideo("BV12a411k7os")
+            biliV.download_audio(save_audio_path="output")
+        :param save_audio_path: 音频保存路径
+        :param save_audio_name: 音频保存名称
+        :param fnval: 一般就是16了，原因请见download_video()里fnval参数的描述
+        :param chunk_size: 同download_video()
+        :param progress: 同download_video()
+        :param segments: 同download_video()
+        :return: DownloadProgress
         """
+        def resolve_url(use_cache=False):
+            return self._media_url("audio", fnval, playurl=self._get_playurl(fnval=fnval, use_cache=use_cache))
+
+        if self.down_video_json is None:
+            audio_url = resolve_url(use_cache=True)
+        else:
+            audio_url = self._media_url("audio", fnval)
+        return segmented_download(audio_url, self._media_path(save_audio_path, save_audio_name, "mp3"),
+                                  session=self.session, headers=self.headers, segments=segments,
+                                  chunk_size=chunk_size, progress=progress, resolve_url=resolve_url)
+
+    def download_av(self, save_path=None, save_name=None, qn=80, platform="pc", high_quality=1, segments=1,
+                    chunk_size=1 << 20, progress=None, muxer=ffmpeg_mux, keep_tracks=False):
+        """
+        同时下载视频轨和音频轨(共用一次playurl请求)，然后交给muxer合成一个文件，总耗时约等于两者中较慢的那个
+        [使用方法]:
+            biliV = biliVideo("BV18x4y187DE")
+            biliV.download_av(save_path="output", segments=4)  # 有ffmpeg时得到output/BV18x4y187DE.mp4
+        :param save_path: 保存路径
+        :param save_name: 保存名称，不指定则为bv号。两条轨道分别为f"{save_name}_video.mp4"与f"{save_name}_audio.m4a"
+        :param qn: 同download_video()
+        :param platform: 同download_video()
+        :param high_quality: 同download_video()
+        :param segments: 同download_video()，音视频各自使用这么多条连接
+        :param chunk_size: 同download_video()
+        :param progress: 进度回调，参数是("video"或"audio", DownloadProgress)
+        :param muxer: 合成函数muxer(video_path, audio_path, out_path)，返回out_path，不能合成时返回None。
+            默认使用本地ffmpeg，为None则不合成，只保留两条轨道
+        :param keep_tracks: 合成成功后是否保留两条轨道文件
+        :return: dict，{"video": 视频轨路径, "audio": 音频轨路径, "output": 合成后的路径，没有合成则为None}
+        """
+        name = self._default_name() if save_name is None else save_name
+        playurl = self._get_playurl(qn=qn, platform=platform, high_quality=high_quality, fnval=16)
+        tracks = {
+            "video": self._media_path(save_path, f"{name}_video", "mp4"),
+            "audio": self._media_path(save_path, f"{name}_audio", "m4a"),
+        }
+
+        def download_track(kind):
+            def resolve_url():
+                # 用这次请求自己的返回值取地址，不读self.down_video_json，另一条轨道可能同时在换新地址
+                playurl = self._get_playurl(qn=qn, platform=platform, high_quality=high_quality, fnval=16,
+                                            use_cache=False)
+                return self._media_url(kind, playurl=playurl)
+
+            track_progress = None if progress is None else (lambda p: progress(kind, p))
+            return segmented_download(self._media_url(kind, playurl=playurl), tracks[kind], session=self.session,
+                                      headers=self.headers, segments=segments, chunk_size=chunk_size,
+                                      progress=track_progress, resolve_url=resolve_url)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(profiler.wrap(download_track), kind) for kind in tracks]
+            for future in futures:
+                future.result()
+
+        output = None
+        if muxer is not None:
+            output = muxer(tracks["video"], tracks["audio"], self._media_path(save_path, name, "mp4"))
+            if output is not None and not keep_tracks:
+                for path in tracks.values():
+                    os.remove(path)
+        return {"video": tracks["video"], "audio": tracks["audio"], "output": output}
+
+    def _get_playurl(self, qn=80, platform="pc", high_quality=1, fnval=16, use_cache=True):
+        """
+        [子函数]请求视频下载信息，结果存在self.down_video_json。
+        结果会放进所有biliVideo共用的playurl_cache，同一个视频的其他实例、重试、音视频分开下载都不用再请求
+        参数见download_video()
+        :param use_cache: 是否使用缓存。下载地址过期需要换新地址时应为False
+        :return: 这次得到的下载信息，同时存进self.down_video_json
+        """
+        key = (self.bv, self.cid, qn, fnval, 1, platform, high_quality)
+        if use_cache:
+            cached = playurl_cache.get(key)
+            if cached is not None:
+                with self._playurl_lock:
+                    self.down_video_json = cached
+                return cached
         params = {
             "bvid": self.bv,
             "cid": self.cid,
@@ -353,39 +1152,27 @@ class biliVideo:
             "platform": platform,
             "high_quality": high_quality,
         }
-        r = requests.get(url=self.play_url, headers=self.headers, params=params)
-        self.down_video_json = r.json()
-        # print(self.down_video_json)
-        if fnval == 1:
-            video_content = requests.get(url=self.down_video_json["data"]["durl"][0]["url"], headers=self.headers).content
-        else:
-            video_content = requests.get(url=self.down_video_json["data"]["dash"]["video"][0]["baseUrl"],
-                                         headers=self.headers).content
-        self._save_mp4(video_content, save_video_path)
+        r = self.session.get(url=self.play_url, headers=self.headers, params=params)
+        down_video_json = _json(r, self.session)
+        # print(down_video_json)
+        if down_video_json.get("code") == 0:
+            playurl_cache.set(key, down_video_json, ttl=_playurl_ttl(down_video_json))
+        with self._playurl_lock:
+            self.down_video_json = down_video_json
+        return down_video_json
 
-    def download_audio(self, save_audio_path=None, save_audio_name=None, fnval=16):
+    def _media_url(self, kind="video", fnval=16, playurl=None):
         """
-        下载音频。如果视频音频都要，建议在download_video之后使用，这样能减少一次请求。
-        [使用方法]:
-            biliV = biliVideo("BV12a411k7os")
-            biliV.download_audio(save_audio_path="output")
-        :param save_audio_path: 音频保存路径
-        :param save_audio_name: 音频保存名称
-        :param fnval: 一般就是16了，原因请见download_video()里fnval参数的描述
-        :return:
+        [子函数]从下载信息里取下载地址
+        :param kind: video或audio
+        :param fnval: 1代表mp4(只有video)，16是DASH
+        :param playurl: _get_playurl()的返回值，为None则用self.down_video_json
         """
-        if self.down_video_json is None:
-            params = {
-                "bvid": self.bv,
-                "cid": self.cid,
-                "fnval": fnval
-            }
-            r = requests.get(url=self.play_url, headers=self.headers, params=params)
-            self.down_video_json = r.json()
-        # print(self.down_video_json)
-        audio_content = requests.get(url=self.down_video_json["data"]["dash"]["audio"][0]["baseUrl"],
-                                     headers=self.headers).content
-        self._save_mp3(audio_content, save_audio_path, save_audio_name)
+        if playurl is None:
+            playurl = self.down_video_json
+        if fnval == 1:
+            return playurl["data"]["durl"][0]["url"]
+        return playurl["data"]["dash"][kind][0]["baseUrl"]
 
     def download_pic(self, save_pic_path=None, save_pic_name=None):
         """
@@ -405,33 +1192,100 @@ class biliVideo:
             print("图片地址获取失败，再见ヾ(￣▽￣)")
             return 114514
         print(self.pic)
-        pic_content = requests.get(url=self.pic, headers=self.headers).content
+        pic_content = self.session.get(url=self.pic, headers=self.headers).content
         self._save_pic(pic_content, save_pic_path, save_pic_name)
 
-    def download_videoshot(self, save_videoshot_path=None, save_videoshot_name=None, index=0):
+    def get_danmaku(self, concurrency=4, save_path=None):
+        """
+        获取第self.p个分P的全部弹幕。弹幕按6分钟一个分段，分段数由pagelist里的时长算出，各分段并发请求，
+        按分段顺序解析进DanmakuColumns
+        [使用方法]:
+            biliV = biliVideo("BV1Jv4y1p7q3")
+            dm = biliV.get_danmaku(concurrency=4, save_path="output/BV1Jv4y1p7q3_danmaku.npz")
+            print(len(dm), dm.failed_segments)
+        :param concurrency: 同时请求的分段数
+        :param save_path: 可选，直接保存为npz文件
+        :return: DanmakuColumns，获取失败的分段记在failed_segments里
+        """
+        danmaku_url = "https://api.bilibili.com/x/v2/dm/web/seg.so"
+        duration = self.pages[self.p - 1]["duration"]
+        segments = max(1, math.ceil(duration / DM_SEGMENT_SECONDS))
+        aid = self.aid if self.aid is not None else _bv2av.bv2av(self.bv)
+
+        def fetch(segment_index):
+            params = {"type": 1, "oid": self.cid, "pid": aid, "segment_index": segment_index}
+            r = self.session.get(url=danmaku_url, headers=self.headers, params=params)
+            r.raise_for_status()
+            if r.headers.get("Content-Type", "").startswith("application/json"):
+                # 正常返回的是protobuf，返回json说明出错了，比如被风控
+                raise ValueError(f"获取第{segment_index}个弹幕分段失败，错误信息{_json(r, self.session)}")
+            columns = DanmakuColumns()
+            columns.feed(r.content)
+            return columns
+
+        danmaku = DanmakuColumns()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(profiler.wrap(fetch), i) for i in range(1, segments + 1)]
+            for segment_index, future in enumerate(futures, start=1):
+                try:
+                    danmaku.extend(future.result())
+                except Exception as e:
+                    danmaku.failed_segments[segment_index] = repr(e)
+        if danmaku.failed_segments:
+            print(CT(f"{self.bv}有{len(danmaku.failed_segments)}个弹幕分段获取失败").red())
+        if save_path is not None:
+            danmaku.dump(save_path)
+        return danmaku
+
+    def _get_videoshot_data(self, index=1):
+        """[子函数]请求videoshot接口，返回data"""
+        self.videoshot_url = "https://api.bilibili.com/x/player/videoshot"
+        params = {
+            "bvid": self.bv,
+            "index": index
+        }
+        if self.p != 1:
+            params["cid"] = self.cid  # 不传cid时是第一个分P
+        r = self.session.get(url=self.videoshot_url, headers=self.headers, params=params)
+        r_json = _json(r, self.session)
+        if r_json["code"] != 0:
+            raise ValueError(f"获取{self.bv}的视频快照失败，错误信息{r_json}")
+        return r_json["data"]
+
+    def get_videoshot(self, cache_size=8):
         """
-        视频快照下载
+        获取视频快照，可以按时间取单个小图
+        [使用方法]
+            shot = biliVideo("BV1zm411y7eF").get_videoshot()
+            shot.frame(65).save("output/65s.jpg")
+        :param cache_size: 最多缓存几张解码后的拼图
+        :return: VideoShot
+        """
+        return VideoShot(self._get_videoshot_data(index=1), self.session, headers=self.headers, cache_size=cache_size)
+
+    def download_videoshot(self, save_videoshot_path=None, save_videoshot_name=None, index=0, concurrency=4):
+        """
+        视频快照下载，各张拼图并发下载
         [使用方法]
             biliv = biliVideo("BV1zm411y7eF")
             biliv.download_videoshot(save_videoshot_path="output", save_videoshot_name="快照")
         :param save_videoshot_path: 视频快照保存路径。
-        :param save_videoshot_name: 视频快照保存名称。保存的名字是f"{save_videoshot_path}{save_videoshot_name}_{i}.jpg"
+        :param save_videoshot_name: 视频快照保存名称。保存的名字是f"{save_videoshot_path}{save_videoshot_name}_{i}.jpg"，
+            默认为f"{bv}的快照"
         :param index: 是否需要视频快照的索引。默认为0表示不需要。
+        :param concurrency: 同时下载的拼图数
         :return: (list)视频快照地址
         """
-        self.videoshot_url = "https://api.bilibili.com/x/player/videoshot"
-        params = {
-            "bvid": self.bv,
-            "index": index
-        }
-        r = requests.get(url=self.videoshot_url, headers=self.headers, params=params)
-        r_json = r.json()
-        # print(r_json)
-        videoshot_url = r_json["data"]["image"]
-        for i, url in enumerate(videoshot_url):
-            url = "https:" + url
-            videoshot_content = requests.get(url=url, headers=self.headers).content
-            self._save_pic(videoshot_content, save_videoshot_path, save_videoshot_name+'_'+str(i))
+        videoshot_url = self._get_videoshot_data(index=index)["image"]
+        if save_videoshot_name is None:
+            save_videoshot_name = f"{self.bv}的快照"
+
+        def fetch(url):
+            return self.session.get(url=url if url.startswith("http") else "https:" + url, headers=self.headers).content
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for i, videoshot_content in enumerate(executor.map(profiler.wrap(fetch), videoshot_url)):
+                self._save_pic(videoshot_content, save_videoshot_path, save_videoshot_name+'_'+str(i))
         return videoshot_url
 
     def to_csv(self):
@@ -456,26 +1310,129 @@ class biliVideo:
                     bv_content_df.to_excel("input/xlsx_data/bvs_popular_msg.xlsx", index=False)
 
             bv_content_df.to_excel("input/xlsx_data/bvs_popular_msg.xlsx", index=False)
+        [注意]批量获取请使用biliVideo.crawl_many(bvs_popular)，它会并发请求并且只在最后构建一次DataFrame，
+            需要中途保存时传入SegmentSink，每次保存只写新的一批，不会重写整个xlsx
         :return:
         """
-        data = {
-            "av": [self.aid],
-            "bv": [self.bvid],
-            "title": [self.title],
-            "pic": [self.pic],
-            "desc": [self.desc],
-            "view": [self.view],
-            "dm": [self.dm],
-            "reply": [self.reply],
-            "time": [self.time],
-            "like": [self.like],
-            "coin": [self.coin],
-            "fav": [self.fav],
-            "share": [self.share],
-        }
-        df = pd.DataFrame(data)
+        df = pd.DataFrame([self.to_record()])
         return df
 
+    def to_record(self):
+        """
+        将视频信息转为dict，列与to_csv()相同
+        :return: dict
+        """
+        return {
+            "av": self.aid,
+            "bv": self.bvid,
+            "title": self.title,
+            "pic": self.pic,
+            "desc": self.desc,
+            "view": self.view,
+            "dm": self.dm,
+            "reply": self.reply,
+            "time": self.time,
+            "like": self.like,
+            "coin": self.coin,
+            "fav": self.fav,
+            "share": self.share,
+        }
+
+    @classmethod
+    def iter_crawl(cls, bvs, concurrency=4, rate=None, batch_size=50, html_path=None, session=None, limiter=None,
+                   sink=None, page_store=None):
+        """
+        批量获取视频信息，边爬边解析，每攒够batch_size条就产出一批
+        [使用方法]:
+            for records, failures in biliVideo.iter_crawl(bvs, concurrency=8, rate=2):
+                print(len(records), failures)
+        :param bvs: bv号列表
+        :param concurrency: 同时请求的视频数
+        :param rate: 可选，每秒最多开始爬取几个视频。不指定时只受会话的限速器(bili_limiter)约束，它会按host自适应调整速率
+        :param batch_size: 每批的条数
+        :param html_path: 同biliVideo的html_path
+        :param session: 共享会话，不指定则使用get_bili_session()
+        :param limiter: 可选，传入TokenBucket可以让多次调用共用同一个速率预算，传入后rate无效
+        :param sink: 可选，SegmentSink(key="bv")。每批结果会追加写入sink，已经在sink里的bv会被跳过(断点续传)
+        :param page_store: 同biliVideo的page_store
+        :return: 生成器，每次产出(records, failures)。records是to_record()的list，failures是[{"bv": bv, "error": 错误信息}]
+        """
+        if session is None:
+            session = get_bili_session()
+        if limiter is None and rate is not None:
+            limiter = TokenBucket(rate)
+
+        def fetch(bv):
+            if limiter is not None:
+                limiter.acquire()
+            biliV = cls(bv, html_path=html_path, session=session, page_store=page_store)
+            biliV.get_html(check_login=False)
+            return biliV
+
+        if sink is not None:
+            done = sink.done_keys()
+            bvs = [bv for bv in bvs if bv not in done]
+
+        records, failures = [], []
+        bv_iter = iter(bvs)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = {}
+            while True:
+                # 只保持有限个任务在飞，防止bv很多时所有网页都堆在内存里
+                while len(pending) < concurrency * 2:
+                    bv = next(bv_iter, None)
+                    if bv is None:
+                        break
+                    pending[executor.submit(profiler.wrap(fetch), bv)] = bv
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    bv = pending.pop(future)
+                    try:
+                        biliV = future.result()
+                        biliV.get_content()
+                        if biliV.aid is None:
+                            raise ValueError("网页中没有找到视频信息")
+                        records.append(biliV.to_record())
+                    except Exception as e:
+                        # 比如BV1H1421R7i8这种活动页，记下来继续爬其他的
+                        print(CT(f"{bv}的信息获取失败: {e!r}").red())
+                        failures.append({"bv": bv, "error": repr(e)})
+                if len(records) + len(failures) >= batch_size:
+                    if sink is not None:
+                        sink.write(records)
+                    yield records, failures
+                    records, failures = [], []
+        if records or failures:
+            if sink is not None:
+                sink.write(records)
+            yield records, failures
+
+    @classmethod
+    def crawl_many(cls, bvs, concurrency=4, rate=None, html_path=None, session=None, limiter=None, sink=None,
+                   page_store=None):
+        """
+        批量获取视频信息，返回一个DataFrame
+        [使用方法]:
+            bvs_popular = pd.read_excel("input/xlsx_data/bvs_popular.xlsx")[0].tolist()
+            df, failures = biliVideo.crawl_many(bvs_popular, concurrency=8, rate=2)
+            df.to_excel("input/xlsx_data/bvs_popular_msg.xlsx", index=False)
+        [断点续传]:
+            sink = SegmentSink("output/bvs_popular_msg", key="bv")
+            biliVideo.crawl_many(bvs_popular, sink=sink)  # 中途挂了重新运行即可，已保存的bv会被跳过
+            sink.compact("input/xlsx_data/bvs_popular_msg.xlsx")
+        参数见iter_crawl()
+        :return: (DataFrame, failures)，failures是[{"bv": bv, "error": 错误信息}]
+        """
+        all_records, all_failures = [], []
+        for records, failures in cls.iter_crawl(bvs, concurrency=concurrency, rate=rate, html_path=html_path,
+                                                session=session, limiter=limiter, sink=sink, page_store=page_store):
+            all_records.extend(records)
+            all_failures.extend(failures)
+        df = pd.DataFrame(all_records, columns=list(cls.RECORD_COLUMNS))
+        return df, all_failures
+
     def show_values(self):
         print(CT('av号: ').blue() + f"{self.aid}")
         print(CT('bv号: ').blue() + f"{self.bvid}")
@@ -491,54 +1448,29 @@ class biliVideo:
         print(CT('收藏数: ').blue() + f"{self.fav}")
         print(CT('分享数: ').blue() + f"{self.share}")
 
-    def _save_mp4(self, video_content, save_video_path=None, save_video_name=None):
+    def _media_path(self, save_path=None, save_name=None, ext="mp4"):
         """
-        [子函数]保存视频
-        :param video_content: 视频内容，是get请求返回的二进制数据
-        :param save_video_path: 视频保存路径
-        :param save_video_name: 视频保存名称
+        [子函数]拼出音视频的保存路径
+        :param save_path: 保存路径
+        :param save_name: 保存名称，不指定则为bv号
+        :param ext: 扩展名
+        :return: f"{save_path}{name}.{ext}"
         """
         # 如果地址不是以/结尾，就加上/
-        if save_video_path is not None:
-            if save_video_path[-1] != "/":
-                save_video_path += "/"
-        # 视频名
-        if save_video_name is None:
-            name = self.bv
+        if save_path is not None:
+            if save_path[-1] != "/":
+                save_path += "/"
         else:
-            name = save_video_name
-        # 保存视频
-        if save_video_path is not None:
-            with open(f"{save_video_path}{name}.mp4", 'wb') as f:
-                f.write(video_content)
-        else:
-            with open(f"{name}.mp4", 'wb') as f:
-                f.write(video_content)
+            save_path = ""
+        if save_name is None:
+            save_name = self._default_name()
+        return f"{save_path}{save_name}.{ext}"
 
-    def _save_mp3(self, audio_content, save_audio_path=None, save_audio_name=None):
-        """
-        [子函数]保存音频
-        :param audio_content: 音频内容，是get请求返回的二进制数据
-        :param save_audio_path: 音频保存路径
-        :param save_audio_name: 音频保存名称
-        """
-        # 如果地址不是以/结尾，就加上/
-        if save_audio_path is not None:
-            if save_audio_path[-1] != "/":
-                save_audio_path += "/"
-        # 音频名
-        if save_audio_name is None:
-            name = self.bv
-        else:
-            name = save_audio_name
-        # 保存音频
-        if save_audio_path is not None:
-            with open(f"{save_audio_path}{name}.mp3", 'wb') as f:
-                f.write(audio_content)
-        else:
-            with open(f"{name}.mp3", 'wb') as f:
-                f.write(audio_content)
+    def _default_name(self):
+        """[子函数]默认文件名，第1P为bv号，其余为{bv}_p{分P序号}"""
+        return self.bv if self.p == 1 else f"{self.bv}_p{self.p}"
 
+    @profiler.timed("save")
     def _save_pic(self, pic_content, save_pic_path=None, save_pic_name=None, save_type="jpg"):
         """
         [子函数]保存图片
@@ -568,24 +1500,174 @@ class biliVideo:
 # b站评论相关操作(目前已实现发布评论功能， todo: 爬取评论)
 class biliReply:
     """暂时只支持视频评论"""
-    def __init__(self, bv=None, av=None):
+    REPLY_COLUMNS = ["rpid", "root", "parent", "oid", "mid", "uname", "ctime", "like", "rcount", "message"]
+
+    def __init__(self, bv=None, av=None, session=None):
         """
         :param bv: bv号(bv号和av号有且只能有一个不为None)
         :param av: av号(bv号和av号有且只能有一个不为None)
+        :param session: 共享会话，不指定则使用get_bili_session()
         """
         self.bv = bv
+        self.session = session if session is not None else get_bili_session()
         self.headers = {
-            "User-Agent": useragent().pcChrome,
-            "Cookie": cookies().bilicookie,
             'referer': f'https://www.bilibili.com/video/{self.bv}'
         }
         if av is None:
             if self.bv is None:
                 raise ValueError("bv和av不能同时为None")
             else:
-                self.av = BV2AV().bv2av(self.bv)
+                self.av = _bv2av.bv2av(self.bv)
         else:
             self.av = av
+        self.url_reply_main = "https://api.bilibili.com/x/v2/reply/main"
+        self.url_reply_sub = "https://api.bilibili.com/x/v2/reply/reply"
+        self.failures = []  # 最近一次iter_replies中失败的子评论页，[{"root": .., "pn": .., "error": ..}]
+
+    def _reply_row(self, reply):
+        """[子函数]把接口返回的一条评论转成一行，列见REPLY_COLUMNS"""
+        return {
+            "rpid": reply["rpid"],
+            "root": reply["root"],  # 一级评论为0
+            "parent": reply["parent"],
+            "oid": self.av,
+            "mid": reply["mid"],
+            "uname": reply["member"]["uname"],
+            "ctime": reply["ctime"],
+            "like": reply["like"],
+            "rcount": reply.get("rcount", 0),
+            "message": reply["content"]["message"],
+        }
+
+    def _get_reply_page(self, next_cursor=0, ps=20):
+        """
+        [子函数]按时间从新到旧获取一页一级评论
+        文档：https://socialsisteryi.github.io/bilibili-API-collect/docs/comment/list.html
+        :param next_cursor: 游标，第一页为0，之后用上一页返回的cursor["next"]
+        :return: (评论的list, cursor)
+        """
+        params = {"type": 1, "oid": self.av, "mode": 2, "next": next_cursor, "ps": ps}
+        r = self.session.get(url=self.url_reply_main, headers=self.headers, params=params)
+        reply_data = _json(r, self.session)
+        if reply_data["code"] != 0:
+            raise ValueError(f"获取评论失败，错误信息{reply_data}")
+        return reply_data["data"].get("replies") or [], reply_data["data"]["cursor"]
+
+    def _get_sub_reply_page(self, root, pn, ps=20):
+        """
+        [子函数]获取一级评论root下的第pn页子评论
+        :return: 行的list
+        """
+        params = {"type": 1, "oid": self.av, "root": root, "pn": pn, "ps": ps}
+        r = self.session.get(url=self.url_reply_sub, headers=self.headers, params=params)
+        reply_data = _json(r, self.session)
+        if reply_data["code"] != 0:
+            raise ValueError(f"获取{root}的子评论第{pn}页失败，错误信息{reply_data}")
+        return [self._reply_row(reply) for reply in reply_data["data"].get("replies") or []]
+
+    def iter_replies(self, concurrency=4, sub_replies=True, since_rpid=None, ps=20):
+        """
+        按时间从新到旧逐条产出评论(一级评论和子评论)。一级评论只能按游标一页一页往后翻，在当前线程里请求；
+        子评论页交给线程池并发请求，和翻一级评论同时进行。排队和在飞的子评论页都有上限，所以评论再多内存占用也不变
+        [使用方法]:
+            for row in biliReply(bv="BV1Ss421M7VJ").iter_replies(concurrency=4):
+                print(row["rpid"], row["message"])
+        :param concurrency: 同时请求的子评论页数
+        :param sub_replies: 是否获取子评论
+        :param since_rpid: 只获取rpid比它大(也就是比它新)的一级评论及其子评论，用于增量更新
+        :param ps: 每页项数
+        :return: 生成器，dict，列见REPLY_COLUMNS。失败的子评论页记在self.failures里
+        """
+        self.failures = []
+        jobs = deque()  # 等待请求的(root, pn)
+        pending = {}  # Future -> (root, pn)
+        next_cursor, is_end = 0, False
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                while jobs and len(pending) < concurrency * 2:
+                    root, pn = jobs.popleft()
+                    pending[executor.submit(profiler.wrap(self._get_sub_reply_page), root, pn, ps)] = (root, pn)
+                # 排队的子评论页不多时才继续翻一级评论，否则先等子评论
+                if not is_end and len(jobs) < concurrency * 8:
+                    replies, cursor = self._get_reply_page(next_cursor, ps)
+                    next_cursor, is_end = cursor["next"], cursor["is_end"] or not replies
+                    for reply in replies:
+                        if since_rpid is not None and reply["rpid"] <= since_rpid:
+                            is_end = True  # 再往后都是上次已经获取过的
+                            break
+                        yield self._reply_row(reply)
+                        if sub_replies and reply.get("rcount"):
+                            jobs.extend((reply["rpid"], pn) for pn in range(1, math.ceil(reply["rcount"] / ps) + 1))
+                    continue
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    root, pn = pending.pop(future)
+                    try:
+                        rows = future.result()
+                    except Exception as e:
+                        self.failures.append({"root": root, "pn": pn, "error": repr(e)})
+                        continue
+                    yield from rows
+
+    def crawl_replies(self, path=None, concurrency=4, sub_replies=True, incremental=True, batch_size=1000,
+                      fmt="jsonl"):
+        """
+        把评论写进只追加的分段(SegmentSink)，按rpid去重。内存里只有当前这一批，评论再多占用也不变：
+        去重用的是磁盘上的sqlite表(seen_rpid.sqlite)，不把所有rpid放进内存。
+        上一次完整获取结束时会记下最新的一级评论rpid，incremental=True时只获取比它新的一级评论；
+        上一次中途中断的话没有这个记录，会从头再翻一遍，但已经保存的rpid不会重复写入
+        [使用方法]:
+            biliR = biliReply(bv="BV1Ss421M7VJ")
+            biliR.crawl_replies(concurrency=4)  # 之后再调用就是增量更新
+            df = SegmentSink("output/replies/BV1Ss421M7VJ").to_dataframe()
+        [注意]增量更新只会获取新的一级评论及其子评论，旧的一级评论下新增的子评论需要incremental=False重新翻一遍
+        :param path: 存储目录，默认为f"output/replies/{bv或av}"
+        :param concurrency: 同时请求的子评论页数
+        :param sub_replies: 是否获取子评论
+        :param incremental: 是否增量更新
+        :param batch_size: 每个分段的行数
+        :param fmt: 分段格式，同SegmentSink。parquet更省空间但需要pyarrow。同一个目录换了格式也能接着写，旧的分段按原来的格式读
+        :return: 本次新写入的行数
+        """
+        if path is None:
+            path = f"output/replies/{self.bv or self.av}"
+        sink = SegmentSink(path, fmt=fmt, batch_size=batch_size)
+        state_path = os.path.join(path, "crawl_state.json")
+        since_rpid = None
+        if incremental and os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                since_rpid = json.load(f)["newest_rpid"]
+        seen = sqlite3.connect(os.path.join(path, "seen_rpid.sqlite"))
+        seen.execute("CREATE TABLE IF NOT EXISTS seen (rpid INTEGER PRIMARY KEY)")
+        newest_rpid = since_rpid
+        batch, count = [], 0
+
+        def save():
+            sink.write(batch)
+            seen.commit()  # 分段写完再提交，中途被杀最多下次重复写入几条，不会漏
+            batch.clear()
+
+        try:
+            for row in self.iter_replies(concurrency=concurrency, sub_replies=sub_replies, since_rpid=since_rpid):
+                if seen.execute("INSERT OR IGNORE INTO seen (rpid) VALUES (?)", (row["rpid"],)).rowcount == 0:
+                    continue  # 已经保存过
+                if row["root"] == 0 and (newest_rpid is None or row["rpid"] > newest_rpid):
+                    newest_rpid = row["rpid"]
+                batch.append(row)
+                count += 1
+                if len(batch) >= batch_size:
+                    save()
+        finally:
+            save()  # 中途出错也把已经获取的保存下来
+            seen.close()
+        if self.failures:
+            print(CT(f"{len(self.failures)}页子评论获取失败，见self.failures，这次不记录增量进度").red())
+        elif newest_rpid is not None:
+            with open(state_path, 'w', encoding='utf-8') as f:
+                json.dump({"newest_rpid": newest_rpid}, f)
+        return count
 
     def send_reply(self, message):
         """
@@ -603,12 +1685,12 @@ class biliReply:
             "plat": 1,
             "csrf": cookies().bili_jct  # CSRF Token是cookie中的bili_jct
         }
-        r = requests.post(url=post_url, headers=self.headers, data=post_data)
-        reply_data = r.json()
+        r = self.session.post(url=post_url, headers=self.headers, data=post_data)
+        reply_data = _json(r, self.session)
         if reply_data["code"] != 0:
             print(f"评论失败，错误码{reply_data['code']}，"
                   f"请查看'https://socialsisteryi.github.io/bilibili-API-collect/docs/comment/action.html'获取错误码信息")
-            biliLoginState(self.headers).get_login_state()
+            biliLoginState(self.headers, session=self.session).get_login_state()
         else:
             print("评论成功")
             print("评论rpid：", reply_data["data"]["rpid"])
@@ -617,10 +1699,12 @@ class biliReply:
 
 # b站私信功能
 class biliMessage:
-    def __init__(self):
+    def __init__(self, session=None):
+        """
+        :param session: 共享会话，不指定则使用get_bili_session()
+        """
+        self.session = session if session is not None else get_bili_session()
         self.headers = {
-            "User-Agent": useragent().pcChrome,
-            "Cookie": cookies().bilicookie,
             'referer': 'https://message.bilibili.com/'
         }
 
@@ -655,8 +1739,8 @@ class biliMessage:
             # 'csrf_token': cookies().bili_jct,
             'csrf': cookies().bili_jct
         }
-        r = requests.post(url, data=data, headers=self.headers)
-        r_json = r.json()
+        r = self.session.post(url, data=data, headers=self.headers)
+        r_json = _json(r, self.session)
         if r_json['code'] == 0:
             msg_content = r_json['data']['msg_content']
             content_dict = json.loads(msg_content)
@@ -667,13 +1751,14 @@ class biliMessage:
 
 # b站的一些排行榜(目前建议只使用get_popular，其余的不太行的样子)
 class biliRank:
-    def __init__(self):
-        self.headers = {
-            "User-Agent": useragent().pcChrome,
-            "Cookie": cookies().bilicookie,
-        }
+    def __init__(self, session=None):
+        """
+        :param session: 共享会话，不指定则使用get_bili_session()
+        """
+        self.session = session if session is not None else get_bili_session()
+        self.headers = {}  # User-Agent与Cookie在session里
         self.headers_no_cookie = {
-            "User-Agent": useragent().pcChrome,
+            "Cookie": None,  # 值为None时会去掉session里的Cookie
         }
         self.url_popular = "https://api.bilibili.com/x/web-interface/popular"
         self.url_ranking = "https://api.bilibili.com/x/web-interface/ranking/v2"
@@ -685,68 +1770,114 @@ class biliRank:
         文档：https://socialsisteryi.github.io/bilibili-API-collect/docs/video_ranking/popular.html
         [使用方法]:
             bvs = biliRank().get_popular()
-        [注意]可以使用下面的方法获取热门视频列表：
-            bvs = []
-            for i in range(1, 6):
-                bvs.extend(biliRank().get_popular(pn=i))
-            print(bvs)
+        [注意]需要多页时用iter_popular，它会并发请求并去重：
+            bvs = [video["bvid"] for video in biliRank().iter_popular(max_pages=5)]
         :param use_cookie: 是否使用cookie
         :param pn: 页码
         :param ps: 每页项数
         :return: 视频的bv号列表
         """
+        videos, _ = self._popular_page(use_cookie, pn, ps)
+        # 将BV号用list返回
+        return [video['bvid'] for video in videos]
+
+    def _popular_page(self, use_cookie, pn, ps):
+        """
+        [子函数]请求一页综合热门
+        :return: (视频信息的list, 是否没有下一页了)
+        """
         params = {
             "pn": pn,
             "ps": ps
         }
         if use_cookie:
-            r = requests.get(url=self.url_popular, headers=self.headers, params=params)
+            r = self.session.get(url=self.url_popular, headers=self.headers, params=params)
         else:
-            r = requests.get(url=self.url_popular, headers=self.headers_no_cookie, params=params)
-        popular_data = r.json()
-        # print("热门视频：")
-        # for i, video in enumerate(popular_data["data"]["list"]):
-        #     print(f"{i+1}.{video['bvid']} {video['title']}")
-        # 将BV号用list返回
-        return [video['bvid'] for video in popular_data["data"]["list"]]
+            r = self.session.get(url=self.url_popular, headers=self.headers_no_cookie, params=params)
+        popular_data = _json(r, self.session)
+        if popular_data["code"] != 0:
+            raise ValueError(f"获取综合热门第{pn}页失败，错误信息{popular_data}")
+        data = popular_data["data"]
+        return data["list"], data.get("no_more", False)
 
-    def get_ranking(self, tid=None):
+    def iter_popular(self, max_pages=10, concurrency=4, ps=20, use_cookie=True, verbose=False):
+        """
+        逐个产出综合热门视频的完整信息(标题、up主、播放数等都在里面，不需要再请求一次)。
+        同时请求concurrency页，但按页码顺序产出；不同页里重复的视频只产出一次；某页不满ps条或者接口说没有下一页时就停止
+        [使用方法]:
+            for video in biliRank().iter_popular(max_pages=5, concurrency=4):
+                print(video["bvid"], video["title"], video["stat"]["view"])
+        :param max_pages: 最多请求多少页
+        :param concurrency: 同时请求的页数
+        :param ps: 每页项数
+        :param use_cookie: 是否使用cookie
+        :param verbose: 是否打印每个视频
+        :return: 生成器，视频信息dict
+        """
+        seen = set()
+        next_pn = 1
+        pending = {}  # 页码 -> Future
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for pn in range(1, max_pages + 1):
+                # 始终保持concurrency页在飞
+                while next_pn <= max_pages and len(pending) < concurrency:
+                    pending[next_pn] = executor.submit(profiler.wrap(self._popular_page), use_cookie, next_pn, ps)
+                    next_pn += 1
+                videos, no_more = pending.pop(pn).result()
+                for video in videos:
+                    if video["bvid"] in seen:
+                        continue
+                    seen.add(video["bvid"])
+                    if verbose:
+                        print(f"{len(seen)}.{video['bvid']} {video['title']}")
+                    yield video
+                if no_more or len(videos) < ps:
+                    break
+            for future in pending.values():
+                future.cancel()  # 已经发出去的请求没法取消，只取消还没开始的
+
+    def get_ranking(self, tid=None, verbose=False):
         """
         获取排行榜视频列表：https://www.bilibili.com/v/popular/rank/all
         [使用方法]:
-            biliRank().get_ranking()
+            biliRank().get_ranking(verbose=True)
         :param tid: [有问题]分区id，但似乎不起作用。文档: https://socialsisteryi.github.io/bilibili-API-collect/docs/video/video_zone.html
+        :param verbose: 是否打印排行榜
         :return: 视频的bv号列表
         """
         if tid is not None:
-            r = requests.get(url=self.url_ranking, headers=self.headers, params={"tid": tid})
+            r = self.session.get(url=self.url_ranking, headers=self.headers, params={"tid": tid})
         else:
-            r = requests.get(url=self.url_ranking, headers=self.headers)
-        ranking_data = r.json()
-        print("排行榜：")
-        for i, video in enumerate(ranking_data["data"]["list"]):
-            print(f"{i+1}.{video['bvid']} {video['title']}")
+            r = self.session.get(url=self.url_ranking, headers=self.headers)
+        ranking_data = _json(r, self.session)
+        if verbose:
+            print("排行榜：")
+            for i, video in enumerate(ranking_data["data"]["list"]):
+                print(f"{i+1}.{video['bvid']} {video['title']}")
         return [video['bvid'] for video in ranking_data["data"]["list"]]
 
-    def get_new(self, rid=1, pn=1, ps=5):
+    def get_new(self, rid=1, pn=1, ps=5, verbose=False):
         """
         [有问题]获取新视频列表，但似乎不是最新的，目前不知道是干什么的
         [使用方法]:
-            biliRank().get_new()
+            biliRank().get_new(verbose=True)
         :param rid: [必要]目标分区tid
         :param pn: 页码
         :param ps: 每页项数
+        :param verbose: 是否打印新视频
+        :return: 视频的bv号列表
         """
         params = {
             "rid": rid,
             "pn": pn,
             "ps": ps
         }
-        r = requests.get(url=self.url_new, headers=self.headers, params=params)
-        new_data = r.json()
-        print("新视频：")
-        for i, video in enumerate(new_data["data"]["archives"]):
-            print(f"{i+1}.{video['bvid']} {video['title']}")
+        r = self.session.get(url=self.url_new, headers=self.headers, params=params)
+        new_data = _json(r, self.session)
+        if verbose:
+            print("新视频：")
+            for i, video in enumerate(new_data["data"]["archives"]):
+                print(f"{i+1}.{video['bvid']} {video['title']}")
         return [video['bvid'] for video in new_data["data"]["archives"]]
 
 if __name__ == '__main__':
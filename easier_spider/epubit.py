@@ -9,25 +9,177 @@
 # 右侧工具栏
 # 目录：https://labs.epubit.com/pubcloud/content/front/ebookFolderTree?projectId=27be6d78-dc2b-43fb-a9f0-cf76723af3ca
 # 搜索：https://labs.epubit.com/pubcloud/content/front/ebookSearch?keyword=&page=1&size=5&tag=&projectType=&projectId=27be6d78-dc2b-43fb-a9f0-cf76723af3ca
-# 应该做一个目录的功能，但是我现在好懒啊
+# 已经下载的书可以用update_epubit_index建立本地索引，再用search_epubit_books离线搜索
+# 目录用于get_whole_content_by_tree：先拿到所有folderId再并发获取
 
+import hashlib
+import html
+import json
 import os
-import random
 import re
-import time
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
 from easier_spider.config import useragent, epubitcookies
+from easier_tools.easy_session import EasySession
+from easier_tools.easy_download import stream_download
+from easier_tools.epub_writer import EpubWriter
+from easier_tools.rate_limiter import AdaptiveRateLimiter
+from easier_tools.journal import AppendJournal
+from easier_tools.retry import RetryPolicy, RetryableError, FatalError, RetryError
+from easier_tools.text_index import TextIndex
+from easier_tools.timer import profiler
+
+EPUB_CSS = """
+p.zw { text-indent: 2em; margin: 1em 0; line-height: 180%; }
+p.footnote { margin: 1em 0; font-size: 80%; line-height: 180%; background-color: #EFF8FB; }
+.img { max-width: 80%; display: block; margin: auto; }
+p.图题 { text-align: center; }
+"""
+
+
+def _section_title(content):
+    """[子函数]取一节里第一个标题的文字，没有标题返回None"""
+    for fragment in content:
+        match = re.search(r"<h[1-6][^>]*>(.*?)</h[1-6]>", fragment, re.S)
+        if match:
+            title = re.sub(r"<[^>]+>", "", match.group(1)).strip()
+            if title:
+                return title
+    return None
+
+
+def _html2text(content):
+    """[子函数]把一节的html片段转成纯文本"""
+    return html.unescape(re.sub(r"<[^>]+>", "", "\n".join(content)))
+
+
+def _read_journal_lines(path, start):
+    """
+    [子函数]从start偏移开始读日志，只读完整的行(另一个进程可能正在追加)
+    :return: 生成器，(offset, record, 这一行结束的偏移)
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            if line.strip():
+                yield offset, json.loads(line), offset + len(line)
+            offset += len(line)
+
+
+def update_epubit_index(root="output/epubit", index_path="output/epubit_index"):
+    """
+    增量建立本地全文索引：每本书的日志只读上次索引之后追加的部分，所以可以在下载过程中随时调用
+    [使用方法]:
+        update_epubit_index()
+        for result in search_epubit_books("卷积神经网络"):
+            print(result["book"], result["title"], result["snippet"])
+    :param root: epubit的输出目录
+    :param index_path: 索引目录
+    :return: 本次新索引的节数
+    """
+    index = TextIndex(index_path)
+    added = 0
+    for book in sorted(os.listdir(root)):
+        for name in ("journal.jsonl", "journal_tree.jsonl"):
+            path = os.path.join(root, book, name)
+            if not os.path.exists(path):
+                continue
+            for offset, record, end in _read_journal_lines(path, index.state.get(path, 0)):
+                index.state[path] = end
+                if "failure" in record or not record["content"]:
+                    continue
+                index.add([book, record["folderId"]], _html2text(record["content"]), book=book,
+                          folderId=record["folderId"], title=_section_title(record["content"]),
+                          journal=path, offset=offset)
+                added += 1
+    index.commit()
+    index.close()
+    return added
+
+
+def search_epubit_books(query, index_path="output/epubit_index", limit=20, context=30):
+    """
+    离线搜索已经下载的书。先用索引找出候选的节，再用原文核对并截取片段
+    :param query: 查询文本，空格分隔的多个词需要同时出现
+    :param index_path: 索引目录
+    :param limit: 最多返回多少条
+    :param context: 片段里匹配处前后各保留多少字
+    :return: list，[{"book": 书名, "folderId": .., "title": 节标题, "snippet": 片段}]
+    """
+    words = [word.lower() for word in query.split()]
+    index = TextIndex(index_path)
+    results = []
+    for meta in index.search(query):
+        with open(meta["journal"], 'rb') as f:
+            f.seek(meta["offset"])
+            record = json.loads(f.readline())
+        text = _html2text(record["content"])
+        lower = text.lower()
+        positions = [lower.find(word) for word in words]
+        if not words or -1 in positions:
+            continue  # 分词命中但原文里不连续
+        start = positions[0]
+        snippet = text[max(0, start - context):start + len(words[0]) + context].replace("\n", " ")
+        results.append({"book": meta["book"], "folderId": meta["folderId"], "title": meta["title"],
+                        "snippet": snippet})
+        if len(results) >= limit:
+            break
+    index.close()
+    return results
+
+
+def _file_sha256(path):
+    """[子函数]分块计算文件的sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _flatten_folder_tree(nodes):
+    """
+    [子函数]把ebookFolderTree返回的data先序展开。data是节点的list，每个节点是
+        {"folderId": "...", "folderName": "标题", "children": [子节点, ...]}，叶子节点的children为空list或null。
+    形状不对时直接报错，不猜字段名：猜错了只会得到空的或者缺节的目录，整本书悄悄少掉几节
+    :param nodes: list
+    :return: list，[(folderId, 标题)]
+    :raises ValueError: 返回的不是上面的形状
+    """
+    if not isinstance(nodes, list):
+        raise ValueError(f"目录应该是节点的list，实际是{type(nodes).__name__}: {str(nodes)[:200]}")
+    result = []
+    for node in nodes:
+        if not isinstance(node, dict) or not isinstance(node.get("folderId"), str) or not node["folderId"] \
+                or "folderName" not in node:
+            raise ValueError(f"目录节点应该有folderId和folderName，实际是{str(node)[:200]}")
+        result.append((node["folderId"], node["folderName"]))
+        children = node.get("children")
+        if children is not None:
+            result.extend(_flatten_folder_tree(children))
+    return result
+
 
 class epubit:
-    def __init__(self, pid, book_name="temp"):
+    def __init__(self, pid, book_name="temp", limiter=None, img_workers=8, retry=None):
         """
         初始化
         :param pid: 这个是书的ID，也就是下文参数里的projectId
         :param book_name: 书名，可选参数，默认为temp，以后有空再做自动获取书名的功能
+        :param limiter: 可选，AdaptiveRateLimiter。不指定则labs.epubit.com每秒最多0.2次(和以前写死的sleep平均下来差不多)，
+            被限流后自动降速，之后慢慢恢复，但不会超过这个上限
+        :param img_workers: 下载图片的线程数。图片在单独的线程池里下载，不占用文字接口的速率，也不阻塞get_content
+        :param retry: 可选，RetryPolicy。不指定则每个请求最多试5次，指数退避加抖动，单个请求最多耗时10分钟
         """
         self.url_content = "https://labs.epubit.com/pubcloud/content/front/getContentsByFolderId"
+        self.url_folder_tree = "https://labs.epubit.com/pubcloud/content/front/ebookFolderTree"
+        self.url_next_section = "https://labs.epubit.com/pubcloud/content/front/nextNotNullSection"
+        self.url_img = "https://cdn.ptpress.cn/"  # 图片地址是它加上pubcloud/...
         self.pid = pid
         self.book_name = book_name
         self.book_path = None
@@ -38,8 +190,30 @@ class epubit:
             "origin-domain": "labs.epubit.com",  # 这个不加就直接寄
             "host": "labs.epubit.com",  # 该参数似乎可以不加，但是先留着吧
         }
+        # 代替原来写死的sleep：以前每节1.2秒，外加每5、17、37、73节一次的长暂停，平均每节约10.7秒、2个请求，
+        # 所以上限定在每秒0.2次；返回的不是json或code不为'0'时减速并暂停，正常返回时慢慢恢复到上限
+        self.limiter = limiter if limiter is not None else AdaptiveRateLimiter(
+            host_rates={"labs.epubit.com": 0.2}, max_rate=0.2, increase=0.01, cooldown=22)
+        self.session = EasySession(limiter=self.limiter)  # headers里有host，所以不作为默认请求头，图片CDN不带它
+        self.retry = retry if retry is not None else RetryPolicy(max_attempts=5, base_delay=5, max_delay=120,
+                                                                 deadline=600)
+        self.failures = []  # 最近一次get_whole_content*中失败的节，[{"key": folderId, "error": .., "attempts": .., ...}]
+
+        self.img_workers = img_workers
+        self._img_executor = None
+        self._img_futures = {}  # 图片名 -> Future，同一张图只提交一次
+        self._img_lock = threading.Lock()
 
         self._init_book_path()
+        self._img_manifest = AppendJournal(f"{self.book_path}/img/manifest.jsonl")
+        self._img_sizes = {}  # 图片名 -> 下载完成后的大小
+        self._img_hashes = {}  # 图片名 -> 下载完成后的sha256
+        self._img_srcs = {}  # 图片名 -> pubcloud/...，包括提交了但还没下载完的
+        for record in self._img_manifest:
+            self._img_srcs[record["name"]] = record["src"]
+            if "size" in record:
+                self._img_sizes[record["name"]] = record["size"]
+                self._img_hashes[record["name"]] = record.get("sha256")
 
     def _init_book_path(self):
         self.book_path = f"output/epubit/{self.book_name}"
@@ -47,11 +221,128 @@ class epubit:
             os.makedirs(self.book_path)
             os.makedirs(f"{self.book_path}/img")
 
+    def _submit_img(self, editingContent):
+        """
+        [子函数]把图片交给图片线程池下载，不等待下载完成
+        :param editingContent: pubcloud/...形式的图片路径
+        :return: 图片名
+        """
+        img_name = editingContent.split("/")[-1]
+        with self._img_lock:
+            if img_name in self._img_futures:
+                return img_name
+            if self._img_executor is None:
+                self._img_executor = ThreadPoolExecutor(max_workers=self.img_workers)
+            self._img_futures[img_name] = self._img_executor.submit(profiler.wrap(self._save_img), editingContent,
+                                                                    img_name)
+            submitted = img_name in self._img_srcs
+            self._img_srcs[img_name] = editingContent
+        if not submitted:
+            # 先记下提交过这张图，这样文字写进日志后进程被杀，下次wait_images时还能补下载
+            self._img_manifest.append({"name": img_name, "src": editingContent})
+        return img_name
+
+    def _save_img(self, editingContent, img_name):
+        """
+        [子函数]下载一张图片。已经下载过且大小和sha256都和manifest.jsonl里记录的一致就跳过，不一致就重新下载。
+        以前的版本下载的图片没有记录，非空的就认为是完整的，补记一条
+        :return: 图片的本地路径
+        """
+        img_local = f"{self.book_path}/img/{img_name}"
+        if os.path.exists(img_local):
+            size = os.path.getsize(img_local)
+            if img_name in self._img_sizes:
+                expected = self._img_hashes[img_name]
+                if size == self._img_sizes[img_name] and (expected is None or _file_sha256(img_local) == expected):
+                    return img_local
+            elif size > 0:
+                self._record_img(editingContent, img_name, img_local)
+                return img_local
+        stream_download(f"{self.url_img}{editingContent}", img_local, session=self.session)
+        self._record_img(editingContent, img_name, img_local)
+        return img_local
+
+    def _record_img(self, editingContent, img_name, img_local):
+        """[子函数]在manifest.jsonl里记下图片的大小和sha256"""
+        size, digest = os.path.getsize(img_local), _file_sha256(img_local)
+        self._img_manifest.append({"name": img_name, "src": editingContent, "size": size, "sha256": digest})
+        self._img_sizes[img_name] = size
+        self._img_hashes[img_name] = digest
+
+    def wait_images(self):
+        """
+        等待已经提交的图片下载完。上次运行提交了但没下载完的图片也会在这里补下载。
+        失败的图片会从记录里去掉，之后再遇到或再调用wait_images时会重新下载
+        [使用方法]:
+            content = ep.get_content(folderId)
+            failures = ep.wait_images()
+        :return: dict，{图片名: 异常}
+        """
+        with self._img_lock:
+            unfinished = [src for name, src in self._img_srcs.items()
+                          if name not in self._img_sizes and name not in self._img_futures]
+        for src in unfinished:
+            self._submit_img(src)
+        with self._img_lock:
+            futures = dict(self._img_futures)
+        failures = {}
+        for img_name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failures[img_name] = e
+                with self._img_lock:
+                    self._img_futures.pop(img_name, None)
+        if failures:
+            warnings.warn(f"{len(failures)}张图片下载失败：{failures}")
+        return failures
+
+    def close(self):
+        """
+        等所有图片下载完，然后关闭图片线程池。之后再获取内容会自动新建线程池
+        [使用方法]:
+            with epubit(pid, "书名") as ep:
+                ep.get_content(folderId)  # 离开with时等图片下载完
+        :return: dict，{图片名: 异常}，同wait_images()
+        """
+        failures = self.wait_images()
+        with self._img_lock:
+            executor, self._img_executor = self._img_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        return failures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return False
+        # 出错时不再等排队的图片，正在下载的下完就停；没下完的都在manifest.jsonl里，下次wait_images会补
+        with self._img_lock:
+            executor, self._img_executor = self._img_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return False
+
     def get_content(self, folderId):
         """
-        获取pid书的folderId页面
+        获取pid书的folderId页面，失败时按self.retry重试
         :param folderId: 页面id
         :return: list，书的内容，list的元素是html格式
+        :raises RetryError: 重试后仍然失败，e.failure是结构化的失败信息
+        """
+        return self.retry.call(self._fetch_content, folderId, key=folderId, on_retry=self._warn_retry)
+
+    @staticmethod
+    def _warn_retry(attempt, e, wait):
+        warnings.warn(f"第{attempt}次请求失败，{wait:.1f}秒后重试，错误信息{e}")
+
+    def _fetch_content(self, folderId):
+        """
+        [子函数]请求一次folderId页面，不重试
+        :raises RetryableError: 返回的不是json或者code不为'0'，一般是被限流了
         """
         img_list = []  # 图
         content_list = []  # 书
@@ -61,15 +352,14 @@ class epubit:
             "projectId": self.pid,
             "src": "normal"
         }
-        response = requests.get(self.url_content, headers=self.headers, params=params)
+        response = self.session.get(self.url_content, headers=self.headers, params=params)
         # print(response.json())
         try:
             r_json = response.json()
         except Exception as e:
-            warnings.warn(f"获取{folderId}的内容失败，错误信息{e}，返回值{response.text}")
-            # 等待一段时间再继续
-            time.sleep(66)
-            return self.get_content(folderId)
+            # 通知限速器降速，下次请求前会等待一段时间再继续
+            self.limiter.on_throttle(self.url_content, cooldown=66)
+            raise RetryableError(f"获取{folderId}的内容失败，错误信息{e}，返回值{response.text[:200]}")
         if r_json["code"] == '0':
             # print("获取成功")
             r_data = r_json["data"]
@@ -77,14 +367,9 @@ class epubit:
             for content in r_contents:
                 editingContent = content["editingContent"]
                 # 如果contet以pubcloud开头，以图片格式(png,jpg,jpeg,gif,webp)结尾(这个暂时不知道有多少格式，先不写)，那么就是图片。
-                # 保存图片到img文件夹，然后将图片的路径加入到content_list中
+                # 图片交给图片线程池保存到img文件夹，不等它下载完，直接将图片的路径加入到content_list中
                 if editingContent.startswith("pubcloud"):
-                    img_name = editingContent.split("/")[-1]
-                    img_local = f"{self.book_path}/img/{img_name}"
-                    img_response = requests.get(f"https://cdn.ptpress.cn/{editingContent}")
-                    # print(img_response.url)
-                    with open(img_local, "wb") as f:
-                        f.write(img_response.content)
+                    img_name = self._submit_img(editingContent)
                     content_list.append(f'<img src="img/{img_name}" class="img">')
                 else:
                     content_list.append(editingContent)
@@ -130,56 +415,275 @@ class epubit:
             #     warnings.warn(f"请注意图片未能全部填入到content_list中，缺少的图片是{img_list}")
             #     content_list.extend(img_list)  # 将剩余的图片加入到content_list中
         else:
-            warnings.warn(f"获取{folderId}的内容失败，错误信息{r_json}")
-            # 等待一段时间再继续
-            time.sleep(22)
-            return self.get_content(folderId)
+            # 通知限速器降速，下次请求前会等待一段时间再继续
+            self.limiter.on_throttle(self.url_content)
+            raise RetryableError(f"获取{folderId}的内容失败，错误信息{r_json}")
         return content_list
 
-    def get_whole_content(self, first_folderId, content=None):
+    def get_whole_content(self, first_folderId=None, content=None):
         """
-        获取整本书
-        :param first_folderId: 第一个folderId。断点续传时应该选用被10整除的那个folderId，因为每10次保存一次
-        :param content: 可选参数，断点续传时传入的content
+        获取整本书。每获取完一节就把(folderId, 下一节folderId, 内容)追加到日志f"{book_path}/journal.jsonl"里，
+        中途中断后再次调用会自动从日志里最后一节的下一节继续，全部获取完后才生成一次html。
+        某一节重试后仍然失败时记进日志和self.failures，接着获取下一节；获取下一节的folderId失败时没法往下走，
+        只能停下来，再次调用会从这里续传。整条链获取完后再次调用会重试之前失败的节。
+        [使用方法]:
+            ep = epubit("75044a69-f2c0-451f-8ca3-96e4b4f1987a", "深度学习案例精粹")
+            ep.get_whole_content("第一节的folderId")  # 中断后再次运行同样的代码即可续传
+        :param first_folderId: 第一个folderId。日志里已经有记录时会被忽略
+        :param content: 可选参数，兼容以前用html2content()续传的方式：日志为空时，把它作为已经获取的内容写进日志，
+            并从first_folderId继续获取
         :return: list, content
         """
-        content_list = []
-        if content:
-            content_list.extend(content)
-
-        current_folderId = first_folderId
-        current_iter = 0  # 当前get_content次数
-        while True:
-            content = self.get_content(current_folderId)
-            content_list.extend(content)
-
-            current_folderId = self._get_next_folderId(current_folderId)
-            if current_folderId == -1:
-                print("获取完毕")
-                break
+        journal = self.journal
+        last = journal.last()
+        if last is None:
+            if first_folderId is None:
+                raise ValueError("日志为空，需要指定first_folderId")
+            if content:
+                journal.append({"folderId": None, "next": first_folderId, "content": list(content)})
+            current_folderId = first_folderId
+        else:
+            current_folderId = last["next"]
+            if current_folderId != -1:
+                print(f"从日志续传，上次获取到{last['folderId']}，从{current_folderId}继续")
 
-            if current_iter % 10 == 0:
-                print(f"当前次数{current_iter}，当前folderId{current_folderId}")
-                self.content2html(content_list)  # 防止中途寄寄
+        self.failures = []
+        current_iter = 0  # 本次get_content次数
+        while current_folderId != -1:
+            record = {"folderId": current_folderId, "next": None, "content": []}
+            try:
+                record["content"] = self.get_content(current_folderId)
+            except RetryError as e:
+                warnings.warn(str(e))
+                record["failure"] = e.failure
+                self.failures.append(e.failure)
+            try:
+                record["next"] = self._get_next_folderId(current_folderId)
+            except RetryError as e:
+                warnings.warn(f"{e}，先停在这里，再次调用会从{current_folderId}续传")
+                self.failures.append(e.failure)
+                break
+            journal.append(record)
+            current_folderId = record["next"]
             current_iter += 1
-            print(f"\r当前次数{current_iter}", end="")
-            self._sleep_in_get_whole_content(current_iter)
+            print(f"\r当前次数{current_iter}，当前速率{self.limiter.rates()}", end="")
+        else:
+            # 整条链获取完了，重试之前失败的节。追加的记录next为-1，续传时仍然认为已经获取到结尾
+            for folderId in self._failed_folderIds(journal):
+                if folderId in {failure["key"] for failure in self.failures}:
+                    continue  # 本次刚失败过的不再重试
+                try:
+                    journal.append({"folderId": folderId, "next": -1, "content": self.get_content(folderId)})
+                except RetryError as e:
+                    warnings.warn(str(e))
+                    self.failures.append(e.failure)
+        print("获取完毕" if not self.failures else f"获取完毕，{len(self.failures)}处失败，见self.failures")
+        self.wait_images()
+        content_list = self.journal2content()
+        self.content2html(content_list)
+        return content_list
+
+    def get_folder_tree(self):
+        """
+        获取目录(ebookFolderTree)，按阅读顺序(先序遍历)展开成列表
+        [使用方法]:
+            for folderId, name in ep.get_folder_tree():
+                print(folderId, name)
+        :return: list，[(folderId, 标题)]
+        :raises RetryError: 重试后仍然失败，或者目录的格式不对(不重试)
+        """
+        return self.retry.call(self._fetch_folder_tree, key=self.pid, on_retry=self._warn_retry)
+
+    def _fetch_folder_tree(self):
+        """[子函数]请求一次ebookFolderTree，不重试"""
+        response = self.session.get(self.url_folder_tree, headers=self.headers, params={"projectId": self.pid})
+        try:
+            r_json = response.json()
+        except Exception as e:
+            self.limiter.on_throttle(self.url_folder_tree)
+            raise RetryableError(f"获取目录失败，错误信息{e}，返回值{response.text[:200]}")
+        if r_json["code"] != "0":
+            raise FatalError(f"获取目录失败，错误信息{r_json}")
+        try:
+            tree = _flatten_folder_tree(r_json["data"])
+        except (KeyError, ValueError) as e:
+            raise FatalError(f"目录的格式和预期的不一样，错误信息{e}") from e
+        if not tree:
+            raise FatalError(f"目录是空的，返回值{str(r_json)[:200]}")
+        return tree
+
+    def get_whole_content_by_tree(self, concurrency=4, check_gaps=False):
+        """
+        先一次性获取目录，再并发获取各节，最后按目录顺序拼起来。总请求速率仍受self.limiter限制，
+        但不用等上一节返回才知道下一节是谁，所以耗时取决于并发数和速率，而不是一节一节的往返。
+        获取失败的节会退回nextNotNullSection，从它的上一节开始一节一节往后补，直到接上已经获取到的节。
+        默认只有失败的节附近会问nextNotNullSection，目录里漏掉的节只有紧挨着失败的节时才会被补上；
+        check_gaps=True时每一节都问一次下一节是谁，和目录对不上就补，能补上目录里任何地方漏掉的节，但请求数翻倍。
+        每节获取完就追加到日志f"{book_path}/journal_tree.jsonl"，中断后再次调用只获取缺的节。
+        补缺时仍然失败的节记进日志和self.failures，不会中断整本书。
+        [使用方法]:
+            ep = epubit("75044a69-f2c0-451f-8ca3-96e4b4f1987a", "深度学习案例精粹")
+            ep.get_whole_content_by_tree(concurrency=4)
+        :param concurrency: 同时获取的节数
+        :param check_gaps: 是否检查目录里漏掉的节
+        :return: list, content
+        """
+        tree = [folderId for folderId, _ in self.get_folder_tree()]
+        journal = self.tree_journal
+        done = {record["folderId"] for record in journal if "failure" not in record}
+        self.failures = []
+        todo = [(i, folderId) for i, folderId in enumerate(tree) if folderId not in done]
+        print(f"目录共{len(tree)}节，已获取{len(tree) - len(todo)}节")
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            get_content = profiler.wrap(self.get_content)
+            futures = {executor.submit(get_content, folderId): (i, folderId) for i, folderId in todo}
+            for n, future in enumerate(as_completed(futures)):
+                i, folderId = futures[future]
+                try:
+                    content = future.result()
+                except RetryError as e:
+                    warnings.warn(f"{e}，稍后按nextNotNullSection补上")
+                    failed.append(i)
+                    continue
+                journal.append({"folderId": folderId, "next": None, "content": content, "order": [i, 0]})
+                print(f"\r已获取{n + 1}/{len(todo)}，当前速率{self.limiter.rates()}", end="")
+        print()
+
+        # 补缺：从失败节的上一节开始顺着nextNotNullSection往后走，直到接上已经获取到的节。
+        # 起点是(从第几节之后开始问, 补上的第一节的order)：失败的第i节从它自己开始补，排在[i, 0]、[i, 1]...；
+        # check_gaps时每一节之后都问一次，第i节后面补上的节排在[i, 1]、[i, 2]...，在第i+1节[i+1, 0]之前
+        done = {record["folderId"] for record in journal if "failure" not in record}
+        starts = [(i - 1, (i, 0)) for i in failed]
+        if check_gaps:
+            starts += [(i, (i, 1)) for i in range(len(tree))]
+        for prev, (i, k) in sorted(starts):
+            if k == 0 and tree[i] in done:
+                continue
+            try:
+                next_folderId = tree[0] if prev == -1 else self._get_next_folderId(tree[prev])
+                while next_folderId != -1 and next_folderId not in done:
+                    record = {"folderId": next_folderId, "next": None, "content": [], "order": [i, k]}
+                    try:
+                        record["content"] = self.get_content(next_folderId)
+                        done.add(next_folderId)
+                    except RetryError as e:
+                        record["failure"] = e.failure
+                        self.failures.append(e.failure)
+                    journal.append(record)
+                    k += 1
+                    next_folderId = self._get_next_folderId(next_folderId)
+            except RetryError as e:
+                warnings.warn(f"{e}，第{i}节附近的缺口没能补上")
+                self.failures.append(e.failure)
+        print("获取完毕" if not self.failures else f"获取完毕，{len(self.failures)}处失败，见self.failures")
+        self.wait_images()
+        content_list = self.journal2content(journal)
         self.content2html(content_list)
+        return content_list
+
+    @property
+    def journal(self):
+        """这本书的断点续传日志(get_whole_content使用)"""
+        return AppendJournal(f"{self.book_path}/journal.jsonl")
+
+    @property
+    def tree_journal(self):
+        """按目录并发获取时的日志(get_whole_content_by_tree使用)，记录带有目录中的顺序order"""
+        return AppendJournal(f"{self.book_path}/journal_tree.jsonl")
+
+    def journal2content(self, journal=None):
+        """
+        从日志中读出整本书的content，可以随时调用，比如获取到一半时先生成html看看
+        [使用方法]:
+            ep.content2html(ep.journal2content())
+        :param journal: 默认为self.journal(按获取顺序)。为self.tree_journal时按目录顺序排序。
+            同一节有多条记录时(比如失败后重试成功)，放在第一次出现的位置，内容取最后一次成功的
+        :return: list, content
+        """
+        if journal is None:
+            journal = self.journal
+        content_list = []
+        for offset in self._journal_plan(journal):
+            content_list.extend(journal.read(offset)["content"])
+        return content_list
+
+    def journal2epub(self, journal=None, epub_path=None):
+        """
+        从日志流式生成EPUB，一节一个xhtml，图片从img文件夹打包进去。一次只读一节，内存占用和书的大小无关
+        [使用方法]:
+            ep.get_whole_content_by_tree()
+            ep.journal2epub(ep.tree_journal)
+        :param journal: 同journal2content
+        :param epub_path: 默认为f"{book_path}/{book_name}.epub"
+        :return: epub文件路径
+        """
+        if journal is None:
+            journal = self.journal
+        if epub_path is None:
+            epub_path = f"{self.book_path}/{self.book_name}.epub"
+        with EpubWriter(epub_path, self.book_name, css=EPUB_CSS, image_root=self.book_path) as epub:
+            for n, offset in enumerate(self._journal_plan(journal)):
+                content = journal.read(offset)["content"]
+                if content:
+                    epub.add_chapter(_section_title(content) or f"第{n + 1}节", content)
+        print(f"EPUB文件已保存为{epub_path}")
+        return epub_path
+
+    @staticmethod
+    def _journal_plan(journal):
+        """
+        [子函数]按journal2content的规则排好顺序，返回每节最终使用的那条记录在日志里的偏移，不把内容留在内存里
+        :return: list，偏移
+        """
+        first, latest, orders = [], {}, {}
+        for offset, record in journal.scan():
+            folderId = record["folderId"]
+            if folderId not in latest:
+                first.append(folderId)
+                latest[folderId] = offset
+                orders[folderId] = record.get("order")
+            elif "failure" not in record:
+                latest[folderId] = offset
+        if first and all(orders[folderId] is not None for folderId in first):
+            first.sort(key=lambda folderId: orders[folderId])
+        return [latest[folderId] for folderId in first]
+
+    @staticmethod
+    def _failed_folderIds(journal):
+        """[子函数]日志里失败了且之后没有重试成功的节"""
+        failed = {}
+        for record in journal:
+            if "failure" in record:
+                failed.setdefault(record["folderId"], True)
+            else:
+                failed[record["folderId"]] = False
+        return [folderId for folderId, is_failed in failed.items() if is_failed]
 
     def _get_next_folderId(self, folderId):
-        url = f"https://labs.epubit.com/pubcloud/content/front/nextNotNullSection?folderId={folderId}&projectId={self.pid}"
-        response = requests.get(url, headers=self.headers)
+        """
+        获取下一节的folderId，失败时按self.retry重试
+        :return: 下一节的folderId，已经是最后一节时返回-1
+        :raises RetryError: 重试后仍然失败
+        """
+        return self.retry.call(self._fetch_next_folderId, folderId, key=folderId, on_retry=self._warn_retry)
+
+    def _fetch_next_folderId(self, folderId):
+        """[子函数]请求一次nextNotNullSection，不重试"""
+        params = {"folderId": folderId, "projectId": self.pid}
+        response = self.session.get(self.url_next_section, headers=self.headers, params=params)
         try:
             r_json = response.json()
         except Exception as e:
-            warnings.warn(f"获取{folderId}的next_folderId失败，错误信息{e}，返回值{response.text}")
-            exit(111)
+            self.limiter.on_throttle(self.url_next_section)
+            raise RetryableError(f"获取{folderId}的next_folderId失败，错误信息{e}，返回值{response.text[:200]}")
         if r_json["code"] == "0":
             return r_json["data"]
         elif r_json["code"] == "6":
             return -1  # 表示结尾
         else:
-            raise ValueError(f"获取{folderId}的next_folderId失败，错误信息{r_json}")
+            raise FatalError(f"获取{folderId}的next_folderId失败，错误信息{r_json}")
 
     def content2html(self, content):
         """
@@ -236,7 +740,7 @@ class epubit:
 
     def html2content(self, html_path):
         """
-        将html转化成content，一般用于断点续传
+        将html转化成content。以前用于断点续传，现在get_whole_content会自动从日志续传，一般不需要了
         :param html_path: html文件路径
         :return: list, content
         """
@@ -247,19 +751,15 @@ class epubit:
         # 将内容按行分割
         return html_content.split("\n")
 
-    def _sleep_in_get_whole_content(self, current_iter):
-        # 根据需求调整sleep时间
-        time.sleep(1.2)
-        if current_iter % 5 == 0:
-            time.sleep(random.uniform(8, 16))
-        if current_iter % 17 == 0:
-            time.sleep(random.uniform(20, 50))
-        if current_iter % 37 == 0:
-            time.sleep(random.uniform(100, 120))
-        if current_iter % 73 == 0:
-            time.sleep(random.uniform(140, 165))
-
-ep = epubit("75044a69-f2c0-451f-8ca3-96e4b4f1987a", "深度学习案例精粹")
-content = ep.html2content("output/epubit/深度学习案例精粹/深度学习案例精粹.html")  # 断点续传
-ep.get_whole_content("50454a93-ee9f-4190-baec-24610ae5bd29", content=content)  # 使用之前的content继续获取
+
+if __name__ == '__main__':
+    with epubit("75044a69-f2c0-451f-8ca3-96e4b4f1987a", "深度学习案例精粹") as ep:  # 退出时等图片下载完
+        # 以前用html断点续传的书，第一次运行时可以把html里的内容导入日志：
+        # content = ep.html2content("output/epubit/深度学习案例精粹/深度学习案例精粹.html")
+        # ep.get_whole_content("上次获取到的folderId", content=content)
+        ep.get_whole_content("50454a93-ee9f-4190-baec-24610ae5bd29")  # 中断后再次运行会从日志自动续传
+        # 或者先取目录再并发获取：
+        # ep.get_whole_content_by_tree(concurrency=4)
+        # 生成EPUB，比一个巨大的html打开快得多：
+        # ep.journal2epub()
 
@@ -0,0 +1,24 @@
+import os
+import shutil
+import subprocess
+
+
+def ffmpeg_mux(video_path, audio_path, out_path, ffmpeg=None):
+    """
+    用本地的ffmpeg把视频轨和音频轨合成一个文件，只复制流不重新编码，所以很快
+    [使用方法]:
+        ffmpeg_mux("BV1xx_video.mp4", "BV1xx_audio.m4a", "BV1xx.mp4")
+    :param video_path: 视频轨文件
+    :param audio_path: 音频轨文件
+    :param out_path: 输出文件
+    :param ffmpeg: ffmpeg可执行文件路径，不指定则在PATH里找
+    :return: 成功返回out_path，找不到ffmpeg返回None
+    """
+    ffmpeg = ffmpeg or shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    tmp_path = out_path + ".muxing" + os.path.splitext(out_path)[1]
+    subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-i", video_path, "-i", audio_path,
+                    "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", tmp_path], check=True)
+    os.replace(tmp_path, out_path)
+    return out_path
@@ -0,0 +1,315 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from easier_tools.timer import profiler
+
+
+class DownloadProgress:
+    """
+    [功能] 下载进度，作为progress回调的参数
+    [属性]
+        downloaded: 已下载字节数
+        total: 总字节数，服务器没给Content-Length时为None
+        elapsed: 已用时间(秒)
+        speed: 平均速度(字节/秒)
+    """
+    def __init__(self, total=None, downloaded=0):
+        """
+        :param total: 总字节数
+        :param downloaded: 续传时之前已经下好的字节数，不计入速度
+        """
+        self.total = total
+        self.downloaded = downloaded
+        self.resumed = downloaded
+        self.start_time = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()  # 分段下载时多个线程一起更新
+
+    def update(self, n):
+        with self._lock:
+            self.downloaded += n
+            self.elapsed = time.perf_counter() - self.start_time
+
+    @property
+    def speed(self):
+        return (self.downloaded - self.resumed) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        mb = self.downloaded / 1024 / 1024
+        speed = self.speed / 1024 / 1024
+        if self.total:
+            return f"{mb:.1f}/{self.total / 1024 / 1024:.1f}MB ({self.downloaded / self.total:.1%}) {speed:.2f}MB/s"
+        return f"{mb:.1f}MB {speed:.2f}MB/s"
+
+
+def print_progress(progress):
+    """默认的进度回调，在同一行刷新进度"""
+    print(f"\r下载中: {progress}", end="")
+    if progress.total is not None and progress.downloaded >= progress.total:
+        print()
+
+
+def stream_download(url, path, session=None, headers=None, chunk_size=1 << 20, progress=None):
+    """
+    流式下载到文件。每次只在内存里保留一个chunk，先写到path+".part"，下完再原子地重命名为path，
+    所以不管文件多大内存占用都不变，中途失败也不会留下不完整的目标文件。
+    [使用方法]:
+        stream_download(url, "output/BV1xx.mp4", session=session, progress=print_progress)
+    :param url: 下载地址
+    :param path: 保存路径
+    :param session: requests.Session，不指定则用requests
+    :param headers: 请求头
+    :param chunk_size: 每次读取的字节数
+    :param progress: 进度回调，参数是DownloadProgress
+    :return: DownloadProgress
+    """
+    http = session if session is not None else requests
+    tmp_path = path + ".part"
+    with http.get(url, headers=headers, stream=True) as r:
+        r.raise_for_status()
+        content_length = r.headers.get("Content-Length")
+        # 有Content-Encoding时iter_content给的是解压后的数据，长度对不上Content-Length
+        if content_length and not r.headers.get("Content-Encoding"):
+            state = DownloadProgress(int(content_length))
+        else:
+            state = DownloadProgress()
+        with open(tmp_path, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                state.update(len(chunk))
+                if progress is not None:
+                    progress(state)
+    if state.total is not None and state.downloaded != state.total:
+        raise IOError(f"下载不完整: {state.downloaded}/{state.total}字节，url={url}")
+    os.replace(tmp_path, path)
+    return state
+
+
+def probe_range(url, session=None, headers=None):
+    """
+    探测服务器是否支持Range请求
+    :return: 支持则返回{"total": 总字节数, "etag": ETag, "last_modified": Last-Modified}，不支持则返回None
+    """
+    http = session if session is not None else requests
+    probe_headers = dict(headers or {})
+    probe_headers["Range"] = "bytes=0-0"
+    with http.get(url, headers=probe_headers, stream=True) as r:
+        r.raise_for_status()
+        match = re.match(r"bytes\s+0-0/(\d+)", r.headers.get("Content-Range", ""))
+        if r.status_code != 206 or match is None:
+            return None
+        return {
+            "total": int(match.group(1)),
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
+
+
+def split_ranges(total, segments, min_segment_size=1 << 20):
+    """
+    把[0, total)切成最多segments段，每段不小于min_segment_size
+    :return: [(start, end)]，end是闭区间，和HTTP Range一致；total不大于0时为[]
+    """
+    if total <= 0:
+        return []
+    segments = max(1, min(segments, total // min_segment_size or 1))
+    step = -(-total // segments)  # 向上取整
+    return [(start, min(start + step, total) - 1) for start in range(0, total, step)]
+
+
+class PartialDownloadState:
+    """
+    [功能] 断点续传的状态，保存在f"{path}.part.json"里，记录地址、文件大小、ETag和已经下完的字节区间。
+        下载过程中每隔save_interval秒保存一次，进程被杀后重新运行只会请求缺的区间。
+    """
+    def __init__(self, state_path, url, total, etag=None, last_modified=None, done=None, save_interval=1.0):
+        self.state_path = state_path
+        self.url = url
+        self.total = total
+        self.etag = etag
+        self.last_modified = last_modified
+        self.done = done or []  # 已完成的区间[[start, end], ...]，闭区间，有序且不重叠
+        self.save_interval = save_interval
+        self._last_save = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, state_path):
+        """读取状态文件，不存在或损坏时返回None"""
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(state_path, data["url"], data["total"], data.get("etag"), data.get("last_modified"),
+                       data.get("done"))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def matches(self, info):
+        """判断探测到的文件和已下载的部分是不是同一个文件：大小必须一样，双方都有ETag时ETag也要一样"""
+        if info["total"] != self.total:
+            return False
+        if self.etag and info.get("etag") and self.etag != info["etag"]:
+            return False
+        return True
+
+    def mark(self, start, end):
+        """记录[start, end]已经写入文件"""
+        with self._lock:
+            merged = []
+            for s, e in self.done:
+                if e + 1 < start or end + 1 < s:
+                    merged.append([s, e])
+                else:
+                    start, end = min(s, start), max(e, end)
+            merged.append([start, end])
+            self.done = sorted(merged)
+
+    def done_bytes(self):
+        with self._lock:
+            return sum(e - s + 1 for s, e in self.done)
+
+    def missing_ranges(self, segments, min_segment_size=1 << 20):
+        """
+        还没下的区间，按大小把segments条连接分给各个空洞
+        :return: [(start, end)]
+        """
+        with self._lock:
+            gaps = []
+            pos = 0
+            for s, e in self.done:
+                if s > pos:
+                    gaps.append((pos, s - 1))
+                pos = max(pos, e + 1)
+            if pos < self.total:
+                gaps.append((pos, self.total - 1))
+        missing = sum(e - s + 1 for s, e in gaps)
+        ranges = []
+        for s, e in gaps:
+            n = max(1, round(segments * (e - s + 1) / missing))
+            ranges.extend((s + rs, s + re_) for rs, re_ in split_ranges(e - s + 1, n, min_segment_size))
+        return ranges
+
+    def save(self, force=False):
+        """保存状态。不是force时最多每save_interval秒写一次"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_save < self.save_interval:
+                return
+            self._last_save = now
+            data = {"url": self.url, "total": self.total, "etag": self.etag,
+                    "last_modified": self.last_modified, "done": self.done}
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.state_path)
+
+
+def _download_range(http, url, tmp_path, start, end, headers, chunk_size, partial, state, progress):
+    """[子函数]下载[start, end]写到文件对应的偏移处，每写一块就记进partial"""
+    range_headers = dict(headers or {})
+    range_headers["Range"] = f"bytes={start}-{end}"
+    with http.get(url, headers=range_headers, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError(f"服务器没有按Range返回，状态码{r.status_code}，url={url}")
+        pos = start
+        # 不带缓冲地写，记进partial的字节一定已经交给了系统，进程被杀也不会丢
+        with open(tmp_path, 'r+b', buffering=0) as f:
+            f.seek(start)
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                partial.mark(pos, pos + len(chunk) - 1)
+                pos += len(chunk)
+                partial.save()
+                state.update(len(chunk))
+                if progress is not None:
+                    progress(state)
+    if pos != end + 1:
+        raise IOError(f"分段bytes={start}-{end}不完整: {pos - start}/{end - start + 1}字节，url={url}")
+
+
+def segmented_download(url, path, session=None, headers=None, segments=4, chunk_size=1 << 20, progress=None,
+                       min_segment_size=1 << 20, resume=True, resolve_url=None):
+    """
+    多连接分段下载，支持断点续传。把文件按字节切成几段，每段一条连接并行下载，写进预先分配好大小的文件的对应偏移处。
+    下载过程中已完成的区间记在f"{path}.part.json"里，中途失败后再次调用只会下载缺的部分。
+    服务器不支持Range时自动退回stream_download单连接下载(这时无法续传)。
+    [使用方法]:
+        segmented_download(url, "output/BV1xx.mp4", session=session, segments=8, progress=print_progress)
+    :param url: 下载地址
+    :param path: 保存路径
+    :param session: requests.Session，不指定则用requests。连接池大小最好不小于segments
+    :param headers: 请求头
+    :param segments: 最多分几段(几条连接)，为1时也可以续传
+    :param chunk_size: 每次读取的字节数
+    :param progress: 进度回调，参数是DownloadProgress
+    :param min_segment_size: 每段最少的字节数，小文件不值得切太多段
+    :param resume: 是否从已有的.part文件继续下载
+    :param resolve_url: 可选，返回新下载地址的函数。地址过期(403/404/410)时会调用它换新地址，
+        并用文件大小和ETag确认还是同一个文件
+    :return: DownloadProgress
+    """
+    http = session if session is not None else requests
+    tmp_path = path + ".part"
+    state_path = path + ".part.json"
+
+    try:
+        info = probe_range(url, session=session, headers=headers)
+    except requests.HTTPError as e:
+        if resolve_url is None or e.response is None or e.response.status_code not in (403, 404, 410):
+            raise
+        url = resolve_url()
+        info = probe_range(url, session=session, headers=headers)
+    if info is None:
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return stream_download(url, path, session=session, headers=headers, chunk_size=chunk_size, progress=progress)
+
+    partial = PartialDownloadState.load(state_path) if resume else None
+    if partial is None or not os.path.exists(tmp_path) or not partial.matches(info):
+        partial = PartialDownloadState(state_path, url, info["total"], info["etag"], info["last_modified"])
+        with open(tmp_path, 'wb') as f:
+            f.truncate(info["total"])  # 预分配，各段直接写到自己的偏移处
+    partial.url = url
+    partial.save(force=True)
+    state = DownloadProgress(info["total"], downloaded=partial.done_bytes())
+
+    try:
+        for attempt in range(2):
+            ranges = partial.missing_ranges(segments, min_segment_size)
+            if not ranges:
+                break
+            try:
+                with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                    download_range = profiler.wrap(_download_range)
+                    futures = [executor.submit(download_range, http, url, tmp_path, start, end, headers, chunk_size,
+                                               partial, state, progress) for start, end in ranges]
+                    for future in futures:
+                        future.result()
+                break
+            except requests.HTTPError as e:
+                # 下载途中地址过期了，换个地址把剩下的补上
+                if resolve_url is None or attempt == 1 or e.response is None \
+                        or e.response.status_code not in (403, 404, 410):
+                    raise
+                url = resolve_url()
+                info = probe_range(url, session=session, headers=headers)
+                if info is None or not partial.matches(info):
+                    raise IOError(f"新地址的文件和已下载的部分对不上，请删除{tmp_path}后重新下载")
+                partial.url = url
+    finally:
+        partial.save(force=True)
+
+    os.replace(tmp_path, path)
+    os.remove(state_path)
+    return state
@@ -0,0 +1,110 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from easier_tools.timer import profiler
+
+
+class _CountingAdapter(HTTPAdapter):
+    """[子类]连接池被淘汰(host数超过pool_connections)或关闭时，把它的计数累计下来，pool_stats不会因此少算"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.retired = {}  # host -> [请求数, 新建连接数]
+        self._retired_lock = threading.Lock()
+        self.poolmanager.pools.dispose_func = self._retire
+
+    def _retire(self, pool):
+        host = f"{pool.scheme}://{pool.host}:{pool.port}"
+        with self._retired_lock:
+            item = self.retired.setdefault(host, [0, 0])
+            item[0] += pool.num_requests
+            item[1] += pool.num_connections
+        pool.close()
+
+    def counts(self):
+        """
+        :return: dict，host -> [请求数, 新建连接数]，包括已经被淘汰的连接池
+        """
+        with self._retired_lock:
+            counts = {host: list(item) for host, item in self.retired.items()}
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:  # 统计时连接池被淘汰了，已经计入retired
+                continue
+            item = counts.setdefault(f"{pool.scheme}://{pool.host}:{pool.port}", [0, 0])
+            item[0] += pool.num_requests
+            item[1] += pool.num_connections
+        return counts
+
+
+class EasySession(requests.Session):
+    """
+    带连接池的共享会话。对同一host的请求会复用keep-alive连接，省去每次请求的TCP+TLS握手。
+    [使用方法]:
+        session = EasySession(headers={"User-Agent": useragent().pcChrome}, pool_maxsize=16,
+                              host_pool_maxsize={"upos-sz-mirrorcos.bilivideo.com": 32})
+        r = session.get("https://api.bilibili.com/x/web-interface/nav")
+        print(session.pool_stats())  # 查看每个host的请求数、新建连接数与复用次数
+    """
+    def __init__(self, headers=None, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 host_pool_maxsize=None, timeout=None, limiter=None):
+        """
+        :param headers: 默认请求头，只在这里构建一次，之后每次请求都会带上。单次请求传入的headers会覆盖同名项，值为None则去掉该项
+        :param pool_connections: 缓存多少个host的连接池
+        :param pool_maxsize: 每个host的连接池最多保留多少条连接，并发数大于它时多出来的连接用完即关
+        :param pool_block: 连接池满了时是否阻塞等待空闲连接
+        :param host_pool_maxsize: 单独指定某些host的连接池大小，比如{"api.bilibili.com": 4}
+        :param timeout: 默认超时时间(秒)，为None则不设超时
+        :param limiter: 可选，AdaptiveRateLimiter。每次请求前按host取令牌，返回412/429时自动降速
+        """
+        super().__init__()
+        if headers is not None:
+            self.headers.update(headers)
+        self.timeout = timeout
+        self.limiter = limiter
+        self._stats_lock = threading.Lock()
+
+        adapter = _CountingAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if host_pool_maxsize is not None:
+            for host, maxsize in host_pool_maxsize.items():
+                host_adapter = _CountingAdapter(pool_connections=1, pool_maxsize=maxsize, pool_block=pool_block)
+                self.mount(f"http://{host}", host_adapter)
+                self.mount(f"https://{host}", host_adapter)
+
+    def request(self, method, url, **kwargs):
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        if self.limiter is None:
+            with profiler.span("request"):
+                return super().request(method, url, **kwargs)
+        self.limiter.acquire(url)
+        with profiler.span("request"):
+            response = super().request(method, url, **kwargs)
+        self.limiter.observe(response)
+        return response
+
+    def pool_stats(self):
+        """
+        统计各个host的连接复用情况
+        [使用方法]:
+            session.pool_stats()  # 返回{"https://api.bilibili.com:443": {"requests": 100, "connections": 1, "reused": 99}}
+        :return: dict，requests是发出的请求数，connections是新建的连接数，reused是复用已有连接的次数。
+            计数在adapter上累计，连接池因为host太多被淘汰、或者会话关闭之后也不会丢；外部mount的普通HTTPAdapter不统计
+        """
+        stats = {}
+        with self._stats_lock:
+            adapters = {id(a): a for a in self.adapters.values()}.values()
+            for adapter in adapters:
+                if not isinstance(adapter, _CountingAdapter):
+                    continue
+                for host, (num_requests, num_connections) in adapter.counts().items():
+                    item = stats.setdefault(host, {"requests": 0, "connections": 0, "reused": 0})
+                    item["requests"] += num_requests
+                    item["connections"] += num_connections
+                    item["reused"] += max(num_requests - num_connections, 0)
+        return stats
@@ -0,0 +1,201 @@
+import mimetypes
+import os
+import posixpath
+import re
+import time
+import uuid
+import zipfile
+from html import escape, unescape
+from html.parser import HTMLParser
+
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source",
+              "track", "wbr"}
+_AUTO_CLOSE = {"p", "li", "dt", "dd", "tr", "td", "th", "option"}  # 同名标签再次出现时，上一个没闭合的自动闭合
+
+
+class _XhtmlSerializer(HTMLParser):
+    """[子类]用标准库的HTMLParser重新输出一遍，得到格式良好的xhtml"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)  # 文本和属性里的实体(包括所有命名实体)都先解码成字符
+        self.out = []
+        self.stack = []
+
+    def _start(self, tag, attrs, self_closing):
+        if tag in _AUTO_CLOSE and self.stack and self.stack[-1] == tag:
+            self._end_to(len(self.stack) - 1)
+        seen = {}  # 重复的属性在xml里不合法，和浏览器一样只保留第一个
+        for name, value in attrs:
+            seen.setdefault(name, name if value is None else value)
+        attr_text = "".join(f' {name}="{escape(value)}"' for name, value in seen.items())
+        if self_closing or tag in _VOID_TAGS:
+            self.out.append(f"<{tag}{attr_text}/>")
+        else:
+            self.out.append(f"<{tag}{attr_text}>")
+            self.stack.append(tag)
+
+    def _end_to(self, depth):
+        """[子函数]闭合栈里depth以上(包括depth)的所有标签"""
+        while len(self.stack) > depth:
+            self.out.append(f"</{self.stack.pop()}>")
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        if tag in self.stack:  # 中间没闭合的标签一起闭合；没有对应开始标签的结束标签直接丢掉
+            self._end_to(len(self.stack) - 1 - self.stack[::-1].index(tag))
+
+    def handle_data(self, data):
+        self.out.append(escape(data, quote=False))
+
+    def handle_comment(self, data):
+        self.out.append(f"<!--{data.replace('--', '- -')}-->")
+
+    def close(self):
+        super().close()
+        self._end_to(0)
+        return "".join(self.out)
+
+
+def to_xhtml(fragment):
+    """
+    把网页上的html片段改成格式良好的xhtml：空元素自闭合，没闭合的标签补上结束标签，多余的结束标签去掉，
+    属性都加上引号、重复的只保留第一个，所有命名实体(&nbsp;等)换成对应的字符，裸露的&和<转义。严格的阅读器也能打开
+    :param fragment: html片段
+    :return: str
+    """
+    serializer = _XhtmlSerializer()
+    serializer.feed(fragment)
+    return serializer.close()
+
+
+class EpubWriter:
+    """
+    [功能] 流式写EPUB3。每加一章就直接压缩写进zip，内存里只保留这一章和目录信息，整本书再大内存占用也不变；
+        图片按章节里<img src>的相对路径从磁盘读取写入，同一张图只写一次。
+    [使用示例]
+        with EpubWriter("output/书名.epub", "书名", image_root="output/epubit/书名") as epub:
+            for title, fragments in chapters:
+                epub.add_chapter(title, fragments)  # fragments是html片段的list，比如epubit.get_content的返回值
+    """
+    def __init__(self, path, title, language="zh-CN", css=None, image_root=None):
+        """
+        :param path: epub文件路径
+        :param title: 书名
+        :param language: 语言
+        :param css: 可选，样式表内容，每一章都会引用
+        :param image_root: 章节里<img src="img/x.png">相对于哪个目录，为None则不打包图片
+        """
+        self.path = path
+        self.title = title
+        self.language = language
+        self.image_root = image_root
+        self.identifier = f"urn:uuid:{uuid.uuid4()}"
+        self._chapters = []  # (文件名, 标题)
+        self._items = []  # (id, 文件名, media-type)
+        self._images = set()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._tmp_path = path + ".part"
+        self._zip = zipfile.ZipFile(self._tmp_path, "w", zipfile.ZIP_DEFLATED)
+        # mimetype必须是第一个文件且不压缩
+        self._zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr("META-INF/container.xml",
+                           '<?xml version="1.0" encoding="UTF-8"?>\n'
+                           '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+                           '  <rootfiles>\n'
+                           '    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>\n'
+                           '  </rootfiles>\n'
+                           '</container>\n')
+        self._css = css
+        if css is not None:
+            self._zip.writestr("OEBPS/style.css", css)
+            self._items.append(("style", "style.css", "text/css"))
+
+    def add_chapter(self, title, fragments):
+        """
+        写入一章
+        :param title: 章节标题，用于目录
+        :param fragments: html片段的list(或者可迭代对象)
+        :return: 章节的文件名
+        """
+        name = f"chapter_{len(self._chapters) + 1:05d}.xhtml"
+        body = "\n".join(to_xhtml(fragment) for fragment in fragments)
+        css_link = '<link rel="stylesheet" type="text/css" href="style.css"/>' if self._css is not None else ""
+        xhtml = ('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+                 f'<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="{self.language}">\n'
+                 f'<head><meta charset="UTF-8"/><title>{escape(title)}</title>{css_link}</head>\n'
+                 f'<body>\n<div class="content_main">\n{body}\n</div>\n</body>\n</html>\n')
+        self._zip.writestr(f"OEBPS/{name}", xhtml)
+        self._chapters.append((name, title))
+        self._items.append((name.rsplit(".", 1)[0], name, "application/xhtml+xml"))
+        if self.image_root is not None:
+            for src in re.findall(r'<img\b[^>]*?\bsrc="([^"]+)"', body):
+                self._add_image(src)
+        return name
+
+    def _add_image(self, src):
+        """
+        [子函数]按相对路径把图片从磁盘写进zip，已经写过或者找不到的跳过。
+        src来自网页，绝对路径、用../跑到image_root外面的(包括经过符号链接的)都不打包，留着不解析
+        """
+        if src in self._images or "://" in src:
+            return
+        path = unescape(src)
+        if path.startswith(("/", "\\")) or os.path.isabs(path) or os.path.splitdrive(path)[0] \
+                or posixpath.normpath(path).startswith(".."):
+            return
+        root = os.path.realpath(self.image_root)
+        local = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, local]) != root or not os.path.isfile(local):
+            return
+        self._images.add(src)
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        # 图片本身已经压缩过了，再deflate只是浪费时间
+        self._zip.write(local, f"OEBPS/{path}", compress_type=zipfile.ZIP_STORED)
+        self._items.append((f"img_{len(self._images):05d}", path, media_type))
+
+    def close(self):
+        """写入目录和content.opf，然后把.part改名为正式文件"""
+        nav_points = "\n".join(f'      <li><a href="{name}">{escape(title)}</a></li>' for name, title in self._chapters)
+        self._zip.writestr("OEBPS/nav.xhtml",
+                           '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+                           '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+                           f'<head><meta charset="UTF-8"/><title>{escape(self.title)}</title></head>\n'
+                           f'<body>\n  <nav epub:type="toc" id="toc">\n    <h1>目录</h1>\n    <ol>\n{nav_points}\n'
+                           '    </ol>\n  </nav>\n</body>\n</html>\n')
+        manifest = "\n".join(f'    <item id="{item_id}" href="{escape(href)}" media-type="{media_type}"/>'
+                             for item_id, href, media_type in self._items)
+        spine = "\n".join(f'    <itemref idref="{name.rsplit(".", 1)[0]}"/>' for name, _ in self._chapters)
+        self._zip.writestr("OEBPS/content.opf",
+                           '<?xml version="1.0" encoding="UTF-8"?>\n'
+                           '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid">\n'
+                           '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+                           f'    <dc:identifier id="bookid">{self.identifier}</dc:identifier>\n'
+                           f'    <dc:title>{escape(self.title)}</dc:title>\n'
+                           f'    <dc:language>{self.language}</dc:language>\n'
+                           f'    <meta property="dcterms:modified">{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}</meta>\n'
+                           '  </metadata>\n'
+                           '  <manifest>\n'
+                           '    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+                           f'{manifest}\n'
+                           '  </manifest>\n'
+                           f'  <spine>\n{spine}\n  </spine>\n'
+                           '</package>\n')
+        self._zip.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._zip.close()
+            os.remove(self._tmp_path)
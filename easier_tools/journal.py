@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+
+from easier_tools.timer import profiler
+
+
+class AppendJournal:
+    """
+    [功能] 只追加的jsonl日志，用来做断点续传。每条记录一行，写完就flush，所以中途被杀最多丢掉最后一条；
+        重新打开时会截掉不完整的最后一行，取最后一条记录只读文件末尾，不用读整个文件。
+    [使用示例]
+        journal = AppendJournal("output/epubit/书名/journal.jsonl")
+        last = journal.last()  # 断点续传
+        journal.append({"folderId": "xxx", "next": "yyy", "content": [...]})
+        for record in journal:  # 从头按顺序读
+            print(record)
+    """
+    def __init__(self, path):
+        """
+        :param path: 日志文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._repair()
+
+    def _repair(self):
+        """截掉因为进程中途被杀而没写完的最后一行"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            pos = size
+            while pos > 0:
+                step = min(1 << 16, pos)
+                pos -= step
+                f.seek(pos)
+                block = f.read(step)
+                idx = block.rfind(b"\n")
+                if idx != -1:
+                    f.truncate(pos + idx + 1)
+                    return
+            f.truncate(0)
+
+    @profiler.timed("save")
+    def append(self, record):
+        """追加一条记录"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def last(self):
+        """
+        最后一条记录，只从文件末尾往前读
+        :return: dict，日志为空时返回None
+        """
+        if not os.path.exists(self.path):
+            return None
+        with self._lock, open(self.path, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            buffer = b""
+            pos = end
+            while pos > 0:
+                step = min(1 << 16, pos)
+                pos -= step
+                f.seek(pos)
+                buffer = f.read(step) + buffer
+                # 去掉结尾的换行后再找上一个换行，中间的就是最后一行
+                idx = buffer.rstrip(b"\n").rfind(b"\n")
+                if idx != -1:
+                    return json.loads(buffer[idx + 1:])
+            buffer = buffer.strip()
+            return json.loads(buffer) if buffer else None
+
+    def scan(self):
+        """
+        从头读，同时给出每条记录在文件中的偏移，之后可以用read(offset)只读回这一条
+        :return: 生成器，(offset, record)
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    yield offset, json.loads(line)
+                offset += len(line)
+
+    def read(self, offset):
+        """读取偏移offset处的一条记录"""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def __len__(self):
+        return sum(1 for _ in self)
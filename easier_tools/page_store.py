@@ -0,0 +1,181 @@
+import gzip
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from easier_tools.timer import profiler
+
+
+class DirPageStore:
+    """
+    [功能] 一个网页一个文件的存储，也就是原来的f"{html_path}{key}.html"，覆盖写入，不保留历史
+    [使用示例]
+        store = DirPageStore("output/html/")
+        store.put("BV18x4y187DE", rtext)
+        rtext = store.get("BV18x4y187DE")
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @profiler.timed("save")
+    def put(self, key, text, fetched=None):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        with open(f"{self.path}{key}.html", 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def get(self, key, fetched=None):
+        file_path = f"{self.path}{key}.html"
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+
+class SegmentPageStore:
+    """
+    [功能] 压缩后追加写入大分段文件的网页存储。
+        1. 每个网页压缩(zstd，没装zstandard时用gzip)后追加到当前分段文件末尾，分段写满segment_size后换下一个，不会产生海量小文件
+        2. 按内容的sha256去重(内容寻址)，同一个网页重复抓到相同内容只存一份
+        3. sqlite索引记录(key, 抓取时间) -> 内容hash -> (分段, 偏移, 长度)，每次抓取都保留，不会覆盖历史
+        4. 读取时用mmap直接定位到偏移处，一次就能取到
+    [使用示例]
+        store = SegmentPageStore("output/pages")
+        store.put("BV18x4y187DE", rtext)
+        rtext = store.get("BV18x4y187DE")  # 最新一次抓取
+        for fetched in store.history("BV18x4y187DE"):
+            old = store.get("BV18x4y187DE", fetched)
+    """
+    INDEX_NAME = "index.sqlite"
+
+    def __init__(self, path, compression=None, segment_size=256 << 20, level=3):
+        """
+        :param path: 存储目录
+        :param compression: zstd或gzip，不指定时有zstandard就用zstd
+        :param segment_size: 每个分段文件的大小上限(字节)
+        :param level: 压缩等级
+        """
+        if compression is None:
+            compression = "zstd" if zstandard is not None else "gzip"
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("使用zstd压缩需要先pip install zstandard")
+        if compression not in ("zstd", "gzip"):
+            raise ValueError(f"不支持的压缩方式{compression}，请使用zstd或gzip")
+        self.path = path
+        self.compression = compression
+        self.segment_size = segment_size
+        self.level = level
+        self._lock = threading.Lock()
+        self._maps = {}  # 分段名 -> mmap
+        os.makedirs(self.path, exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(self.path, self.INDEX_NAME), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS blobs "
+                         "(hash TEXT PRIMARY KEY, segment TEXT, offset INTEGER, length INTEGER, codec TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS pages "
+                         "(key TEXT, fetched REAL, hash TEXT, PRIMARY KEY (key, fetched))")
+        self._db.commit()
+        row = self._db.execute("SELECT segment FROM blobs ORDER BY segment DESC LIMIT 1").fetchone()
+        self._segment = row[0] if row is not None else "pages_000000.seg"
+
+    def _compress(self, data):
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return gzip.compress(data, compresslevel=self.level)
+
+    @staticmethod
+    def _decompress(blob, codec):
+        if codec == "zstd":
+            if zstandard is None:
+                raise ImportError("读取zstd压缩的网页需要先pip install zstandard")
+            return zstandard.ZstdDecompressor().decompress(blob)
+        return gzip.decompress(blob)
+
+    @profiler.timed("save")
+    def put(self, key, text, fetched=None):
+        """
+        保存一次抓取
+        :param key: 比如bv号
+        :param text: 网页文本
+        :param fetched: 抓取时间戳，默认为当前时间
+        :return: 内容的sha256
+        """
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        fetched = time.time() if fetched is None else fetched
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is None:
+                blob = self._compress(data)
+                segment_path = os.path.join(self.path, self._segment)
+                if os.path.exists(segment_path) and os.path.getsize(segment_path) + len(blob) > self.segment_size:
+                    self._segment = f"pages_{int(self._segment[6:12]) + 1:06d}.seg"
+                    segment_path = os.path.join(self.path, self._segment)
+                with open(segment_path, 'ab') as f:
+                    offset = f.tell()
+                    f.write(blob)
+                self._db.execute("INSERT INTO blobs (hash, segment, offset, length, codec) VALUES (?, ?, ?, ?, ?)",
+                                 (digest, self._segment, offset, len(blob), self.compression))
+            self._db.execute("INSERT OR REPLACE INTO pages (key, fetched, hash) VALUES (?, ?, ?)",
+                             (key, fetched, digest))
+            self._db.commit()
+        return digest
+
+    def get(self, key, fetched=None):
+        """
+        读取网页
+        :param key: 比如bv号
+        :param fetched: 抓取时间戳，不指定则取最新一次
+        :return: 网页文本，没有则返回None
+        """
+        with self._lock:
+            if fetched is None:
+                row = self._db.execute(
+                    "SELECT b.segment, b.offset, b.length, b.codec FROM pages p JOIN blobs b ON p.hash = b.hash "
+                    "WHERE p.key = ? ORDER BY p.fetched DESC LIMIT 1", (key,)).fetchone()
+            else:
+                row = self._db.execute(
+                    "SELECT b.segment, b.offset, b.length, b.codec FROM pages p JOIN blobs b ON p.hash = b.hash "
+                    "WHERE p.key = ? AND p.fetched = ?", (key, fetched)).fetchone()
+            if row is None:
+                return None
+            segment, offset, length, codec = row
+            mapped = self._map(segment, offset + length)
+            blob = mapped[offset:offset + length]
+        return self._decompress(blob, codec).decode("utf-8")
+
+    def _map(self, segment, min_size):
+        """[子函数]取分段的mmap，当前分段追加后长度不够时重新映射"""
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < min_size:
+            if mapped is not None:
+                mapped.close()
+            with open(os.path.join(self.path, segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return mapped
+
+    def history(self, key):
+        """某个key所有的抓取时间，从旧到新"""
+        with self._lock:
+            rows = self._db.execute("SELECT fetched FROM pages WHERE key = ? ORDER BY fetched", (key,)).fetchall()
+        return [row[0] for row in rows]
+
+    def keys(self):
+        """所有的key"""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT key FROM pages").fetchall()]
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+            self._db.close()
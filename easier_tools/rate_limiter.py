@@ -0,0 +1,205 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+from easier_tools.timer import profiler
+
+
+class TokenBucket:
+    """
+    [功能] 令牌桶限速。多个线程共用一个桶时，总请求速率不会超过rate。
+    [使用示例]
+        bucket = TokenBucket(rate=2)  # 每秒最多2次
+        for url in urls:
+            bucket.acquire()
+            session.get(url)
+    """
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: 每秒产生的令牌数，也就是每秒最多的请求数
+        :param capacity: 桶的容量，也就是允许的最大突发请求数
+        :param clock: 时钟函数，测试时可以换成模拟时钟
+        :param sleep: 等待函数，测试时可以换成模拟时钟的等待
+        """
+        if rate <= 0:
+            raise ValueError("rate必须大于0")
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def try_acquire(self, tokens=1):
+        """不等待地取令牌，取到返回True"""
+        with self._lock:
+            self._refill(self.clock())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """
+        取令牌，不够时等待
+        :param tokens: 需要的令牌数
+        :return: 总共等待的秒数
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(self.clock())
+                if self.tokens >= tokens - 1e-9:  # 浮点误差，否则模拟时钟下可能差一点点永远取不到
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            with profiler.span("sleep"):
+                self.sleep(wait)
+            waited += wait
+
+    def set_rate(self, rate):
+        """修改速率，之前攒下的令牌按旧速率结算"""
+        with self._lock:
+            self._refill(self.clock())
+            self.rate = rate
+
+    def penalize(self, seconds):
+        """清空令牌并欠下seconds秒的令牌，接下来至少要等seconds秒才能再取到"""
+        with self._lock:
+            self._refill(self.clock())
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+THROTTLE_STATUS = (412, 429)  # B站被风控时返回412，通用的限流是429
+
+
+class AdaptiveRateLimiter:
+    """
+    [功能] 按host分别限速的令牌桶，并根据服务器的反馈用AIMD(加性增、乘性减)自动调整速率：
+        每次正常返回速率加increase，被限流(412/429、返回的不是json、业务错误码等)时速率乘以decrease并暂停cooldown秒。
+        这样不用再手写一堆固定的sleep，速率会自己逼近不被限流的上限，被限流后也能马上慢下来。
+    [使用示例]
+        limiter = AdaptiveRateLimiter(host_rates={"api.bilibili.com": 2})
+        session = EasySession(limiter=limiter)  # 每次请求前自动acquire，412/429自动on_throttle
+        # 业务层面的限流信号需要自己报告，比如
+        limiter.on_throttle("https://api.bilibili.com/x/player/pagelist")
+    [测试]
+        clock = SimulatedClock()
+        limiter = AdaptiveRateLimiter(host_rates={"a.com": 1}, clock=clock.time, sleep=clock.sleep)
+    """
+    def __init__(self, host_rates=None, default_rate=None, min_rate=0.02, max_rate=None, increase=0.05,
+                 decrease=0.5, cooldown=30, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param host_rates: 各host的初始速率(每秒请求数)，比如{"api.bilibili.com": 2}
+        :param default_rate: 没在host_rates里的host的速率，为None则不限速(比如下载视频的CDN)
+        :param min_rate: 速率下限
+        :param max_rate: 速率上限，为None则为初始速率的4倍
+        :param increase: 每次正常返回速率增加多少
+        :param decrease: 每次被限流速率乘以多少
+        :param cooldown: 被限流后暂停多少秒
+        :param capacity: 令牌桶容量
+        :param clock: 时钟函数
+        :param sleep: 等待函数
+        """
+        self.host_rates = dict(host_rates or {})
+        self.default_rate = default_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = {}
+        self.throttled = {}  # host -> 被限流次数
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url):
+        """url或host都可以"""
+        if "//" not in url:
+            return url
+        return urlsplit(url).hostname or url
+
+    def bucket(self, url):
+        """取host对应的令牌桶，不限速的host返回None"""
+        host = self._host(url)
+        with self._lock:
+            if host not in self.buckets:
+                rate = self.host_rates.get(host, self.default_rate)
+                if rate is None:
+                    return None
+                self.buckets[host] = TokenBucket(rate, capacity=self.capacity, clock=self.clock, sleep=self.sleep)
+            return self.buckets[host]
+
+    def _max_rate(self, host):
+        if self.max_rate is not None:
+            return self.max_rate
+        return 4 * self.host_rates.get(host, self.default_rate)
+
+    def acquire(self, url):
+        """请求前调用，按host取令牌，返回等待的秒数"""
+        bucket = self.bucket(url)
+        return 0.0 if bucket is None else bucket.acquire()
+
+    def on_success(self, url):
+        """正常返回，速率加性增加"""
+        bucket = self.bucket(url)
+        if bucket is not None:
+            bucket.set_rate(min(self._max_rate(self._host(url)), bucket.rate + self.increase))
+
+    def on_throttle(self, url, cooldown=None):
+        """
+        被限流，速率乘性减少，并暂停一段时间
+        :param url: 请求的url或host
+        :param cooldown: 暂停秒数，不指定则用初始化时的cooldown
+        """
+        host = self._host(url)
+        bucket = self.bucket(url)
+        with self._lock:
+            self.throttled[host] = self.throttled.get(host, 0) + 1
+        if bucket is not None:
+            bucket.set_rate(max(self.min_rate, bucket.rate * self.decrease))
+            bucket.penalize(self.cooldown if cooldown is None else cooldown)
+
+    def observe(self, response):
+        """
+        根据响应状态码反馈
+        :param response: requests.Response
+        :return: 被限流返回True
+        """
+        if response.status_code in THROTTLE_STATUS:
+            self.on_throttle(response.url)
+            return True
+        self.on_success(response.url)
+        return False
+
+    def rates(self):
+        """各host当前的速率"""
+        with self._lock:
+            return {host: bucket.rate for host, bucket in self.buckets.items()}
+
+
+class SimulatedClock:
+    """
+    [功能] 测试用的模拟时钟，sleep只是把时间往前拨，不会真的等
+    [使用示例]
+        clock = SimulatedClock()
+        bucket = TokenBucket(2, clock=clock.time, sleep=clock.sleep)
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += max(seconds, 0)
@@ -0,0 +1,175 @@
+import csv
+import json
+import os
+import threading
+
+import pandas as pd
+
+from easier_tools.timer import profiler
+
+
+class SegmentSink:
+    """
+    [功能] 只追加的结果存储。每次flush把一批记录写成一个新的分段文件，并在index.jsonl里追加一行，
+        所以每次保存的开销只和这一批的大小有关，不会像反复to_excel那样越存越慢。
+    [使用示例]
+        sink = SegmentSink("output/bvs_popular_msg", fmt="jsonl", key="bv", batch_size=50)
+        done = sink.done_keys()  # 断点续传：只读index，不读数据
+        for bv in bvs:
+            if bv not in done:
+                sink.append(爬到的dict)
+        sink.flush()
+        sink.compact("input/xlsx_data/bvs_popular_msg.xlsx")  # 最后统一生成Excel/Parquet/CSV
+    """
+    INDEX_NAME = "index.jsonl"
+
+    def __init__(self, path, fmt="jsonl", key=None, batch_size=100):
+        """
+        :param path: 存储目录
+        :param fmt: 新写的分段文件的格式，jsonl、csv或parquet(parquet需要pyarrow)。每个分段的格式记在index里，
+            已有的分段不管是什么格式都能读
+        :param key: 记录中作为主键的字段名，比如"bv"。指定后index里会记下每个分段的主键，用于断点续传
+        :param batch_size: append()攒够多少条自动flush一次
+        """
+        if fmt not in ("jsonl", "csv", "parquet"):
+            raise ValueError(f"不支持的格式{fmt}，请使用jsonl、csv或parquet")
+        self.path = path
+        self.fmt = fmt
+        self.key = key
+        self.batch_size = batch_size
+        self.buffer = []
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.index = self._read_index()
+        # 分段编号取目录里已有的最大编号+1，index最后一行丢了也不会覆盖已有分段
+        seg_ids = [int(name[4:10]) for name in os.listdir(self.path)
+                   if name.startswith("seg_") and name[4:10].isdigit()]
+        self._next_seg = max(seg_ids) + 1 if seg_ids else 0
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, self.INDEX_NAME)
+
+    def _read_index(self):
+        """读取分段索引。最后一行如果因为进程中途被杀而不完整，直接忽略"""
+        index = []
+        if not os.path.exists(self.index_path):
+            return index
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if os.path.exists(os.path.join(self.path, entry["segment"])):
+                    index.append(entry)
+        return index
+
+    def append(self, record):
+        """追加一条记录，攒够batch_size条时自动flush"""
+        with self._lock:
+            self.buffer.append(record)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def write(self, records):
+        """直接把一批记录写成一个分段"""
+        with self._lock:
+            self._write_segment(list(records))
+
+    def flush(self):
+        """把缓冲区里的记录写成一个分段"""
+        with self._lock:
+            records, self.buffer = self.buffer, []
+            self._write_segment(records)
+
+    @profiler.timed("save")
+    def _write_segment(self, records):
+        if not records:
+            return
+        segment = f"seg_{self._next_seg:06d}.{self.fmt}"
+        self._next_seg += 1
+        segment_path = os.path.join(self.path, segment)
+        tmp_path = segment_path + ".tmp"
+        if self.fmt == "jsonl":
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        elif self.fmt == "csv":
+            columns = list(dict.fromkeys(k for record in records for k in record))
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            pd.DataFrame(records).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, segment_path)  # 先写完分段再登记，中途被杀也不会留下半个分段
+
+        entry = {"segment": segment, "fmt": self.fmt, "rows": len(records)}
+        if self.key is not None:
+            entry["keys"] = [record.get(self.key) for record in records]
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.index.append(entry)
+
+    def done_keys(self):
+        """
+        已保存记录的主键集合，只读index不读分段
+        :return: set
+        """
+        if self.key is None:
+            raise ValueError("初始化时没有指定key")
+        return {k for entry in self.index for k in entry.get("keys", [])}
+
+    def __len__(self):
+        return sum(entry["rows"] for entry in self.index) + len(self.buffer)
+
+    def iter_segments(self):
+        """
+        逐个分段读成DataFrame，内存里同时只有一个分段。
+        每个分段按写入时的格式读，所以同一个目录先后用不同的fmt写也没关系
+        """
+        for entry in self.index:
+            segment_path = os.path.join(self.path, entry["segment"])
+            # 以前的index没有fmt，从文件扩展名看
+            fmt = entry.get("fmt") or entry["segment"].rsplit(".", 1)[-1]
+            if fmt == "jsonl":
+                yield pd.read_json(segment_path, lines=True, dtype=False)
+            elif fmt == "csv":
+                yield pd.read_csv(segment_path)
+            else:
+                yield pd.read_parquet(segment_path)
+
+    def to_dataframe(self):
+        """读取全部分段，合并成一个DataFrame"""
+        frames = list(self.iter_segments())
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def compact(self, out_path, drop_duplicates=True):
+        """
+        把所有分段合并成最终文件，根据扩展名决定格式(.xlsx/.parquet/.csv/.jsonl)
+        :param out_path: 输出文件路径
+        :param drop_duplicates: 指定了key时，是否按key去重(保留最后一次)
+        :return: 合并后的DataFrame
+        """
+        self.flush()
+        df = self.to_dataframe()
+        if drop_duplicates and self.key is not None and self.key in df.columns:
+            df = df.drop_duplicates(subset=self.key, keep="last")
+        out_dir = os.path.dirname(out_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        if out_path.endswith(".xlsx"):
+            df.to_excel(out_path, index=False)
+        elif out_path.endswith(".parquet"):
+            df.to_parquet(out_path, index=False)
+        elif out_path.endswith(".csv"):
+            df.to_csv(out_path, index=False)
+        elif out_path.endswith(".jsonl"):
+            df.to_json(out_path, orient="records", lines=True, force_ascii=False)
+        else:
+            raise ValueError(f"不支持的输出格式{out_path}")
+        return df
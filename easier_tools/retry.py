@@ -0,0 +1,123 @@
+import random
+import time
+
+import requests
+
+from easier_tools.timer import profiler
+
+
+class RetryableError(Exception):
+    """可以重试的错误，比如被限流、返回的不是json、业务错误码表示稍后再试"""
+
+
+class FatalError(Exception):
+    """重试也没用的错误，比如参数错误、资源不存在"""
+
+
+class RetryError(Exception):
+    """
+    重试失败。failure是结构化的失败信息，可以直接放进failures列表或写进日志：
+        {"key": .., "error": 最后一次的错误, "attempts": 尝试次数, "elapsed": 总耗时(秒), "fatal": 是否因为不可重试的错误而停止}
+    """
+    def __init__(self, failure):
+        super().__init__(f"{failure['key']}重试{failure['attempts']}次后失败: {failure['error']}")
+        self.failure = failure
+
+
+RETRYABLE_STATUS = (408, 412, 429, 500, 502, 503, 504)
+
+
+def classify_error(e):
+    """
+    默认的错误分类
+    :return: True可以重试，False不可重试
+    """
+    if isinstance(e, RetryableError):
+        return True
+    if isinstance(e, FatalError):
+        return False
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code in RETRYABLE_STATUS
+    if isinstance(e, (requests.ConnectionError, requests.Timeout, ValueError, IOError)):
+        return True  # 网络错误、返回的不是json(ValueError)、下载不完整
+    return False
+
+
+class RetryPolicy:
+    """
+    [功能] 有上限的重试：指数退避加随机抖动，最多重试max_attempts次，总耗时不超过deadline秒，
+        不可重试的错误直接放弃。失败时抛出带结构化失败信息的RetryError，不会无限递归，也不会直接退出进程。
+    [使用示例]
+        policy = RetryPolicy(max_attempts=5, base_delay=2, max_delay=60, deadline=300)
+        try:
+            data = policy.call(get_json, url, key=url)
+        except RetryError as e:
+            failures.append(e.failure)
+    [测试]
+        clock = SimulatedClock()
+        policy = RetryPolicy(clock=clock.time, sleep=clock.sleep, rng=random.Random(0))
+    """
+    def __init__(self, max_attempts=5, base_delay=1, max_delay=60, factor=2, deadline=None, jitter=True,
+                 classify=classify_error, clock=time.monotonic, sleep=time.sleep, rng=None):
+        """
+        :param max_attempts: 最多尝试几次(包括第一次)
+        :param base_delay: 第一次重试前等待的秒数
+        :param max_delay: 单次等待的上限
+        :param factor: 每次重试等待时间乘以多少
+        :param deadline: 从第一次尝试开始算，总共最多花多少秒，为None则不限
+        :param jitter: 是否加随机抖动(在0到退避时间之间均匀取值)，避免多个线程同时重试
+        :param classify: 错误分类函数，参数是异常，返回True表示可以重试
+        :param clock: 时钟函数
+        :param sleep: 等待函数
+        :param rng: random.Random，测试时可以固定种子
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts至少为1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.deadline = deadline
+        self.jitter = jitter
+        self.classify = classify
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng if rng is not None else random.Random()
+
+    def delay(self, attempt):
+        """
+        第attempt次失败后等待的秒数
+        :param attempt: 从1开始
+        """
+        backoff = min(self.max_delay, self.base_delay * self.factor ** (attempt - 1))
+        return self.rng.uniform(0, backoff) if self.jitter else backoff
+
+    def call(self, func, *args, key=None, on_retry=None, **kwargs):
+        """
+        调用func，失败时按策略重试
+        :param func: 要调用的函数
+        :param key: 失败信息里的标识，比如folderId
+        :param on_retry: 可选，每次重试前调用on_retry(attempt, 异常, 等待秒数)，比如打印或者通知限速器
+        :return: func的返回值
+        """
+        start = self.clock()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                elapsed = self.clock() - start
+                failure = {"key": key, "error": repr(e), "attempts": attempt, "elapsed": elapsed, "fatal": False}
+                if not self.classify(e):
+                    failure["fatal"] = True
+                    raise RetryError(failure) from e
+                if attempt >= self.max_attempts:
+                    raise RetryError(failure) from e
+                wait = self.delay(attempt)
+                if self.deadline is not None and elapsed + wait > self.deadline:
+                    raise RetryError(failure) from e
+                if on_retry is not None:
+                    on_retry(attempt, e, wait)
+                with profiler.span("sleep"):
+                    self.sleep(wait)
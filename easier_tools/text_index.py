@@ -0,0 +1,261 @@
+import json
+import mmap
+import os
+import re
+import struct
+from array import array
+
+_CJK_RANGE = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN = re.compile(f"[{_CJK_RANGE}]+|[0-9a-z_]+")
+_CJK = re.compile(f"[{_CJK_RANGE}]")
+
+_HEADER = struct.Struct("<4sIII")  # 魔数, 词数, 词表字节数, 倒排表长度
+_ENTRY = struct.Struct("<IIII")  # 词在词表中的偏移, 词的字节数, 倒排表偏移, 文档数
+_MAGIC = b"TIX1"
+
+
+def tokenize(text):
+    """
+    分词：中日韩文字切成单字和相邻两字(二元组)，字母数字按单词切开并转小写。
+    不需要词典，查询时同样切分后取交集，任何连续的中文片段都能查到
+    :param text: 文本
+    :return: 生成器，词
+    """
+    for match in _TOKEN.finditer(text.lower()):
+        run = match.group()
+        if _CJK.match(run):
+            for i, char in enumerate(run):
+                yield char
+                if i + 1 < len(run):
+                    yield run[i:i + 2]
+        else:
+            yield run
+
+
+class _Segment:
+    """[子类]一个只读的索引分段，mmap后二分查找词表"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_terms, terms_size, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path}不是索引分段文件")
+        self._entries = _HEADER.size
+        self._terms = self._entries + self.n_terms * _ENTRY.size
+        self._postings = self._terms + terms_size
+
+    def _term(self, i):
+        term_offset, term_size, _, _ = _ENTRY.unpack_from(self._mm, self._entries + i * _ENTRY.size)
+        start = self._terms + term_offset
+        return self._mm[start:start + term_size]
+
+    def postings(self, term):
+        """
+        :param term: 词(bytes)
+        :return: array('I')，包含这个词的文档id，从小到大
+        """
+        low, high = 0, self.n_terms
+        while low < high:
+            mid = (low + high) // 2
+            if self._term(mid) < term:
+                low = mid + 1
+            else:
+                high = mid
+        if low == self.n_terms or self._term(low) != term:
+            return array('I')
+        _, _, posting_offset, count = _ENTRY.unpack_from(self._mm, self._entries + low * _ENTRY.size)
+        start = self._postings + posting_offset * 4
+        result = array('I')
+        result.frombytes(self._mm[start:start + count * 4])
+        return result
+
+    def items(self):
+        """所有的(词, 倒排表)"""
+        for i in range(self.n_terms):
+            term = self._term(i)
+            yield term.decode("utf-8"), self.postings(term)
+
+    def close(self):
+        self._mm.close()
+
+    @staticmethod
+    def write(path, postings):
+        """
+        写一个分段
+        :param postings: dict，词 -> 文档id的list(从小到大)
+        """
+        terms = sorted(term.encode("utf-8") for term in postings)
+        entries, blob, posting_array = [], bytearray(), array('I')
+        for term in terms:
+            ids = postings[term.decode("utf-8")]
+            entries.append(_ENTRY.pack(len(blob), len(term), len(posting_array), len(ids)))
+            blob += term
+            posting_array.extend(ids)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(terms), len(blob), len(posting_array)))
+            f.write(b"".join(entries))
+            f.write(blob)
+            f.write(posting_array.tobytes())
+        os.replace(tmp_path, path)
+
+
+class TextIndex:
+    """
+    [功能] 本地全文倒排索引。
+        1. 每次commit把新加的文档写成一个只读分段文件(词表按字节序排好，倒排表是uint32数组)，查询时mmap后二分查找，
+           不需要把索引读进内存；增量更新只写新分段，不改旧文件，分段多了可以compact合并
+        2. 文档信息(key和调用方给的meta)追加写在docs.jsonl里；同一个key再次add时以最新的为准
+        3. state是调用方自己的增量进度(比如每个日志已经索引到哪个偏移)，和分段一起在commit时保存
+    [使用示例]
+        index = TextIndex("output/index")
+        index.add(("书名", "folderId"), "正文文本", book="书名")
+        index.commit()
+        for meta in index.search("深度学习"):
+            print(meta["book"])
+    [注意]
+        search按分词取交集，返回的是候选文档，需要精确匹配时调用方再用原文核对一遍
+    """
+    def __init__(self, path):
+        """
+        :param path: 索引目录
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.docs = []  # 文档id -> meta
+        self._latest = {}  # key -> 最新的文档id
+        self._pending = {}  # 词 -> 文档id的list，还没commit的
+        self._pending_docs = []
+        self.state = {}
+        self._segment_names = []
+        self._load()
+        self._segments = [_Segment(os.path.join(path, name)) for name in self._segment_names]
+
+    def _load(self):
+        """[子函数]读取state.json和docs.jsonl。commit写到一半被中断时，多出来的文档和分段都丢掉"""
+        state_path = os.path.join(self.path, "state.json")
+        saved = {"docs": 0, "segments": [], "state": {}}
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        self.state = saved["state"]
+        self._segment_names = saved["segments"]
+        for name in os.listdir(self.path):
+            if name.startswith("seg_") and name not in self._segment_names:
+                os.remove(os.path.join(self.path, name))
+        docs_path = os.path.join(self.path, "docs.jsonl")
+        if not os.path.exists(docs_path):
+            return
+        extra = False
+        with open(docs_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if len(self.docs) == saved["docs"]:
+                    extra = True
+                    break
+                self._add_doc(json.loads(line))
+        if extra:
+            with open(docs_path, 'w', encoding='utf-8') as f:
+                for meta in self.docs:
+                    f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+
+    def _next_segment_path(self):
+        number = int(self._segment_names[-1][4:10]) + 1 if self._segment_names else 0
+        return os.path.join(self.path, f"seg_{number:06d}.idx")
+
+    def _add_doc(self, meta):
+        meta["key"] = tuple(meta["key"]) if isinstance(meta["key"], list) else meta["key"]
+        self.docs.append(meta)
+        self._latest[meta["key"]] = meta["doc"]
+
+    def add(self, key, text, **meta):
+        """
+        加入一个文档，commit后才能查到
+        :param key: 文档的标识，比如(书名, folderId)，需要能被json序列化
+        :param text: 纯文本
+        :param meta: 查询结果里要返回的其他信息
+        :return: 文档id
+        """
+        doc = len(self.docs)
+        meta = dict(meta, doc=doc, key=key)
+        self._add_doc(meta)
+        self._pending_docs.append(meta)
+        for term in set(tokenize(text)):
+            self._pending.setdefault(term, []).append(doc)
+        return doc
+
+    def commit(self):
+        """把新加的文档写成一个分段，并保存state"""
+        if self._pending:
+            segment_path = self._next_segment_path()
+            _Segment.write(segment_path, self._pending)
+            self._segments.append(_Segment(segment_path))
+            self._segment_names.append(os.path.basename(segment_path))
+        if self._pending_docs:
+            with open(os.path.join(self.path, "docs.jsonl"), 'a', encoding='utf-8') as f:
+                for meta in self._pending_docs:
+                    f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+        self._save_state()
+        self._pending, self._pending_docs = {}, []
+
+    def _save_state(self):
+        tmp_path = os.path.join(self.path, "state.json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"docs": len(self.docs), "segments": self._segment_names, "state": self.state}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.path, "state.json"))
+
+    def postings(self, term):
+        """包含term的所有文档id(所有分段)"""
+        term = term.encode("utf-8")
+        result = set()
+        for segment in self._segments:
+            result.update(segment.postings(term))
+        return result
+
+    def search(self, query, limit=None):
+        """
+        查询包含query中所有词的文档
+        :param query: 查询文本，比如"卷积神经网络"或者"ResNet 残差"
+        :param limit: 最多返回多少个，为None则不限
+        :return: list，文档的meta(包含doc和key)，按文档id排序
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        postings = sorted((self.postings(term) for term in terms), key=len)
+        docs = postings[0].intersection(*postings[1:])
+        result = []
+        for doc in sorted(docs):
+            meta = self.docs[doc]
+            if self._latest.get(meta["key"]) != doc:
+                continue  # 同一个key后来又加过，这是旧版本
+            result.append(meta)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def compact(self):
+        """把所有分段合并成一个，去掉旧版本文档的倒排记录"""
+        self.commit()
+        latest = set(self._latest.values())
+        merged = {}
+        for segment in self._segments:
+            for term, ids in segment.items():
+                merged.setdefault(term, []).extend(doc for doc in ids if doc in latest)
+        merged = {term: sorted(ids) for term, ids in merged.items() if ids}
+        old_names = self._segment_names
+        segment_path = self._next_segment_path()
+        _Segment.write(segment_path, merged)
+        for segment in self._segments:
+            segment.close()
+        self._segment_names = [os.path.basename(segment_path)]
+        self._save_state()  # 先让state指向新分段，再删旧的
+        for name in old_names:
+            os.remove(os.path.join(self.path, name))
+        self._segments = [_Segment(segment_path)]
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
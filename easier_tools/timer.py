@@ -1,9 +1,53 @@
+import functools
+import threading
 import time
+from array import array
+
 import numpy as np
+import pandas as pd
+
+
+class RingBuffer:
+    """
+    [功能] 用array('q')存整数(这里是纳秒)的环形缓冲区，写满后覆盖最旧的，内存占用固定；capacity为None时不限长度。
+        count和total记录的是所有写入过的值，不受覆盖影响。为了开销小没有加锁，只能由一个线程写入
+    [使用示例]
+        buffer = RingBuffer(4096)
+        buffer.append(1234)
+        values = buffer.values()  # 按写入顺序的array
+    """
+    def __init__(self, capacity=4096):
+        """
+        :param capacity: 最多保留多少个值，为None则不限
+        """
+        self.capacity = capacity
+        self._data = array('q') if capacity is None else array('q', bytes(8 * capacity))
+        self.count = 0  # 写入过的总个数
+        self.total = 0  # 写入过的值的总和
+
+    def append(self, value):
+        if self.capacity is None:
+            self._data.append(value)
+        else:
+            self._data[self.count % self.capacity] = value
+        self.count += 1
+        self.total += value
+
+    def values(self):
+        """保留着的值，按写入顺序"""
+        count = self.count
+        if self.capacity is None or count <= self.capacity:
+            return self._data[:count]
+        split = count % self.capacity
+        return self._data[split:] + self._data[:split]
+
+    def __len__(self):
+        return self.count if self.capacity is None else min(self.count, self.capacity)
+
 
 class Timer:
     """
-    [功能] 记录多次运行时间。
+    [功能] 记录多次运行时间。用time.perf_counter_ns计时，精度比time.time()高；也可以用with语句
     [使用示例]
         timer = Timer()
           要测试时间的代码块1
@@ -12,28 +56,276 @@ class Timer:
         timer.start()
           要测试时间的代码块2
         print(f'{timer.stop():.5f} sec')
+        with timer:
+          要测试时间的代码块3
+        print(timer.percentile(95))
     """
-    def __init__(self):
-        self.times = []
+    def __init__(self, capacity=None):
+        """
+        :param capacity: 最多保留多少次的时间，为None则全部保留。长时间运行时可以指定，内存占用固定。
+            指定后times、cumsum()和percentile()只按最近的capacity次计算，sum()和avg()仍然包括所有记录过的时间
+        """
+        self._buffer = RingBuffer(capacity)
         self.start()
 
     def start(self):
         """启动计时器"""
-        self.tik = time.time()
+        self.tik = time.perf_counter_ns()
 
     def stop(self):
-        """停止计时器并将时间记录在列表中"""
-        self.times.append(time.time() - self.tik)
-        return self.times[-1]
+        """停止计时器并将时间记录下来"""
+        elapsed = time.perf_counter_ns() - self.tik
+        self._buffer.append(elapsed)
+        return elapsed / 1e9
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    @property
+    def times(self):
+        """记录的时间(秒)列表"""
+        return [ns / 1e9 for ns in self._buffer.values()]
 
     def avg(self):
         """返回平均时间"""
-        return sum(self.times) / len(self.times)
+        return self._buffer.total / self._buffer.count / 1e9
 
     def sum(self):
         """返回时间总和"""
-        return sum(self.times)
+        return self._buffer.total / 1e9
 
     def cumsum(self):
         """返回累计时间"""
-        return np.array(self.times).cumsum().tolist()
\ No newline at end of file
+        return (np.frombuffer(self._buffer.values(), dtype=np.int64).cumsum() / 1e9).tolist()
+
+    def percentile(self, q):
+        """返回时间的q分位数(秒)，q为0~100"""
+        return float(np.percentile(np.frombuffer(self._buffer.values(), dtype=np.int64), q)) / 1e9
+
+
+class _ThreadState:
+    """[子类]一个线程的span栈和记录"""
+    __slots__ = ("stack", "buffers")
+
+    def __init__(self):
+        self.stack = []
+        self.buffers = {}
+
+
+class _Span:
+    """[子类]Profiler.span返回的上下文管理器"""
+    __slots__ = ("_profiler", "_name", "_state", "_path", "_start")
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._state = state = self._profiler._thread_state()
+        stack = state.stack
+        self._path = path = f"{stack[-1]}/{self._name}" if stack else self._name
+        stack.append(path)
+        self._start = _perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = _perf_counter_ns() - self._start
+        state = self._state
+        state.stack.pop()
+        buffer = state.buffers.get(self._path)
+        if buffer is None:
+            buffer = state.buffers[self._path] = RingBuffer(self._profiler.capacity)
+        buffer.append(elapsed)
+        return False
+
+
+class _NullSpan:
+    """[子类]关闭Profiler时span返回的空上下文管理器"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_perf_counter_ns = time.perf_counter_ns
+
+
+class Profiler:
+    """
+    [功能] 分层计时。用span按名字记录每段代码的耗时，span可以嵌套，嵌套时名字是"外层/内层"；
+        每个线程、每个名字一个固定大小的环形缓冲区(记录时不用加锁)，可以随时查看次数、总耗时、p50/p95/p99和直方图。
+        本项目的会话请求(request)、解析(parse)、保存(save)、限速等待(sleep)已经埋好点，记在全局的profiler里
+    [使用示例]
+        from easier_tools.timer import profiler
+        with profiler.span("crawl"):
+            biliVideo.crawl_many(bvs)  # 里面的请求记为"crawl/request"，解析记为"crawl/parse"
+        span的栈是每个线程自己的，交给线程池的任务要用profiler.wrap(func)包一下，才会记在提交时的span下面；
+        本项目里的线程池都已经包好了
+        profiler.print_report()
+
+        @profiler.timed("download")
+        def download(url): ...
+    """
+    def __init__(self, capacity=4096, enabled=True):
+        """
+        :param capacity: 每个名字最多保留多少次的耗时，用于计算分位数和直方图；次数和总耗时不受限制
+        :param enabled: 是否记录。关闭后span几乎没有开销
+        """
+        self.capacity = capacity
+        self.enabled = enabled
+        self._states = []  # 每个线程的记录，线程结束后也保留
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _thread_state(self):
+        """[子函数]当前线程的span栈和{名字: RingBuffer(纳秒)}"""
+        try:
+            return self._local.state
+        except AttributeError:
+            state = self._local.state = _ThreadState()
+            with self._lock:
+                self._states.append(state)
+            return state
+
+    def span(self, name):
+        """
+        计时一段代码
+        [使用方法]:
+            with profiler.span("parse"):
+                ...
+        :param name: 名字，嵌套时会加上外层的名字
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name=None):
+        """
+        装饰器，计时整个函数
+        :param name: 名字，默认为函数的__qualname__
+        """
+        def decorator(func):
+            span_name = name if name is not None else func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def wrap(self, func):
+        """
+        span的栈是每个线程自己的，交给线程池的函数在工作线程里看不到提交时外层的span。
+        用wrap包一下再提交，工作线程里的span会记在提交时所在的span下面
+        [使用方法]:
+            with profiler.span("crawl"):
+                executor.submit(profiler.wrap(fetch), bv)  # fetch里的请求记为"crawl/request"
+        :param func: 要交给其他线程运行的函数
+        :return: 包装后的函数
+        """
+        if not self.enabled:
+            return func
+        stack = self._thread_state().stack
+        if not stack:
+            return func
+        parent = stack[-1]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            worker_stack = self._thread_state().stack
+            worker_stack.append(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                worker_stack.pop()
+        return wrapper
+
+    def record(self, name, elapsed_ns):
+        """直接记录一次耗时(纳秒)"""
+        if not self.enabled:
+            return
+        buffers = self._thread_state().buffers
+        buffer = buffers.get(name)
+        if buffer is None:
+            buffer = buffers[name] = RingBuffer(self.capacity)
+        buffer.append(elapsed_ns)
+
+    def _buffers(self, name):
+        """[子函数]所有线程里这个名字的RingBuffer"""
+        with self._lock:
+            states = list(self._states)
+        return [state.buffers[name] for state in states if name in state.buffers]
+
+    def names(self):
+        """记录过的所有名字"""
+        with self._lock:
+            states = list(self._states)
+        return list(dict.fromkeys(name for state in states for name in list(state.buffers)))
+
+    def _values_ms(self, buffers):
+        return np.concatenate([np.frombuffer(buffer.values(), dtype=np.int64) for buffer in buffers]) / 1e6
+
+    def stats(self, name):
+        """
+        某个名字的统计(所有线程合并)
+        :return: dict，count是次数，total是总耗时(秒)，其余是毫秒；分位数按每个线程最近的capacity次计算
+        """
+        buffers = self._buffers(name)
+        if not buffers:
+            raise KeyError(name)
+        count = sum(buffer.count for buffer in buffers)
+        total = sum(buffer.total for buffer in buffers)
+        values = self._values_ms(buffers)
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"name": name, "count": count, "total": total / 1e9, "mean_ms": total / count / 1e6,
+                "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "max_ms": values.max()}
+
+    def histogram(self, name, bins=10):
+        """
+        某个名字的耗时直方图，按对数等分区间，适合跨好几个数量级的耗时(比如网络请求)
+        :return: (每个区间的次数, 区间边界(毫秒))
+        """
+        buffers = self._buffers(name)
+        if not buffers:
+            raise KeyError(name)
+        values = self._values_ms(buffers)
+        low, high = max(values.min(), 1e-6), max(values.max(), 1e-6)
+        edges = np.geomspace(low, high * (1 + 1e-9), bins + 1) if high > low else np.array([low, high + 1e-6])
+        counts, edges = np.histogram(values, bins=edges)
+        return counts, edges
+
+    def report(self):
+        """
+        所有名字的统计，按总耗时从大到小
+        :return: DataFrame
+        """
+        rows = [self.stats(name) for name in self.names()]
+        if not rows:
+            return pd.DataFrame(columns=["name", "count", "total", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+        return pd.DataFrame(rows).sort_values("total", ascending=False, ignore_index=True)
+
+    def print_report(self):
+        """打印report()"""
+        print(self.report().to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+    def reset(self):
+        """
+        清空所有记录。就地清空每个线程的字典，不替换成新对象；
+        记录时不加锁，所以应该在没有span正在计时的时候调用(比如两轮爬取之间)，否则正在结束的span可能会留下一条记录
+        """
+        with self._lock:
+            for state in self._states:
+                state.buffers.clear()
+
+
+profiler = Profiler()  # 全局的profiler，各个爬虫的埋点都记在这里
@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    [功能] 线程安全的带过期时间的LRU缓存，可选用sqlite文件做磁盘备份，进程重启后还能接着用
+    [使用示例]
+        cache = TTLCache(maxsize=1024, ttl=600, disk_path="output/cache/playurl.sqlite")
+        value = cache.get(key)
+        if value is None:
+            value = 请求接口()
+            cache.set(key, value, ttl=300)  # 可以单独指定这一条的过期时间
+        print(cache.stats())  # {"hits": .., "misses": .., "size": ..}
+    [注意]
+        key需要能被json序列化(比如tuple/str/int)，使用磁盘备份时value也要能被json序列化
+    """
+    def __init__(self, maxsize=1024, ttl=600, disk_path=None, clock=time.time):
+        """
+        :param maxsize: 内存里最多保留多少条，超出后淘汰最久没用过的
+        :param ttl: 默认过期时间(秒)
+        :param disk_path: sqlite文件路径，为None则只在内存里
+        :param clock: 时钟函数。因为要和磁盘里的过期时间比较，所以默认用time.time
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (过期时间, value)
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path is not None:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+            self._db.commit()
+
+    def get(self, key, default=None):
+        """取缓存，没有或已过期返回default"""
+        now = self.clock()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None and self._db is not None:
+                row = self._db.execute("SELECT expires, value FROM cache WHERE key = ?",
+                                       (json.dumps(key),)).fetchone()
+                if row is not None:
+                    item = (row[0], json.loads(row[1]))
+                    self._put(key, item)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    self._delete(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        """写缓存，ttl不指定则用默认值"""
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put(key, (expires, value))
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO cache (key, expires, value) VALUES (?, ?, ?)",
+                                 (json.dumps(key), expires, json.dumps(value, ensure_ascii=False)))
+                self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def _put(self, key, item):
+        self._data[key] = item
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)  # 只从内存淘汰，磁盘里的等过期
+
+    def _delete(self, key):
+        self._data.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (json.dumps(key),))
+            self._db.commit()
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _install_placeholder_config():
+    """
+    easier_spider/config.py是各人自己填cookie的文件，不在仓库里。
+    没有时放一个只有占位值的模块，这样测试不用真的cookie也能import爬虫模块
+    """
+    try:
+        import easier_spider.config  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    class useragent:
+        def __init__(self):
+            self.pcChrome = "Mozilla/5.0 (easier_spider tests)"
+
+    class bilicookies:
+        def __init__(self):
+            self.bilicookie = "SESSDATA=test; bili_jct=test"
+            self.SESSDATA = "test"
+            self.bili_jct = "test"
+
+    class epubitcookies:
+        def __init__(self):
+            self.cookie = ""
+
+    config = types.ModuleType("easier_spider.config")
+    config.useragent, config.bilicookies, config.epubitcookies = useragent, bilicookies, epubitcookies
+    sys.modules["easier_spider.config"] = config
+
+
+_install_placeholder_config()
+
+
+class FakeServer:
+    """
+    [功能] 本地的假接口，按路径依次返回事先排好的响应，最后一个响应会一直重复
+    [使用示例]
+        fake_server.add("/api", {"code": "1"}, {"code": "0", "data": []})
+        fake_server.add("/html", (200, "<html>风控</html>", "text/html"))
+        fake_server.add("/content", lambda query: {"code": "0", "data": query["folderId"]})  # 按参数生成响应
+        fake_server.add_file("/v.m4s", b"..." * 1000, cut=100)  # 支持Range的文件，第一次传100字节就断开
+        session.get(fake_server.url("/api"))
+    """
+    def __init__(self):
+        self.routes = {}  # 路径 -> [(状态码, 内容, Content-Type)]
+        self.files = {}  # 路径 -> 支持Range的文件
+        self.requests = []  # 收到的请求的路径(带参数)
+        self.ranges = []  # 文件收到的(路径, Range请求头)
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if urlsplit(self.path).path in server.files:
+                    server._serve_file(self)
+                    return
+                status, body, content_type = server._next(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.host = "127.0.0.1"
+        self.port = self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    def add(self, path, *responses):
+        """
+        :param responses: dict/list按json返回；也可以是(状态码, 内容, Content-Type)；
+            也可以是函数，参数是请求参数的dict，返回上面两种之一
+        """
+        with self._lock:
+            self.routes[path] = list(responses)
+
+    def add_file(self, path, data, etag='"v1"', cut=None):
+        """
+        按HTTP Range返回data的对应部分
+        :param cut: 第一次要发的内容超过cut字节时，只发cut字节就断开连接，模拟下载到一半网络断了
+        """
+        with self._lock:
+            self.files[path] = {"data": data, "etag": etag, "cut": cut}
+
+    def _serve_file(self, handler):
+        path = urlsplit(handler.path).path
+        range_header = handler.headers.get("Range")
+        with self._lock:
+            self.requests.append(handler.path)
+            self.ranges.append((path, range_header))
+            file = self.files[path]
+            data = file["data"]
+            match = re.match(r"bytes=(\d+)-(\d*)$", range_header or "")
+            start, end = (int(match.group(1)), int(match.group(2) or len(data) - 1)) if match else (0, len(data) - 1)
+            body = data[start:end + 1]
+            length = len(body)
+            if file["cut"] is not None and length > file["cut"]:
+                body, file["cut"] = body[:file["cut"]], None
+        handler.send_response(206 if match else 200)
+        if match:
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        handler.send_header("Accept-Ranges", "bytes")
+        handler.send_header("ETag", file["etag"])
+        handler.send_header("Content-Length", str(length))
+        handler.end_headers()
+        handler.wfile.write(body)
+        if len(body) < length:
+            handler.wfile.flush()
+            handler.close_connection = True
+
+    @staticmethod
+    def _normalize(response):
+        if not isinstance(response, tuple):
+            response = (200, json.dumps(response, ensure_ascii=False), "application/json")
+        status, body, content_type = response
+        return status, body.encode("utf-8") if isinstance(body, str) else body, content_type
+
+    def _next(self, raw_path):
+        path = urlsplit(raw_path).path
+        with self._lock:
+            self.requests.append(raw_path)
+            responses = self.routes.get(path)
+            if not responses:
+                return 404, b"not found", "text/plain"
+            response = responses.pop(0) if len(responses) > 1 else responses[0]
+        if callable(response):
+            response = response(dict(parse_qsl(urlsplit(raw_path).query)))
+        return self._normalize(response)
+
+    def url(self, path):
+        return f"http://{self.host}:{self.port}{path}"
+
+    def count(self, path):
+        """某个路径收到的请求数"""
+        with self._lock:
+            return sum(1 for raw_path in self.requests if urlsplit(raw_path).path == path)
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_network(monkeypatch):
+    """测试只能访问本机，解析其他域名直接报错，不会悄悄地去连真的服务器"""
+    getaddrinfo = socket.getaddrinfo
+
+    def local_only(host, *args, **kwargs):
+        if host not in ("127.0.0.1", "localhost", "::1"):
+            raise OSError(f"测试不能访问网络: {host}")
+        return getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(socket, "getaddrinfo", local_only)
+
+
+@pytest.fixture
+def fake_server():
+    server = FakeServer()
+    yield server
+    server.close()
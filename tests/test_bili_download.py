@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+import requests
+
+from easier_tools.easy_session import EasySession
+from easier_tools.ttl_cache import TTLCache
+
+DATA = bytes(range(256)) * 64  # 16KB
+
+
+def playurl(fake_server, video_path, audio_path="/audio.m4s"):
+    return {"code": 0, "data": {"dash": {"video": [{"baseUrl": fake_server.url(video_path)}],
+                                         "audio": [{"baseUrl": fake_server.url(audio_path)}]}}}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    from easier_spider import bilivideo
+
+    cache = TTLCache(maxsize=16, ttl=600)
+    monkeypatch.setattr(bilivideo, "playurl_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def make_video(fake_server, cache):
+    from easier_spider.bilivideo import biliVideo
+
+    def make_video():
+        video = biliVideo("BV1L9Uoa9EUx", session=EasySession())
+        video.cid = 1
+        video.play_url = fake_server.url("/playurl")
+        return video
+    return make_video
+
+
+def download_video(make_video, tmp_path):
+    return make_video().download_video(save_video_path=str(tmp_path), chunk_size=1024, progress=None)
+
+
+def interrupt(make_video, tmp_path):
+    """下载到一半断开，返回.part.json里记下的续传位置"""
+    with pytest.raises(requests.RequestException):
+        download_video(make_video, tmp_path)
+    with open(tmp_path / "BV1L9Uoa9EUx.mp4.part.json") as f:
+        state = json.load(f)
+    assert state["total"] == len(DATA)
+    assert len(state["done"]) == 1 and state["done"][0][0] == 0
+    resume_from = state["done"][0][1] + 1
+    assert 0 < resume_from <= 5000
+    return resume_from
+
+
+def test_interrupted_download_resumes_from_sidecar(make_video, fake_server, tmp_path):
+    fake_server.add("/playurl", playurl(fake_server, "/v1.m4s"))
+    fake_server.add_file("/v1.m4s", DATA, cut=5000)
+    resume_from = interrupt(make_video, tmp_path)
+
+    fake_server.ranges.clear()
+    download_video(make_video, tmp_path)
+    path = tmp_path / "BV1L9Uoa9EUx.mp4"
+    assert path.read_bytes() == DATA
+    assert not os.path.exists(f"{path}.part.json") and not os.path.exists(f"{path}.part")
+    # 续传只请求缺的部分，下载地址从缓存里取，不重新请求playurl
+    assert fake_server.ranges == [("/v1.m4s", "bytes=0-0"), ("/v1.m4s", f"bytes={resume_from}-{len(DATA) - 1}")]
+    assert fake_server.count("/playurl") == 1
+
+
+def test_resume_re_resolves_expired_url(make_video, fake_server, tmp_path):
+    fake_server.add("/playurl", playurl(fake_server, "/v1.m4s"), playurl(fake_server, "/v2.m4s"))
+    fake_server.add_file("/v1.m4s", DATA, cut=5000)
+    resume_from = interrupt(make_video, tmp_path)
+
+    del fake_server.files["/v1.m4s"]  # 旧地址过期了，返回404
+    fake_server.add_file("/v2.m4s", DATA)
+    fake_server.ranges.clear()
+    download_video(make_video, tmp_path)
+    assert (tmp_path / "BV1L9Uoa9EUx.mp4").read_bytes() == DATA
+    assert fake_server.count("/playurl") == 2  # 缓存里的地址过期后绕过缓存换了新地址
+    assert fake_server.ranges == [("/v2.m4s", "bytes=0-0"), ("/v2.m4s", f"bytes={resume_from}-{len(DATA) - 1}")]
+
+
+def test_cached_playurl_is_reused(make_video, fake_server, cache, tmp_path):
+    fake_server.add("/playurl", playurl(fake_server, "/v1.m4s"), playurl(fake_server, "/v2.m4s"))
+    fake_server.add_file("/v1.m4s", DATA)
+    fake_server.add_file("/audio.m4s", DATA[:100])
+
+    first = make_video()
+    first.download_video(save_video_path=str(tmp_path), progress=None)
+    first.download_audio(save_audio_path=str(tmp_path), progress=None)  # 用同一个实例已有的下载信息
+    second = make_video()
+    assert second._get_playurl() == first.down_video_json  # 其他实例从共用的缓存里取
+    assert fake_server.count("/playurl") == 1
+    assert cache.hits == 1
+
+    assert second._get_playurl(use_cache=False)["data"]["dash"]["video"][0]["baseUrl"].endswith("/v2.m4s")
+    assert fake_server.count("/playurl") == 2
@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+from easier_tools.result_sink import SegmentSink
+
+
+def reply(rpid, root=0, rcount=0):
+    return {"rpid": rpid, "root": root, "parent": root, "mid": 1, "member": {"uname": "u"}, "ctime": rpid,
+            "like": 0, "rcount": rcount, "content": {"message": f"m{rpid}"}}
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.url = "https://api.bilibili.com/x"
+
+    def json(self):
+        return self.data
+
+
+class FakeReplyApi:
+    """
+    按游标分页的一级评论和按页码分页的子评论。pages里是每一页的一级评论，
+    可以在两页里放同一条评论，模拟翻页时有新评论把旧评论挤到下一页
+    """
+    limiter = None
+
+    def __init__(self, pages, subs):
+        self.pages = pages
+        self.subs = subs  # root -> 子评论的list
+
+    def get(self, url, headers=None, params=None):
+        if url.endswith("/main"):
+            index = params["next"]
+            if index < len(self.pages) and self.pages[index] is None:
+                return FakeResponse({"code": -400, "message": "请求错误"})
+            data = {"replies": self.pages[index] if index < len(self.pages) else [],
+                    "cursor": {"next": index + 1, "is_end": index + 1 >= len(self.pages)}}
+        else:
+            start = (params["pn"] - 1) * params["ps"]
+            data = {"replies": self.subs[params["root"]][start:start + params["ps"]]}
+        return FakeResponse({"code": 0, "data": data})
+
+
+@pytest.fixture
+def api():
+    subs = {98: [reply(rpid, root=98) for rpid in (200, 201, 202)]}
+    pages = [[reply(100), reply(99)], [reply(99), reply(98, rcount=3)], [reply(97), reply(96)]]
+    return FakeReplyApi(pages, subs)
+
+
+def crawl(api, path, **kwargs):
+    from easier_spider.bilivideo import biliReply
+
+    return biliReply(av=1, session=api).crawl_replies(path=str(path), batch_size=2, **kwargs)
+
+
+def saved_rpids(path):
+    return sorted(SegmentSink(str(path)).to_dataframe()["rpid"].tolist())
+
+
+def test_crawl_replies_dedupes_and_records_newest_root(api, tmp_path):
+    assert crawl(api, tmp_path) == 8
+    assert saved_rpids(tmp_path) == [96, 97, 98, 99, 100, 200, 201, 202]
+    with open(os.path.join(tmp_path, "crawl_state.json")) as f:
+        # 增量游标是最新的一级评论，不是更新的子评论，否则会漏掉rpid在两者之间的新一级评论
+        assert json.load(f) == {"newest_rpid": 100}
+
+
+def test_crawl_replies_incremental(api, tmp_path):
+    crawl(api, tmp_path)
+    api.pages[0].insert(0, reply(101))
+    assert crawl(api, tmp_path) == 1
+    assert saved_rpids(tmp_path)[-4:] == [101, 200, 201, 202]
+
+
+def test_full_recrawl_skips_saved_rows(api, tmp_path):
+    crawl(api, tmp_path)
+    api.pages[-1].append(reply(95))
+    assert crawl(api, tmp_path, incremental=False) == 1
+    assert len(saved_rpids(tmp_path)) == 9
+
+
+def test_interrupted_crawl_keeps_saved_rows(api, tmp_path):
+    api.pages[2] = None  # 第三页出错
+    with pytest.raises(ValueError):
+        crawl(api, tmp_path)
+    assert not os.path.exists(os.path.join(tmp_path, "crawl_state.json"))
+    saved = saved_rpids(tmp_path)
+    assert {98, 99, 100} <= set(saved)
+    api.pages[2] = [reply(97), reply(96)]
+    assert crawl(api, tmp_path) == 8 - len(saved)
+    assert saved_rpids(tmp_path) == [96, 97, 98, 99, 100, 200, 201, 202]
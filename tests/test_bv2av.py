@@ -0,0 +1,47 @@
+import re
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def converter():
+    from easier_spider.bilivideo import BV2AV
+
+    return BV2AV()
+
+
+def test_many_matches_scalar(converter):
+    aids = np.random.default_rng(0).integers(1, converter.MAX_AID, size=10_000, dtype=np.int64)
+    aids[:3] = [1, 170001, converter.MAX_AID - 1]
+    bvids = converter.av2bv_many(aids)
+    assert bvids.tolist() == [converter.av2bv(int(aid)) for aid in aids]
+    assert converter.bv2av_many(bvids).tolist() == [converter.bv2av(bvid) for bvid in bvids] == aids.tolist()
+    assert converter.bv2av_many(bvids.astype("S12")).tolist() == aids.tolist()  # bytes也可以
+
+
+def test_many_keeps_shape(converter):
+    aids = np.array([[111298867365120, 170001], [2, 3]])
+    bvids = converter.av2bv_many(aids)
+    assert bvids.shape == (2, 2)
+    assert bvids[0, 0] == "BV1L9Uoa9EUx"
+    assert converter.bv2av_many(bvids).tolist() == aids.tolist()
+    assert converter.bv2av_many("BV1L9Uoa9EUx").shape == ()
+    assert converter.av2bv_many(np.zeros((0, 3), dtype=np.int64)).shape == (0, 3)
+
+
+@pytest.mark.parametrize("bvids, index", [
+    (["BV1L9Uoa9EUx", "BV1L9Uoa9EU中"], "[1]"),  # 非ASCII
+    (["BV1L9Uoa9EUx", "BV1L9Uoa9EUxé"], "[1]"),  # 太长
+    ([b"BV1L9Uoa9EUx", "BV1L9Uoa9EU\xe9".encode("latin-1")], "[1]"),
+    (["BV1L9Uoa9EUx", "AV1L9Uoa9EUx", "BV1L9Uoa9EU0"], "[1, 2]"),  # 前缀不对、0不在字母表里
+    ([["BV1L9Uoa9EUx", "x"]], "[(0, 1)]"),  # 多维时报告原数组的下标
+])
+def test_bad_bvids_report_index(converter, bvids, index):
+    with pytest.raises(ValueError, match=re.escape(f"第{index}个bv号格式不对")):
+        converter.bv2av_many(bvids)
+
+
+def test_bad_aids_report_index(converter):
+    with pytest.raises(ValueError, match=r"第\[\(1, 0\)\]个av号超出范围"):
+        converter.av2bv_many([[1, 2], [0, 3]])
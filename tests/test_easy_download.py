@@ -0,0 +1,24 @@
+import pytest
+
+from easier_tools.easy_download import PartialDownloadState, split_ranges
+
+
+@pytest.mark.parametrize("total, segments, expected", [
+    (0, 4, []),
+    (-1, 4, []),
+    (1, 4, [(0, 0)]),
+    (10, 3, [(0, 3), (4, 7), (8, 9)]),
+])
+def test_split_ranges(total, segments, expected):
+    assert split_ranges(total, segments, min_segment_size=1) == expected
+
+
+def test_missing_ranges(tmp_path):
+    empty = PartialDownloadState(str(tmp_path / "a.part.json"), "url", 0)
+    assert empty.missing_ranges(4) == []
+    partial = PartialDownloadState(str(tmp_path / "b.part.json"), "url", 10)
+    partial.mark(2, 5)
+    assert partial.missing_ranges(2, min_segment_size=1) == [(0, 1), (6, 9)]
+    partial.mark(0, 1)
+    partial.mark(6, 9)
+    assert partial.missing_ranges(2, min_segment_size=1) == []
@@ -0,0 +1,63 @@
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from easier_tools.epub_writer import EpubWriter, to_xhtml
+
+
+def parse(fragment):
+    return ET.fromstring(f"<div>{to_xhtml(fragment)}</div>")
+
+
+@pytest.mark.parametrize("fragment, expected", [
+    ("a<br>b", "a<br/>b"),
+    ('<img src="img/a.png" class=img>', '<img src="img/a.png" class="img"/>'),
+    ("<hr/>", "<hr/>"),
+    ("&nbsp;&mdash;&copy;&lambda;&rarr;", " —©λ→"),
+    ("a & b < c", "a &amp; b &lt; c"),
+    ("&amp;lt;", "&amp;lt;"),
+    ("<p>一<p>二", "<p>一</p><p>二</p>"),
+    ("<b><i>x</b>", "<b><i>x</i></b>"),
+    ("x</div>", "x"),
+    ("<td nowrap>1", '<td nowrap="nowrap">1</td>'),
+    ('<a href="?a=1&b=2">l</a>', '<a href="?a=1&amp;b=2">l</a>'),
+    ('<p class="a" id="x" class="b">1', '<p class="a" id="x">1</p>'),
+    ('<img src="a.png" SRC="b.png">', '<img src="a.png"/>'),
+])
+def test_to_xhtml(fragment, expected):
+    assert to_xhtml(fragment) == expected
+    parse(fragment)  # 必须是格式良好的xml
+
+
+def test_epub_chapters_are_well_formed(tmp_path):
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "a.png").write_bytes(b"\x89PNG")
+    path = tmp_path / "book.epub"
+    with EpubWriter(str(path), "书 & 名", image_root=str(tmp_path), css="p {}") as epub:
+        epub.add_chapter("第1章", ['<p class="zw">正文&nbsp;一<br>', '<img src="img/a.png" class="img">'])
+        epub.add_chapter("第2章", ["<p>二<p>三", "&hellip;</span>"])
+    with zipfile.ZipFile(path) as z:
+        assert z.namelist()[0] == "mimetype"
+        assert z.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+        assert "OEBPS/img/a.png" in z.namelist()
+        for name in z.namelist():
+            if name.endswith((".xhtml", ".opf", ".xml")):
+                ET.fromstring(z.read(name))
+
+
+def test_images_outside_image_root_are_not_packed(tmp_path):
+    root = tmp_path / "book"
+    (root / "img").mkdir(parents=True)
+    (root / "img" / "a.png").write_bytes(b"\x89PNG")
+    (tmp_path / "secret.txt").write_text("host-only-content")
+    (root / "img" / "link.png").symlink_to(tmp_path / "secret.txt")
+    path = tmp_path / "book.epub"
+    with EpubWriter(str(path), "书", image_root=str(root)) as epub:
+        epub.add_chapter("第1章", [f'<img src="{src}">' for src in
+                                  ("img/a.png", str(tmp_path / "secret.txt"), "../secret.txt",
+                                   "img/../../secret.txt", "img/link.png", "/etc/hostname")])
+    with zipfile.ZipFile(path) as z:
+        packed = [name for name in z.namelist() if not name.endswith((".xhtml", ".opf", ".xml", "mimetype"))]
+        assert packed == ["OEBPS/img/a.png"]
+        assert b"host-only-content" not in b"".join(z.read(name) for name in z.namelist())
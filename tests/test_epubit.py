@@ -0,0 +1,200 @@
+import threading
+
+import pytest
+
+from easier_tools.rate_limiter import AdaptiveRateLimiter, SimulatedClock
+from easier_tools.retry import RetryError, RetryPolicy
+
+pytestmark = pytest.mark.filterwarnings("ignore:第.*次请求失败")  # epubit._warn_retry
+
+
+@pytest.fixture
+def ep(tmp_path, monkeypatch, fake_server):
+    """用模拟时钟限速、重试不真的等待的epubit，接口和图片地址都指向fake_server，结束时关掉图片线程池"""
+    from easier_spider.epubit import epubit
+
+    monkeypatch.chdir(tmp_path)  # 书保存在相对路径output/epubit下
+    clock = SimulatedClock()
+    limiter = AdaptiveRateLimiter(host_rates={fake_server.host: 1}, clock=clock.time, sleep=clock.sleep)
+    retry = RetryPolicy(max_attempts=3, base_delay=1, jitter=False, clock=clock.time, sleep=clock.sleep)
+    book = epubit("pid", "book", limiter=limiter, retry=retry)
+    book.url_content = fake_server.url("/content")
+    book.url_folder_tree = fake_server.url("/tree")
+    book.url_img = fake_server.url("/")
+    yield book
+    book.close()
+
+
+TREE = [
+    {"folderId": "c1", "folderName": "第1章", "children": [
+        {"folderId": "s11", "folderName": "1.1", "children": []},
+        {"folderId": "s12", "folderName": "1.2", "children": None},
+    ]},
+    {"folderId": "c2", "folderName": "第2章"},
+]
+
+
+def test_flatten_folder_tree_is_preorder():
+    from easier_spider.epubit import _flatten_folder_tree
+
+    assert _flatten_folder_tree(TREE) == [("c1", "第1章"), ("s11", "1.1"), ("s12", "1.2"), ("c2", "第2章")]
+
+
+@pytest.mark.parametrize("data", [
+    {"folderId": "c1", "folderName": "第1章"},  # 不是list
+    [{"id": "c1", "name": "第1章"}],  # 字段名不对
+    [{"folderId": "c1", "folderName": "第1章", "childList": [{"id": "s11"}], "children": "s11"}],
+    [{"folderId": "c1", "folderName": "第1章", "children": [{"folderId": "", "folderName": "空"}]}],
+])
+def test_flatten_folder_tree_rejects_unexpected_shape(data):
+    from easier_spider.epubit import _flatten_folder_tree
+
+    with pytest.raises(ValueError):
+        _flatten_folder_tree(data)
+
+
+def test_get_folder_tree(ep, fake_server):
+    fake_server.add("/tree", {"code": "0", "data": TREE})
+    assert [folderId for folderId, _ in ep.get_folder_tree()] == ["c1", "s11", "s12", "c2"]
+
+
+@pytest.mark.parametrize("data", [[], [{"id": "c1", "title": "第1章"}]])
+def test_get_folder_tree_fails_loudly_on_bad_shape(ep, fake_server, data):
+    fake_server.add("/tree", {"code": "0", "data": data})
+    with pytest.raises(RetryError) as info:
+        ep.get_folder_tree()
+    assert info.value.failure["fatal"] is True
+    assert info.value.failure["attempts"] == 1
+
+
+def test_images_are_downloaded_once_and_close_waits(ep, fake_server):
+    fake_server.add("/pubcloud/a.png", (200, b"\x89PNG-a", "image/png"))
+    ep.url_img = fake_server.url("/")
+    with ep:
+        assert ep._submit_img("pubcloud/a.png") == "a.png"
+        ep._submit_img("pubcloud/a.png")
+    assert ep._img_executor is None
+    with open(f"{ep.book_path}/img/a.png", "rb") as f:
+        assert f.read() == b"\x89PNG-a"
+    assert fake_server.count("/pubcloud/a.png") == 1
+
+
+def test_resume_verifies_image_hash(ep, fake_server):
+    from easier_spider.epubit import epubit
+
+    fake_server.add("/pubcloud/a.png", (200, b"\x89PNG-a", "image/png"))
+    fake_server.add("/pubcloud/b.png", (200, b"\x89PNG-b", "image/png"))
+    ep.url_img = fake_server.url("/")
+    with ep:
+        ep._submit_img("pubcloud/a.png")
+        ep._submit_img("pubcloud/b.png")
+    with open(f"{ep.book_path}/img/b.png", "r+b") as f:
+        f.write(b"\x00")  # 大小不变，内容坏了
+
+    with epubit("pid", "book", limiter=ep.limiter, retry=ep.retry) as resumed:
+        resumed.url_img = fake_server.url("/")
+        resumed._submit_img("pubcloud/a.png")
+        resumed._submit_img("pubcloud/b.png")
+    assert fake_server.count("/pubcloud/a.png") == 1  # 完好的跳过
+    assert fake_server.count("/pubcloud/b.png") == 2  # 坏的重新下载
+    with open(f"{ep.book_path}/img/b.png", "rb") as f:
+        assert f.read() == b"\x89PNG-b"
+
+
+CONTENT = {"code": "0", "data": {"contents": [{"editingContent": "<p class=\"zw\">正文</p>"},
+                                               {"editingContent": "pubcloud/x/fig.png"}]}}
+FIG = b"\x89PNG-fig"
+
+
+def downloaded_images(book):
+    """等图片下完，返回manifest.jsonl里有sha256的记录"""
+    from easier_tools.journal import AppendJournal
+
+    book.wait_images()
+    return {record["name"]: record for record in AppendJournal(f"{book.book_path}/img/manifest.jsonl")
+            if "sha256" in record}
+
+
+def test_get_content(ep, fake_server):
+    fake_server.add("/content", CONTENT)
+    fake_server.add("/pubcloud/x/fig.png", (200, FIG, "image/png"))
+    assert ep.get_content("f1") == ['<p class="zw">正文</p>', '<img src="img/fig.png" class="img">']
+    assert "folderId=f1" in fake_server.requests[0]
+    record = downloaded_images(ep)["fig.png"]
+    assert record["src"] == "pubcloud/x/fig.png"
+    assert record["size"] == len(FIG)
+    assert fake_server.count("/pubcloud/x/fig.png") == 1
+
+
+def test_get_content_recovers_after_transient_failures(ep, fake_server):
+    fake_server.add("/content", (200, "<html>请登录</html>", "text/html"), {"code": "1"}, CONTENT)
+    fake_server.add("/pubcloud/x/fig.png", (200, FIG, "image/png"))
+    assert ep.get_content("f1")[0] == '<p class="zw">正文</p>'
+    assert fake_server.count("/content") == 3
+    assert "fig.png" in downloaded_images(ep)
+
+
+@pytest.mark.parametrize("response, error", [
+    ((200, "<html>请登录</html>", "text/html"), "RetryableError"),  # 返回的不是json
+    ({"code": "1", "msg": "操作频繁"}, "操作频繁"),  # code不为'0'
+])
+def test_get_content_failure_is_structured(ep, fake_server, response, error):
+    fake_server.add("/content", response)
+    with pytest.raises(RetryError) as info:
+        ep.get_content("f1")
+    failure = info.value.failure
+    assert failure["key"] == "f1"
+    assert failure["attempts"] == ep.retry.max_attempts == fake_server.count("/content")
+    assert failure["fatal"] is False
+    assert error in failure["error"]
+    assert failure["elapsed"] > 0  # 模拟时钟上的退避和限流等待都算在里面
+
+
+class Book:
+    """
+    假的书：目录里是tree，实际的节是sections(按nextNotNullSection的顺序)，目录里可能漏掉几节。
+    fail里的节前几次请求返回code不为'0'
+    """
+    def __init__(self, fake_server, tree, sections, fail=None):
+        self.sections = sections
+        self.fail = dict(fail or {})
+        self._lock = threading.Lock()
+        fake_server.add("/tree", {"code": "0", "data": [{"folderId": f, "folderName": f} for f in tree]})
+        fake_server.add("/content", self.content)
+        fake_server.add("/next", self.next)
+
+    def content(self, query):
+        folderId = query["folderId"]
+        with self._lock:
+            if self.fail.get(folderId, 0) > 0:
+                self.fail[folderId] -= 1
+                return {"code": "1", "msg": "操作频繁"}
+        return {"code": "0", "data": {"contents": [{"editingContent": f"<p>{folderId}</p>"}]}}
+
+    def next(self, query):
+        i = self.sections.index(query["folderId"]) + 1
+        return {"code": "0", "data": self.sections[i]} if i < len(self.sections) else {"code": "6"}
+
+
+@pytest.fixture
+def tree_ep(ep, fake_server):
+    ep.url_next_section = fake_server.url("/next")
+    return ep
+
+
+@pytest.mark.filterwarnings("ignore:.*稍后按nextNotNullSection补上")
+def test_by_tree_fills_gap_next_to_failure(tree_ep, fake_server):
+    Book(fake_server, ["a", "b", "c", "e"], ["a", "b", "c", "d", "e"], fail={"c": 3})
+    content = tree_ep.get_whole_content_by_tree(concurrency=2)
+    assert content == [f"<p>{f}</p>" for f in "abcde"]
+    assert tree_ep.failures == []
+
+
+def test_by_tree_only_checks_gaps_when_asked(tree_ep, fake_server):
+    Book(fake_server, ["a", "b", "c", "e"], ["a", "b", "c", "d", "e", "f"])
+    assert tree_ep.get_whole_content_by_tree(concurrency=2) == [f"<p>{f}</p>" for f in "abce"]
+    assert fake_server.count("/next") == 0
+
+    content = tree_ep.get_whole_content_by_tree(concurrency=2, check_gaps=True)
+    assert content == [f"<p>{f}</p>" for f in "abcdef"]  # 中间和结尾漏掉的节都补上了
+    assert fake_server.count("/content") == 4 + 2  # 已经获取的节不会重新获取
@@ -0,0 +1,114 @@
+import types
+
+import pytest
+
+from easier_tools.rate_limiter import AdaptiveRateLimiter, SimulatedClock, TokenBucket
+
+
+def make_limiter(clock, **kwargs):
+    kwargs.setdefault("host_rates", {"a.com": 1})
+    return AdaptiveRateLimiter(clock=clock.time, sleep=clock.sleep, **kwargs)
+
+
+def response(status_code, url="https://a.com/x"):
+    return types.SimpleNamespace(status_code=status_code, url=url)
+
+
+def test_token_bucket_refills_at_rate():
+    clock = SimulatedClock()
+    bucket = TokenBucket(2, capacity=1, clock=clock.time, sleep=clock.sleep)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.time() == pytest.approx(0.5)
+    clock.sleep(0.25)
+    assert not bucket.try_acquire()
+    clock.sleep(0.25)
+    assert bucket.try_acquire()
+
+
+def test_token_bucket_caps_idle_tokens_at_capacity():
+    clock = SimulatedClock()
+    bucket = TokenBucket(1, capacity=3, clock=clock.time, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+    clock.sleep(100)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+@pytest.mark.parametrize("status_code", [412, 429])
+def test_throttle_status_halves_rate(status_code):
+    clock = SimulatedClock()
+    limiter = make_limiter(clock)
+    limiter.acquire("https://a.com/x")
+    assert limiter.observe(response(status_code)) is True
+    assert limiter.rates() == {"a.com": pytest.approx(0.5)}
+    assert limiter.throttled == {"a.com": 1}
+
+
+def test_normal_status_is_not_a_throttle():
+    clock = SimulatedClock()
+    limiter = make_limiter(clock, increase=0.1)
+    limiter.acquire("https://a.com/x")
+    assert limiter.observe(response(404)) is False
+    assert limiter.rates() == {"a.com": pytest.approx(1.1)}
+    assert limiter.throttled == {}
+
+
+def test_rate_never_drops_below_min_rate():
+    clock = SimulatedClock()
+    limiter = make_limiter(clock, min_rate=0.2)
+    for _ in range(10):
+        limiter.on_throttle("a.com", cooldown=0)
+    assert limiter.rates()["a.com"] == pytest.approx(0.2)
+
+
+def test_additive_increase_is_capped_at_max_rate():
+    clock = SimulatedClock()
+    limiter = make_limiter(clock, max_rate=1.2, increase=0.05)
+    rates = []
+    for _ in range(10):
+        limiter.on_success("https://a.com/x")
+        rates.append(limiter.rates()["a.com"])
+    assert rates[:4] == pytest.approx([1.05, 1.1, 1.15, 1.2])
+    assert rates[-1] == pytest.approx(1.2)
+
+
+def test_default_max_rate_is_four_times_initial():
+    clock = SimulatedClock()
+    limiter = make_limiter(clock, increase=1)
+    for _ in range(10):
+        limiter.on_success("a.com")
+    assert limiter.rates()["a.com"] == pytest.approx(4)
+
+
+def test_throttle_pauses_host_for_cooldown():
+    clock = SimulatedClock()
+    limiter = make_limiter(clock, cooldown=30)
+    limiter.acquire("https://a.com/x")
+    limiter.on_throttle("https://a.com/x")
+    # 先还清cooldown欠下的令牌，再按降速后的0.5次每秒等一个令牌
+    assert limiter.acquire("https://a.com/y") == pytest.approx(30 + 1 / 0.5)
+    assert limiter.acquire("https://a.com/y") == pytest.approx(1 / 0.5)
+
+
+def test_cooldown_can_be_overridden_per_throttle():
+    clock = SimulatedClock()
+    limiter = make_limiter(clock, cooldown=30)
+    limiter.acquire("a.com")
+    limiter.on_throttle("a.com", cooldown=66)
+    assert limiter.acquire("a.com") == pytest.approx(66 + 2)
+
+
+def test_hosts_are_limited_independently():
+    clock = SimulatedClock()
+    limiter = make_limiter(clock, host_rates={"a.com": 1, "b.com": 1})
+    limiter.acquire("a.com")
+    limiter.on_throttle("a.com", cooldown=100)
+    assert limiter.acquire("b.com") == 0
+    assert limiter.acquire("https://cdn.example.com/v.mp4") == 0  # 没配置速率的host不限速
+    assert limiter.bucket("cdn.example.com") is None
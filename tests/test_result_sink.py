@@ -0,0 +1,23 @@
+import json
+
+from easier_tools.result_sink import SegmentSink
+
+
+def test_segments_are_read_with_their_own_format(tmp_path):
+    SegmentSink(str(tmp_path), fmt="csv").write([{"rpid": 1, "msg": "a"}, {"rpid": 2, "msg": "b"}])
+    sink = SegmentSink(str(tmp_path), fmt="jsonl")  # 比如默认格式改了以后接着写同一个目录
+    sink.write([{"rpid": 3, "msg": "c"}])
+    assert [entry["fmt"] for entry in sink.index] == ["csv", "jsonl"]
+    df = SegmentSink(str(tmp_path)).to_dataframe()
+    assert df["rpid"].tolist() == [1, 2, 3]
+    assert df["msg"].tolist() == ["a", "b", "c"]
+
+
+def test_index_without_fmt_uses_extension(tmp_path):
+    SegmentSink(str(tmp_path), fmt="csv").write([{"rpid": 1}])
+    index_path = tmp_path / SegmentSink.INDEX_NAME
+    entries = [json.loads(line) for line in index_path.read_text(encoding="utf-8").splitlines()]
+    for entry in entries:
+        del entry["fmt"]  # 以前写的index
+    index_path.write_text("".join(json.dumps(entry) + "\n" for entry in entries), encoding="utf-8")
+    assert SegmentSink(str(tmp_path), fmt="jsonl").to_dataframe()["rpid"].tolist() == [1]
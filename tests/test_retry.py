@@ -0,0 +1,112 @@
+import random
+
+import pytest
+import requests
+
+from easier_tools.rate_limiter import SimulatedClock
+from easier_tools.retry import FatalError, RetryableError, RetryError, RetryPolicy
+
+
+class Flaky:
+    """前几次抛出给定的异常，之后返回"ok"，记录调用次数"""
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def make_policy(clock, **kwargs):
+    kwargs.setdefault("jitter", False)
+    return RetryPolicy(clock=clock.time, sleep=clock.sleep, **kwargs)
+
+
+def test_retryable_error_is_retried_with_backoff():
+    clock = SimulatedClock()
+    func = Flaky(RetryableError("限流"), RetryableError("限流"))
+    retries = []
+    policy = make_policy(clock, base_delay=1, factor=2)
+    assert policy.call(func, on_retry=lambda attempt, e, wait: retries.append((attempt, wait))) == "ok"
+    assert func.calls == 3
+    assert retries == [(1, 1), (2, 2)]
+    assert clock.time() == 3
+
+
+@pytest.mark.parametrize("error", [FatalError("不存在"), KeyError("code")])
+def test_non_retryable_error_fails_at_once(error):
+    clock = SimulatedClock()
+    func = Flaky(error)
+    with pytest.raises(RetryError) as info:
+        make_policy(clock).call(func, key="k")
+    assert func.calls == 1
+    assert clock.time() == 0
+    assert info.value.failure == {"key": "k", "error": repr(error), "attempts": 1, "elapsed": 0, "fatal": True}
+    assert info.value.__cause__ is error
+
+
+def test_stops_after_max_attempts():
+    clock = SimulatedClock()
+    func = Flaky(*[RetryableError(i) for i in range(10)])
+    with pytest.raises(RetryError) as info:
+        make_policy(clock, max_attempts=4, base_delay=1, max_delay=3).call(func, key="k")
+    assert func.calls == 4
+    assert clock.time() == 1 + 2 + 3  # 第三次等待被max_delay截断
+    failure = info.value.failure
+    assert (failure["attempts"], failure["fatal"], failure["elapsed"]) == (4, False, 6)
+    assert failure["error"] == repr(RetryableError(3))
+
+
+def test_stops_before_waiting_past_deadline():
+    clock = SimulatedClock()
+    func = Flaky(*[RetryableError(i) for i in range(10)])
+    with pytest.raises(RetryError) as info:
+        make_policy(clock, max_attempts=10, base_delay=10, deadline=25).call(func)
+    # 第一次失败后等10秒；第二次失败时已用10秒，再等20秒会超过25秒，直接放弃
+    assert func.calls == 2
+    assert clock.time() == 10
+    assert info.value.failure["elapsed"] == 10
+    assert info.value.failure["fatal"] is False
+
+
+def test_jitter_stays_within_backoff():
+    policy = RetryPolicy(base_delay=2, max_delay=5, rng=random.Random(0))
+    for attempt, backoff in [(1, 2), (2, 4), (3, 5), (10, 5)]:
+        assert all(0 <= policy.delay(attempt) <= backoff for _ in range(100))
+
+
+def test_max_attempts_must_be_positive():
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
+
+
+def test_http_status_classification_against_local_server(fake_server):
+    fake_server.add("/busy", (503, "busy", "text/plain"), (503, "busy", "text/plain"), {"ok": True})
+    fake_server.add("/missing", (404, "missing", "text/plain"))
+    clock = SimulatedClock()
+    policy = make_policy(clock)
+
+    def get(path):
+        r = requests.get(fake_server.url(path), timeout=5)
+        r.raise_for_status()
+        return r.json()
+
+    assert policy.call(get, "/busy") == {"ok": True}
+    assert fake_server.count("/busy") == 3
+    with pytest.raises(RetryError) as info:
+        policy.call(get, "/missing", key="/missing")
+    assert fake_server.count("/missing") == 1
+    assert info.value.failure["fatal"] is True
+
+
+def test_connection_error_is_retryable(fake_server):
+    url = fake_server.url("/gone")
+    fake_server.close()  # 端口上没有服务了
+    clock = SimulatedClock()
+    with pytest.raises(RetryError) as info:
+        make_policy(clock, max_attempts=2).call(requests.get, url, timeout=5)
+    assert info.value.failure["attempts"] == 2
+    assert info.value.failure["fatal"] is False
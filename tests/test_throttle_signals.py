@@ -0,0 +1,89 @@
+import pytest
+
+from easier_tools.easy_session import EasySession
+from easier_tools.rate_limiter import AdaptiveRateLimiter, SimulatedClock
+
+
+@pytest.fixture
+def clock():
+    return SimulatedClock()
+
+
+@pytest.fixture
+def limiter(clock, fake_server):
+    return AdaptiveRateLimiter(host_rates={fake_server.host: 1}, cooldown=10, clock=clock.time, sleep=clock.sleep)
+
+
+@pytest.fixture
+def ep(tmp_path, monkeypatch, limiter, fake_server):
+    from easier_spider.epubit import epubit
+    from easier_tools.retry import RetryPolicy
+
+    monkeypatch.chdir(tmp_path)  # 书保存在相对路径output/epubit下
+    book = epubit("pid", "book", limiter=limiter, retry=RetryPolicy(max_attempts=1))
+    book.url_content = fake_server.url("/content")
+    return book
+
+
+def test_session_reports_throttle_status(fake_server, limiter):
+    fake_server.add("/x", (412, "", "text/plain"), {"code": 0})
+    session = EasySession(limiter=limiter)
+    session.get(fake_server.url("/x"))
+    assert limiter.throttled == {fake_server.host: 1}
+    assert limiter.rates()[fake_server.host] == pytest.approx(0.5)
+    session.get(fake_server.url("/x"))
+    assert limiter.rates()[fake_server.host] == pytest.approx(0.55)
+
+
+def test_bilivideo_json_decode_failure_is_a_throttle(fake_server, limiter):
+    from easier_spider.bilivideo import _json
+
+    fake_server.add("/nav", (200, "<html>验证码</html>", "text/html"))
+    session = EasySession(limiter=limiter)
+    with pytest.raises(ValueError):
+        _json(session.get(fake_server.url("/nav")), session)
+    assert limiter.throttled == {fake_server.host: 1}
+
+
+def test_bili_login_state_goes_through_json_helper(fake_server, limiter, monkeypatch):
+    from easier_spider.bilivideo import biliLoginState
+
+    fake_server.add("/nav", (200, "<html>验证码</html>", "text/html"))
+    state = biliLoginState(session=EasySession(limiter=limiter))
+    state.url = fake_server.url("/nav")
+    with pytest.raises(ValueError):
+        state.get_login_state()
+    assert limiter.throttled == {fake_server.host: 1}
+
+
+def test_epubit_non_json_body_is_a_throttle(ep, fake_server, limiter, clock):
+    from easier_tools.retry import RetryableError
+
+    fake_server.add("/content", (200, "<html>请登录</html>", "text/html"))
+    with pytest.raises(RetryableError):
+        ep._fetch_content("f1")
+    assert limiter.throttled == {fake_server.host: 1}
+    # 状态码200时会话先按正常返回加速一次，解析失败再乘性减速
+    assert limiter.rates()[fake_server.host] == pytest.approx(1.05 * 0.5)
+    # 返回网页一般是被封了，暂停66秒而不是默认的cooldown
+    assert limiter.acquire(ep.url_content) == pytest.approx(66 + 1 / (1.05 * 0.5))
+
+
+def test_epubit_non_zero_code_is_a_throttle(ep, fake_server, limiter):
+    from easier_tools.retry import RetryableError
+
+    fake_server.add("/content", {"code": "1", "msg": "操作频繁"})
+    with pytest.raises(RetryableError):
+        ep._fetch_content("f1")
+    assert limiter.throttled == {fake_server.host: 1}
+    assert limiter.rates()[fake_server.host] == pytest.approx(1.05 * 0.5)
+
+
+def test_epubit_default_limiter_is_capped_near_old_pacing(tmp_path, monkeypatch):
+    from easier_spider.epubit import epubit
+
+    monkeypatch.chdir(tmp_path)
+    limiter = epubit("pid", "book").limiter
+    for _ in range(100):
+        limiter.on_success("https://labs.epubit.com/x")
+    assert limiter.rates()["labs.epubit.com"] <= 0.2
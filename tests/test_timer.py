@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from easier_tools.timer import Profiler, Timer
+
+
+def test_timer_window_and_totals():
+    timer = Timer(capacity=2)
+    for ns in (1_000_000_000, 2_000_000_000, 3_000_000_000):
+        timer._buffer.append(ns)
+    assert timer.times == [2.0, 3.0]  # 只保留最近2次
+    assert timer.cumsum() == [2.0, 5.0]
+    assert timer.percentile(0) == 2.0
+    assert timer.sum() == 6.0  # 总和和平均包括所有记录
+    assert timer.avg() == 2.0
+
+
+def test_profiler_reset_clears_all_threads():
+    profiler = Profiler(capacity=8)
+    profiler.record("main", 10)
+    worker = threading.Thread(target=profiler.record, args=("worker", 20))
+    worker.start()
+    worker.join()
+    assert sorted(profiler.names()) == ["main", "worker"]
+
+    buffers = profiler._thread_state().buffers
+    profiler.reset()
+    assert profiler.names() == []
+    assert profiler._thread_state().buffers is buffers  # 就地清空
+    with pytest.raises(KeyError):
+        profiler.stats("main")
+
+    with profiler.span("main"):
+        pass
+    assert profiler.stats("main")["count"] == 1
+
+
+def test_wrap_records_worker_spans_under_submitting_span():
+    from concurrent.futures import ThreadPoolExecutor
+
+    profiler = Profiler(capacity=8)
+
+    def fetch():
+        with profiler.span("request"):
+            pass
+
+    with profiler.span("crawl"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for future in [executor.submit(profiler.wrap(fetch)) for _ in range(4)]:
+                future.result()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(fetch).result()  # 不包的话工作线程里是顶层
+    assert sorted(profiler.names()) == ["crawl", "crawl/request", "request"]
+    assert profiler.stats("crawl/request")["count"] == 4
+
+    fetch_outside = profiler.wrap(fetch)
+    assert fetch_outside is fetch  # 外面没有span时原样返回